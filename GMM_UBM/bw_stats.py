@@ -0,0 +1,108 @@
+import hashlib
+import os
+import numpy as np
+
+# UBM 的 Baum-Welch 统计量及其磁盘缓存
+# 每条语音的 0/1/2 阶统计量只计算一次, 保存为 stats_dir/spk_utt.npz
+# 缓存文件中记录 UBM 参数指纹和特征的来源 key, 任一变化时自动重新计算
+# 来源 key 取自特征档案索引中的缓存 key 或 .npy 文件的 (mtime, size), 命中缓存时不读取特征帧
+
+
+def ubm_stats(ubm_model, data):
+    """
+    data: [T x xdim]
+    返回 0阶统计量 N [M, ], 1阶统计量 F [M x xdim], 2阶统计量 S [M x xdim]
+    """
+    data = np.asarray(data, dtype=np.float64)
+    # 计算特征在每个高斯成分上的后验概率 [T x M]
+    posterior_prob = ubm_model.predict_proba(data)
+    N = posterior_prob.sum(axis=0)
+    F = np.dot(posterior_prob.T, data)
+    S = np.dot(posterior_prob.T, data ** 2)
+    return N, F, S
+
+
+def loop_stats(ubm_model, data):
+    # 逐个高斯成分计算统计量 (旧版 GMM_MAP 的循环写法), 只用于检查 ubm_stats
+    data = np.asarray(data, dtype=np.float64)
+    posterior_prob = ubm_model.predict_proba(data)
+    M = ubm_model.n_components
+    N = np.asarray([posterior_prob[:, i].sum() for i in range(M)])
+    F = np.asarray([(posterior_prob[:, i:i + 1] * data).sum(axis=0) for i in range(M)])
+    S = np.asarray([(posterior_prob[:, i:i + 1] * (data ** 2)).sum(axis=0) for i in range(M)])
+    return N, F, S
+
+
+def check_ubm_stats(ubm_model, data, rtol=1e-9):
+    # 同一段数据上 ubm_stats 与逐成分循环的结果不一致时抛出 RuntimeError
+    for name, a, b in zip(('N', 'F', 'S'), loop_stats(ubm_model, data), ubm_stats(ubm_model, data)):
+        if not np.allclose(a, b, rtol=rtol, atol=1e-12):
+            raise RuntimeError("统计量 %s 与逐成分循环的结果不一致, 最大绝对误差 %.3g" % (name, np.max(np.abs(a - b))))
+    print("vectorised N/F/S match the per-component loop (rtol %g)" % rtol)
+
+
+def sum_stats(stats):
+    # 累加多条语音的统计量, stats 为 (N, F, S) 的列表
+    N, F, S = 0, 0, 0
+    for n, f, s in stats:
+        N = N + n
+        F = F + f
+        S = S + s
+    return N, F, S
+
+
+def ubm_fingerprint(ubm_model):
+    h = hashlib.sha1()
+    for param in (ubm_model.weights_, ubm_model.means_, ubm_model.covariances_):
+        h.update(np.ascontiguousarray(param, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def feature_hash(data):
+    return hashlib.sha1(np.ascontiguousarray(data, dtype=np.float32).tobytes()).hexdigest()
+
+
+class StatsStore:
+    def __init__(self, stats_dir, ubm_model):
+        self.stats_dir = stats_dir
+        self.ubm_model = ubm_model
+        self.fingerprint = ubm_fingerprint(ubm_model)
+        os.makedirs(stats_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.stats_dir, key + '.npz')
+
+    def load(self, key, fea_key=None):
+        # 读取缓存的统计量, 不存在或已过期 (UBM 或特征变化) 时返回 None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as cached:
+            if str(cached['ubm']) != self.fingerprint:
+                return None
+            if fea_key is not None and str(cached['fea']) != fea_key:
+                return None
+            return cached['N'], cached['F'], cached['S']
+
+    def save(self, key, stats, fea_key):
+        N, F, S = stats
+        tmp_path = self._path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, N=N, F=F, S=S, ubm=self.fingerprint, fea=fea_key)
+        os.replace(tmp_path, self._path(key))
+
+    def get(self, feats, key):
+        # 返回一条语音的统计量, 优先使用缓存, 只有未命中时才读取特征帧
+        # 特征来源没有 key 时 (旧档案) 退回到对特征内容做哈希
+        fea_key = feats.source_key(key)
+        data = None
+        if fea_key is None:
+            data = feats[key]
+            fea_key = feature_hash(data)
+        stats = self.load(key, fea_key)
+        if stats is None:
+            if data is None:
+                data = feats[key]
+            stats = ubm_stats(self.ubm_model, data)
+            self.save(key, stats, fea_key)
+        return stats
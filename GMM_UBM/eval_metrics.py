@@ -0,0 +1,79 @@
+import numpy as np
+
+# 说话人确认的评价指标: EER, minDCF, DET 曲线
+# 得分排序后一次扫描所有阈值, 只需要 O(n log n) 时间和几个长度为 n 的数组, 可用于上千万条试验
+# 判决规则: 得分 >= 阈值 时接受 (认为是同一说话人)
+
+
+def _sweep_counts(scores, labels):
+    """
+    按得分从高到低扫描, 返回每个不同得分作为阈值时的 (阈值, 虚警数 fp, 命中数 tp, 不同说话人试验数, 同一说话人试验数)
+    """
+    scores = np.asarray(scores)
+    labels = np.asarray(labels).astype(bool)
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order]
+    n_target = int(sorted_labels.sum())
+    n_nontarget = len(sorted_labels) - n_target
+    if n_target == 0 or n_nontarget == 0:
+        raise ValueError("试验中需要同时包含同一说话人和不同说话人的试验")
+
+    # 阈值取相同得分的最后一个位置, 使相同得分的试验同时被接受
+    last = np.r_[np.flatnonzero(np.diff(sorted_scores)), len(sorted_scores) - 1]
+    tp = np.cumsum(sorted_labels, dtype=np.int64)[last]
+    fp = (last + 1) - tp
+    return sorted_scores[last], fp, tp, n_nontarget, n_target
+
+
+def det_sweep(scores, labels):
+    """
+    按得分从高到低扫描, 返回每个不同得分作为阈值时的 (阈值, 虚警率 P_fa, 漏检率 P_miss)
+    开头额外加入阈值 +inf (全部拒绝) 的点
+    """
+    thresholds, fp, tp, n_nontarget, n_target = _sweep_counts(scores, labels)
+    thresholds = np.r_[np.inf, thresholds]
+    p_fa = np.r_[0.0, fp / n_nontarget]
+    p_miss = np.r_[1.0, 1.0 - tp / n_target]
+    return thresholds, p_fa, p_miss
+
+
+def _roc_corners(fp, tp):
+    # sklearn roc_curve (drop_intermediate=True) 保留的阈值: 去掉 ROC 曲线上位于两点连线中间的阈值, 只保留拐点和两端
+    if len(fp) <= 2:
+        return np.arange(len(fp))
+    return np.flatnonzero(np.r_[True, np.logical_or(np.diff(fp, 2), np.diff(tp, 2)), True])
+
+
+def compute_eer_dcf(scores, labels, p_target=0.01, c_miss=1.0, c_fa=1.0):
+    """
+    返回 (eer, eer 阈值, minDCF, minDCF 阈值), minDCF 按 min(c_miss * p_target, c_fa * (1 - p_target)) 归一化
+    EER 在 _roc_corners 保留的阈值 (和 +inf) 中取 |P_miss - P_fa| 最小的一个, 与 eval_score.compute_eer
+    (sklearn roc_curve) 使用相同的工作点, 结果相同
+    DCF 是 P_fa 和 P_miss 的线性函数, 去掉的阈值位于两个保留的阈值之间, minDCF 用全部阈值计算结果不变
+    """
+    thresholds, fp, tp, n_nontarget, n_target = _sweep_counts(scores, labels)
+    corners = _roc_corners(fp, tp)
+    eer_thresholds = np.r_[np.inf, thresholds[corners]]
+    eer_p_fa = np.r_[0.0, fp[corners] / n_nontarget]
+    eer_p_miss = np.r_[1.0, 1.0 - tp[corners] / n_target]
+    i = np.argmin(np.abs(eer_p_miss - eer_p_fa))
+    eer = (eer_p_fa[i] + eer_p_miss[i]) / 2
+
+    thresholds = np.r_[np.inf, thresholds]
+    p_fa = np.r_[0.0, fp / n_nontarget]
+    p_miss = np.r_[1.0, 1.0 - tp / n_target]
+
+    dcf = c_miss * p_target * p_miss + c_fa * (1 - p_target) * p_fa
+    j = np.argmin(dcf)
+    min_dcf = dcf[j] / min(c_miss * p_target, c_fa * (1 - p_target))
+    return eer, eer_thresholds[i], min_dcf, thresholds[j]
+
+
+def det_points(scores, labels, n_points=1000):
+    # 最多 n_points 个 DET 曲线上的点 (阈值, P_fa, P_miss), 用于画图
+    thresholds, p_fa, p_miss = det_sweep(scores, labels)
+    if len(thresholds) > n_points:
+        idx = np.unique(np.linspace(0, len(thresholds) - 1, n_points).astype(int))
+        thresholds, p_fa, p_miss = thresholds[idx], p_fa[idx], p_miss[idx]
+    return thresholds, p_fa, p_miss
@@ -1,7 +1,19 @@
+import argparse
+import hashlib
+import json
 import numpy as np
 import os
-import joblib
+import time
 import sklearn
+import sklearn.metrics
+from collections import OrderedDict
+from multiprocessing import Pool
+from eval_metrics import compute_eer_dcf, det_points
+from fea_archive import open_features
+from gmm_io import load_prepared, model_path
+from gmm_score import PreparedGMM, ubm_top_c, top_c_llr
+from model_bank import SpeakerModelBank
+from score_norm import ScoreNorm
 
 
 def getscore(ubm, gmm, data):
@@ -27,32 +39,238 @@ def compute_eer(label, pred, positive_label=1):
     return eer, eer_threshold
 
 
+class ModelCache:
+    # 说话人模型的 LRU 缓存, load(spk) 返回 PreparedGMM, 最多缓存 capacity 个
+    def __init__(self, load, capacity=64):
+        self.load = load
+        self.capacity = capacity
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, spk):
+        if spk in self.models:
+            self.hits += 1
+            self.models.move_to_end(spk)
+            return self.models[spk]
+        self.misses += 1
+        model = self.load(spk)
+        self.models[spk] = model
+        if len(self.models) > self.capacity:
+            self.models.popitem(last=False)
+        return model
+
+
+def read_trials(path):
+    # var.scp 每行: wav路径 测试说话人 语音 声称的说话人 标签(1 为同一说话人)
+    file_lines = np.loadtxt(path, dtype='str', delimiter=" ", ndmin=2)
+    spks_true = list(file_lines[:, 1])
+    keys = [spk + '_' + utt for spk, utt in zip(spks_true, file_lines[:, 2])]
+    return keys, spks_true, list(file_lines[:, 3]), [int(lab) for lab in file_lines[:, 4]]
+
+
+def score_trials(feats, ubm, models, keys, spks_var, top_c=0, norm=None):
+    """
+    按测试语音分组打分: 每条语音的特征只读取一次, UBM 只计算一次 (top-C 时同时得到每帧的 top-C 成分)
+    ubm 为 PreparedGMM, models 为 ModelCache, 返回与试验顺序一致的得分 [n_trials, ]
+    norm 为 ScoreNorm 时返回 S-norm 规整后的得分, 每条语音的 T-norm 统计量只计算一次
+    """
+    groups = OrderedDict()
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+
+    scores = np.empty(len(keys))
+    for key, trials in groups.items():
+        data = np.asarray(feats[key], dtype=np.float64)
+        if top_c > 0:
+            idx, ubm_frame_llk = ubm_top_c(ubm, data, top_c)
+        else:
+            score_ubm = ubm.score(data)
+        for i in trials:
+            gmm = models.get(spks_var[i])
+            if top_c > 0:
+                scores[i] = top_c_llr(gmm, data, idx, ubm_frame_llk)
+            else:
+                scores[i] = gmm.score(data) - score_ubm
+        if norm is not None:
+            t_mean, t_std = norm.t_stats(ubm, data)
+            scores[trials] = norm.normalize(scores[trials], [spks_var[i] for i in trials], t_mean, t_std)
+    return scores
+
+
+def load_models(path_model):
+    """
+    返回 (UBM 的 PreparedGMM, 由说话人得到 PreparedGMM 的函数)
+    有说话人模型库时 UBM 和说话人模型都从模型库中读取, 否则读取 .gmm 文件 (或 joblib 保存的 .model 文件)
+    """
+    bank_path = os.path.join(path_model, 'spk_bank.npz')
+    if os.path.exists(bank_path):
+        bank = SpeakerModelBank.load(bank_path)
+        ubm = PreparedGMM.from_covars(bank.ubm_weights, bank.ubm_means, bank.ubm_covars)
+        return ubm, lambda spk: PreparedGMM.from_covars(*bank.speaker_params(spk))
+    return load_prepared(path_model, 'ubm'), lambda spk: load_prepared(path_model, spk)
+
+
+def file_stat(path):
+    # 文件的 (mtime, size), 文件不存在时为 None
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def model_files(path_model, spks):
+    # 打分用到的模型文件: 有模型库时只有模型库, 否则为 UBM 和每个说话人的模型文件
+    bank_path = os.path.join(path_model, 'spk_bank.npz')
+    if os.path.exists(bank_path):
+        return [bank_path]
+    return [model_path(path_model, name) for name in ['ubm'] + sorted(set(spks))]
+
+
+# 得分文件: float32 的 .npy, 第 i 个元素为第 i 条试验的得分
+# 同名 .done.npy 为是否已打分的掩码 (uint8), 得分本身为 NaN 的试验不会被重复打分
+# 同名 .json 中记录试验列表, 打分设置, 模型文件和 S-norm 文件 (mtime, size) 的指纹, 不一致时重新建立得分文件
+def trials_fingerprint(keys, spks_var, top_c, snorm=None, path_model=None):
+    h = hashlib.sha1()
+    for key, spk in zip(keys, spks_var):
+        h.update(('%s %s\n' % (key, spk)).encode())
+    h.update(('top_c=%d snorm=%s' % (top_c, snorm)).encode())
+    if path_model is not None:
+        files = model_files(path_model, spks_var)
+        if snorm:
+            files.append(os.path.join(path_model, snorm))
+        for path in files:
+            h.update(('\n%s %s' % (path, file_stat(path))).encode())
+    return h.hexdigest()
+
+
+def done_path(path):
+    return path + '.done.npy'
+
+
+def open_score_file(path, n_trials, fingerprint):
+    # 返回 (得分, 已打分掩码) 两个可写 memmap
+    meta_path = path + '.json'
+    if os.path.exists(path) and os.path.exists(done_path(path)) and os.path.exists(meta_path):
+        with open(meta_path, 'rt') as f:
+            meta = json.load(f)
+        if meta['fingerprint'] == fingerprint and meta['n_trials'] == n_trials:
+            return np.load(path, mmap_mode='r+'), np.load(done_path(path), mmap_mode='r+')
+        print("trial list, scoring options or models changed, rescoring all trials")
+    scores = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n_trials,))
+    scores[:] = np.nan
+    scores.flush()
+    done = np.lib.format.open_memmap(done_path(path), mode='w+', dtype=np.uint8, shape=(n_trials,))
+    done.flush()
+    with open(meta_path, 'wt') as f:
+        json.dump({'fingerprint': fingerprint, 'n_trials': n_trials}, f)
+    return scores, done
+
+
+# worker 进程中的模型和特征, 由 _init_worker 在每个进程中加载一次
+_worker = {}
+
+
+def _init_worker(path_model, fea_path, score_path, cache_size, top_c, snorm=None):
+    ubm, load_spk = load_models(path_model)
+    _worker['norm'] = ScoreNorm.load(os.path.join(path_model, snorm)) if snorm else None
+    _worker['ubm'] = ubm
+    _worker['models'] = ModelCache(load_spk, cache_size)
+    _worker['feats'] = open_features(fea_path)
+    _worker['scores'] = np.load(score_path, mmap_mode='r+')
+    _worker['done'] = np.load(done_path(score_path), mmap_mode='r+')
+    _worker['top_c'] = top_c
+
+
+def _score_job(job):
+    # 给一组试验打分并立即写入得分文件, 中断后重新运行时已写入的试验不再打分
+    trials, keys, spks_var = job
+    scores = score_trials(_worker['feats'], _worker['ubm'], _worker['models'], keys, spks_var,
+                          _worker['top_c'], _worker['norm'])
+    _worker['scores'][trials] = scores
+    _worker['scores'].flush()
+    # 得分写入磁盘后再标记为已打分
+    _worker['done'][trials] = 1
+    _worker['done'].flush()
+    return len(trials)
+
+
+def run_score_file(score_path, keys, spks_var, path_model, fea_path, n_workers=1,
+                   cache_size=64, top_c=0, snorm=None, utts_per_job=16):
+    """
+    按测试语音把未打分的试验分成若干任务, 由 n_workers 个进程并行打分, 得分写入 score_path
+    返回全部试验的得分 (只读 memmap)
+    """
+    fingerprint = trials_fingerprint(keys, spks_var, top_c, snorm, path_model)
+    scores, done = open_score_file(score_path, len(keys), fingerprint)
+    missing = np.flatnonzero(done == 0)
+    del scores, done
+    print("%d of %d trials to score" % (len(missing), len(keys)))
+
+    groups = OrderedDict()
+    for i in missing:
+        groups.setdefault(keys[i], []).append(i)
+    groups = list(groups.values())
+    jobs = []
+    for start in range(0, len(groups), utts_per_job):
+        trials = np.array([i for group in groups[start:start + utts_per_job] for i in group])
+        jobs.append((trials, [keys[i] for i in trials], [spks_var[i] for i in trials]))
+
+    start = time.time()
+    init_args = (path_model, fea_path, score_path, cache_size, top_c, snorm)
+    if n_workers > 1 and len(jobs) > 1:
+        with Pool(processes=n_workers, initializer=_init_worker, initargs=init_args) as pool:
+            for _ in pool.imap_unordered(_score_job, jobs):
+                pass
+    elif jobs:
+        _init_worker(*init_args)
+        for job in jobs:
+            _score_job(job)
+        _worker.clear()
+    print("scored %d trials in %.2fs with %d workers" % (len(missing), time.time() - start, n_workers))
+    return np.load(score_path, mmap_mode='r')
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GMM-UBM 说话人确认评估")
+    parser.add_argument('--top-c', type=int, default=0,
+                        help="快速打分: 每帧只在 UBM 得分最高的 C 个高斯成分上计算 LLR, 0 为全部成分打分")
+    parser.add_argument('--cache-size', type=int, default=64, help="内存中最多缓存的说话人模型数")
+    parser.add_argument('--score-file', default=None,
+                        help="得分文件 (.npy), 指定时多进程打分并写入该文件, 重新运行时只给缺少的试验打分, 不逐条打印得分")
+    parser.add_argument('--workers', type=int, default=1, help="--score-file 模式下的打分进程数")
+    parser.add_argument('--p-target', type=float, default=0.01, help="minDCF 的目标说话人先验概率")
+    parser.add_argument('--snorm', default=None,
+                        help="S-norm 得分规整文件名 (models 下, 由 score_norm.py 生成), 不指定时使用原始 LLR")
+    parser.add_argument('--det', default=None, help="把 DET 曲线上的点 (阈值 P_fa P_miss) 写入该文本文件")
+    args = parser.parse_args()
 
-    # 加载UBM
     path_model = 'models'
-    ubm = joblib.load(os.path.join(path_model, 'ubm.model'))
-
-    # 加载验证数据
     paht_fea = 'fea/TEST'
-    file_lines = np.loadtxt("var.scp", dtype='str', delimiter=" ")
-    spks_true = file_lines[:, 1]
-    utts = file_lines[:, 2]
-    spks_var = file_lines[:, 3]
-    labs = file_lines[:, 4]
-    labs = [int(lab) for lab in labs]
-    scores = []
-    for spk_ture, utt, spk_var, lab in zip(spks_true, utts, spks_var, labs):
-        file_fea = os.path.join(paht_fea, spk_ture + '_' + utt + '.npy')
-        data = np.load(file_fea).T
-
-        gmm = joblib.load(os.path.join(path_model, spk_var + '.model'))
-        score = getscore(ubm, gmm, data)
-        scores.append(score)
-        print(spk_ture, ' ', spk_var, ' ', "%.3f" % (score))
-
-    eer, thred = compute_eer(labs, scores, positive_label=1)
-    print(eer)
-    print(thred)
+    keys, spks_true, spks_var, labs = read_trials("var.scp")
+
+    if args.score_file is not None:
+        scores = run_score_file(args.score_file, keys, spks_var, path_model, paht_fea,
+                                args.workers, args.cache_size, args.top_c, args.snorm)
+    else:
+        ubm, load_spk = load_models(path_model)
+        models = ModelCache(load_spk, args.cache_size)
+        feats = open_features(paht_fea)
+        norm = ScoreNorm.load(os.path.join(path_model, args.snorm)) if args.snorm else None
+        if norm is not None and norm.top_c != args.top_c:
+            print("warning: s-norm stats computed with --top-c %d, scoring with --top-c %d" % (norm.top_c, args.top_c))
 
+        start = time.time()
+        scores = score_trials(feats, ubm, models, keys, spks_var, args.top_c, norm)
+        for spk_ture, spk_var, score in zip(spks_true, spks_var, scores):
+            print(spk_ture, ' ', spk_var, ' ', "%.3f" % (score))
+        print("scored %d trials of %d utterances in %.2fs, model cache: %d hits, %d loads"
+              % (len(keys), len(set(keys)), time.time() - start, models.hits, models.misses))
 
+    eer, thred, min_dcf, dcf_thred = compute_eer_dcf(scores, labs, args.p_target)
+    print(eer)
+    print(thred)
+    print("minDCF (p_target=%g): %.4f at threshold %.3f" % (args.p_target, min_dcf, dcf_thred))
+    if args.det is not None:
+        np.savetxt(args.det, np.column_stack(det_points(scores, labs)), fmt='%.6g',
+                   header='threshold p_fa p_miss')
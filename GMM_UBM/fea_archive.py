@@ -0,0 +1,217 @@
+import json
+import os
+import numpy as np
+
+# 打包特征档案
+# xxx.ark: 所有语音的特征帧按行连续存放, float32, [总帧数 x 特征维度]
+# xxx.idx: json 索引, 记录每条语音 (spk_utt) 的起始帧和帧数
+# xxx.eng: 可选, 每帧能量 (dB), float32, 与 .ark 中的帧一一对应
+# 读取时使用 np.memmap, 按语音取出的特征是档案的切片, 不发生拷贝
+ARCHIVE_VERSION = 1
+
+
+def archive_paths(path):
+    # path 可以是 'fea/TRAIN' 或 'fea/TRAIN.ark'
+    if path.endswith('.ark'):
+        path = path[:-4]
+    path = path.rstrip('/\\')
+    return path + '.ark', path + '.idx'
+
+
+def energy_path(path):
+    return archive_paths(path)[0][:-4] + '.eng'
+
+
+class FeatureArchiveWriter:
+    def __init__(self, path, with_energy=False):
+        self.data_path, self.index_path = archive_paths(path)
+        self.energy_path = energy_path(path)
+        # 先写临时文件, close 时再替换, 写入过程中旧档案仍然可读
+        self._tmp_data_path = self.data_path + '.tmp'
+        self._f = open(self._tmp_data_path, 'wb')
+        self.with_energy = with_energy
+        self._ef = open(self.energy_path + '.tmp', 'wb') if with_energy else None
+        self.dim = None
+        self.n_frames = 0
+        self.index = {}
+
+    def write(self, key, frames, cache_key=None, energy=None, wav=None):
+        """
+        写入一条语音的特征
+        frames: [T x 特征维度]
+        cache_key: 特征缓存的 key, 下次提取时用于判断是否可以复用
+        energy: [T, ] 每帧能量, with_energy 为 True 时必须提供
+        wav: 音频信息 (fea_cache.cache_key 的返回值), 下次提取时音频未变化则不再计算哈希
+        """
+        if key in self.index:
+            raise ValueError("重复的语音: %s" % key)
+        frames = np.ascontiguousarray(frames, dtype=np.float32)
+        if frames.ndim != 2:
+            raise ValueError("特征必须是二维数组, 实际形状 %s" % (frames.shape,))
+        if self.dim is None:
+            self.dim = frames.shape[1]
+        elif frames.shape[1] != self.dim:
+            raise ValueError("特征维度不一致: %d != %d" % (frames.shape[1], self.dim))
+
+        if self.with_energy:
+            if energy is None or len(energy) != frames.shape[0]:
+                raise ValueError("语音 %s 的帧能量缺失或长度与特征不一致" % key)
+            np.asarray(energy, dtype=np.float32).tofile(self._ef)
+
+        frames.tofile(self._f)
+        self.index[key] = {'offset': self.n_frames, 'frames': frames.shape[0], 'key': cache_key, 'wav': wav}
+        self.n_frames += frames.shape[0]
+
+    def close(self):
+        self._f.close()
+        if self._ef is not None:
+            self._ef.close()
+        header = {'version': ARCHIVE_VERSION,
+                  'dtype': 'float32',
+                  'dim': self.dim or 0,
+                  'frames': self.n_frames,
+                  'energy': self.with_energy,
+                  'index': self.index}
+        tmp_index_path = self.index_path + '.tmp'
+        with open(tmp_index_path, 'wt') as f:
+            json.dump(header, f)
+        # 先替换数据再替换索引
+        os.replace(self._tmp_data_path, self.data_path)
+        if self._ef is not None:
+            os.replace(self.energy_path + '.tmp', self.energy_path)
+        os.replace(tmp_index_path, self.index_path)
+
+    def abort(self):
+        # 丢弃未完成的档案, 保留旧档案
+        self._f.close()
+        if self._ef is not None:
+            self._ef.close()
+        for tmp_path in (self._tmp_data_path, self.energy_path + '.tmp'):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class FeatureArchive:
+    def __init__(self, path):
+        self.data_path, self.index_path = archive_paths(path)
+        with open(self.index_path, 'rt') as f:
+            header = json.load(f)
+        if header.get('version') != ARCHIVE_VERSION:
+            raise ValueError("不支持的特征档案版本: %s" % header.get('version'))
+        self.dim = header['dim']
+        self.n_frames = header['frames']
+        self.index = header['index']
+        self.energy_data = None
+        if self.n_frames > 0:
+            self.data = np.memmap(self.data_path, dtype=np.dtype(header['dtype']), mode='r',
+                                  shape=(self.n_frames, self.dim))
+            if header.get('energy'):
+                self.energy_data = np.memmap(energy_path(path), dtype=np.float32, mode='r',
+                                             shape=(self.n_frames,))
+        else:
+            # 空文件无法 mmap
+            self.data = np.zeros((0, self.dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, key):
+        # 返回 [T x 特征维度] 的 memmap 切片
+        entry = self.index[key]
+        return self.data[entry['offset']:entry['offset'] + entry['frames']]
+
+    def energy(self, key):
+        # 返回 [T, ] 的帧能量切片, 档案中没有帧能量时返回 None
+        if self.energy_data is None:
+            return None
+        entry = self.index[key]
+        return self.energy_data[entry['offset']:entry['offset'] + entry['frames']]
+
+    def cache_key(self, key):
+        entry = self.index.get(key)
+        return entry['key'] if entry is not None else None
+
+    def wav(self, key):
+        entry = self.index.get(key)
+        return entry.get('wav') if entry is not None else None
+
+    def source_key(self, key):
+        # 标识一条语音特征内容的 key (提取时的缓存 key), 不读取特征帧, 旧档案中没有时返回 None
+        entry = self.index[key]
+        return 'ark:' + entry['key'] if entry.get('key') else None
+
+    def all_frames(self):
+        # 整个档案作为一个 [总帧数 x 特征维度] 数组, 不拼接
+        return self.data
+
+    def frames(self, keys):
+        """
+        多条语音的特征按顺序拼接为 [T x 特征维度]
+        这些语音在档案中连续存放时直接返回切片, 不拼接
+        """
+        entries = [self.index[key] for key in keys]
+        if not entries:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        contiguous = all(b['offset'] == a['offset'] + a['frames'] for a, b in zip(entries[:-1], entries[1:]))
+        if contiguous:
+            start = entries[0]['offset']
+            end = entries[-1]['offset'] + entries[-1]['frames']
+            return self.data[start:end]
+        return np.concatenate([self[key] for key in keys], axis=0)
+
+    def close(self):
+        self.data = None
+        self.energy_data = None
+
+
+class NpyFeatureDir:
+    # 逐句 .npy 特征目录, 与 FeatureArchive 接口一致
+    def __init__(self, path):
+        self.path = path
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path, key + '.npy'))
+
+    def __getitem__(self, key):
+        # .npy 中保存的是 [特征维度 x T], 转置为 [T x 特征维度]
+        # 以 mmap 方式打开, 只在用到时读取
+        return np.load(os.path.join(self.path, key + '.npy'), mmap_mode='r').T
+
+    def source_key(self, key):
+        # 由 .npy 文件的 (mtime, size) 标识特征内容, 不读取特征帧
+        st = os.stat(os.path.join(self.path, key + '.npy'))
+        return 'npy:%d:%d' % (st.st_mtime_ns, st.st_size)
+
+    def energy(self, key):
+        # 帧能量保存在 spk_utt.energy.npy 中, 不存在时返回 None
+        path = os.path.join(self.path, key + '.energy.npy')
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def frames(self, keys):
+        return np.concatenate([self[key] for key in keys], axis=0)
+
+
+def open_features(path):
+    # path 对应的 .ark 档案存在时读取档案, 否则读取逐句 .npy 目录
+    data_path, index_path = archive_paths(path)
+    if os.path.exists(index_path):
+        print("load feature archive", data_path)
+        return FeatureArchive(path)
+    return NpyFeatureDir(path)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+# 特征缓存: 每个特征目录下保存一个清单文件
+# 清单记录 特征文件名 -> {key, frames, wav}
+# key = sha1(特征参数指纹 + 音频内容哈希), 音频或参数变化时 key 随之变化
+# wav = {stat: [size, mtime_ns], hash: 音频内容哈希}, 音频的大小和修改时间都未变化时直接使用记录的哈希, 不再读取音频
+MANIFEST_NAME = '.fea_cache.json'
+
+# MFCC 提取参数
+MFCC_PARAMS = dict(n_mfcc=19,
+                   n_fft=512,
+                   hop_length=160,
+                   win_length=320,
+                   n_mels=20
+                   )
+
+# 完整的特征配置, 用于生成缓存指纹; 修改特征流程时需要同步修改这里
+# 放在本模块 (不依赖 librosa) 中, 训练脚本只需要指纹时不必导入 feature_extract
+FEATURE_CONFIG = dict(MFCC_PARAMS,
+                      normalize=True,
+                      delta_orders=[1, 2],
+                      frame_energy='c0_db'
+                      )
+
+
+def config_fingerprint(config):
+    # 特征提取参数的指纹, 参数字典按键排序后哈希
+    text = json.dumps(config, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def file_hash(path, block_size=1 << 20):
+    # 音频文件内容的哈希, 分块读取
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def cache_key(path, fingerprint, wav=None):
+    """
+    返回 (key, 音频信息 {stat, hash})
+    wav 为上次记录的音频信息, 大小和修改时间都未变化时沿用其中的内容哈希, 否则重新计算
+    """
+    stat = file_stat(path)
+    if wav is not None and wav.get('stat') == stat:
+        content_hash = wav['hash']
+    else:
+        content_hash = file_hash(path)
+    key = hashlib.sha1((fingerprint + content_hash).encode('utf-8')).hexdigest()
+    return key, {'stat': stat, 'hash': content_hash}
+
+
+class FeatureCache:
+    def __init__(self, fea_path):
+        self.fea_path = fea_path
+        self.manifest_path = os.path.join(fea_path, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'rt') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                # 清单损坏时全部重新提取
+                print("缓存清单读取失败, 忽略缓存:", e)
+                self.entries = {}
+
+    def lookup(self, name, *extra_names):
+        # 返回特征文件对应的 key, 特征文件或附带的文件 (extra_names) 不存在时视为无缓存
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        for n in (name,) + extra_names:
+            if not os.path.exists(os.path.join(self.fea_path, n)):
+                return None
+        return entry['key']
+
+    def frames(self, name):
+        return self.entries[name]['frames']
+
+    def wav(self, name):
+        # 上次记录的音频信息, 旧清单中没有时返回 None
+        entry = self.entries.get(name)
+        return entry.get('wav') if entry is not None else None
+
+    def update(self, name, key, frames, wav=None):
+        self.entries[name] = {'key': key, 'frames': int(frames), 'wav': wav}
+
+    def save(self):
+        # 先写临时文件再替换, 避免中断时留下损坏的清单
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'wt') as f:
+            json.dump(self.entries, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
@@ -1,80 +1,161 @@
 import librosa
 import os
+import time
+import argparse
 import numpy as np
+from multiprocessing import Pool
+from fea_cache import FeatureCache, MFCC_PARAMS, FEATURE_CONFIG, config_fingerprint, cache_key
+from fea_archive import FeatureArchive, FeatureArchiveWriter, archive_paths
+from mfcc import MFCCEngine
+
+# 默认的 (scp, 特征输出目录) 列表: UBM特征 和 test数据特征
+DEFAULT_JOBS = [('ubm_wav.scp', 'fea/TRAIN'),
+                ('test.scp', 'fea/TEST')]
+
+
+def compute_mfcc(y, fs, return_energy=False):
+    # 进行MFCC特征的提取 (mfcc.MFCCEngine, 结果与 librosa 的 mfcc + normalize + delta 相同)
+    # 每帧能量: 归一化会去掉 c0 中的能量信息, 先把 c0 换算为梅尔谱的平均对数能量 (dB)
+    # 用于 UBM 训练前的静音帧筛选
+    fea_mfcc, energy = MFCCEngine.get(fs, **MFCC_PARAMS).extract(y, return_energy=True)
+
+    # 最终的MFCC特征 [3*n_mfcc x T]
+    fea_mfcc = np.ascontiguousarray(fea_mfcc.T)
+    if return_energy:
+        return fea_mfcc, energy
+    return fea_mfcc
+
+
+def extract_one(job):
+    # 单个文件的提取任务, 在工作进程中执行
+    # 音频内容与参数都未变化时跳过, 返回 (key, 音频信息, None)
+    # 音频的大小和修改时间与上次记录 (cached_wav) 相同时不读取音频计算哈希
+    # file_fea 不为空时保存 .npy 和帧能量 .energy.npy, 只返回帧数, 避免把特征矩阵传回主进程
+    # file_fea 为空 (写入档案) 时返回 ([T x 特征维度] 的特征, 帧能量)
+    file, file_fea, fingerprint, cached_key, cached_wav = job
+    key, wav = cache_key(file, fingerprint, cached_wav)
+    if key == cached_key:
+        return key, wav, None
+    y, fs = librosa.load(file, sr=None, mono=True)
+    fea_mfcc, energy = compute_mfcc(y, fs, return_energy=True)
+    if file_fea is None:
+        return key, wav, (fea_mfcc.T.astype(np.float32), energy)
+    np.save(file=file_fea, arr=fea_mfcc)
+    np.save(file=file_fea[:-len(".npy")] + ".energy.npy", arr=energy)
+    return key, wav, fea_mfcc.shape[1]
+
+
+def read_scp(scp):
+    # scp 每行: wav路径 说话人 语音id
+    file_lines = np.loadtxt(scp, dtype='str', delimiter=" ", ndmin=2)
+    return file_lines[:, 0], file_lines[:, 1], file_lines[:, 2]
+
+
+def extract_scp(scp, fea_path, n_workers=1, chunk_size=4, use_cache=True, archive=False):
+    """
+    提取 scp 中所有语音的特征, 保存为 fea_path/spk_utt.npy
+    archive 为 True 时改为写入打包档案 fea_path.ark / fea_path.idx
+    n_workers > 1 时使用进程池并行提取, chunk_size 为每次分给一个进程的文件数
+    use_cache 为 True 时, 音频内容和特征参数都未变化的语音直接跳过
+    返回 (文件数, 总帧数)
+    """
+    files, spk_ids, utt_ids = read_scp(scp)
+    names = [spk + "_" + utt for spk, utt in zip(spk_ids, utt_ids)]
+    fingerprint = config_fingerprint(FEATURE_CONFIG)
+
+    cache, old_archive, writer = None, None, None
+    if archive:
+        # 档案模式下缓存 key 记录在档案索引中, 未变化的语音从旧档案中复制
+        data_path, index_path = archive_paths(fea_path)
+        os.makedirs(os.path.dirname(data_path) or '.', exist_ok=True)
+        if use_cache and os.path.exists(index_path):
+            old_archive = FeatureArchive(fea_path)
+        jobs = [(file, None, fingerprint, old_archive.cache_key(name) if old_archive else None,
+                 old_archive.wav(name) if old_archive else None)
+                for file, name in zip(files, names)]
+        writer = FeatureArchiveWriter(fea_path, with_energy=True)
+    else:
+        os.makedirs(fea_path, exist_ok=True)
+        cache = FeatureCache(fea_path)
+        jobs = [(file, os.path.join(fea_path, name + ".npy"), fingerprint,
+                 cache.lookup(name + ".npy", name + ".energy.npy") if use_cache else None,
+                 cache.wav(name + ".npy"))
+                for file, name in zip(files, names)]
+
+    start = time.time()
+    n_frames = 0
+    n_cached = 0
+    if n_workers > 1:
+        pool = Pool(processes=n_workers)
+        results = pool.imap(extract_one, jobs, chunksize=chunk_size)
+    else:
+        pool = None
+        results = map(extract_one, jobs)
+    try:
+        for name, (key, wav, result) in zip(names, results):
+            if result is None:
+                n_cached += 1
+            if writer is not None:
+                if result is None:
+                    fea, energy = old_archive[name], old_archive.energy(name)
+                else:
+                    fea, energy = result
+                writer.write(name, fea, cache_key=key, energy=energy, wav=wav)
+                T = fea.shape[0]
+            else:
+                if result is None:
+                    T = cache.frames(name + ".npy")
+                else:
+                    T = result
+                    print("save_file ", os.path.join(fea_path, name + ".npy"))
+                cache.update(name + ".npy", key, T, wav)
+            n_frames += T
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # 中断时也保存已完成的部分
+        if cache is not None:
+            cache.save()
+
+    if writer is not None:
+        if old_archive is not None:
+            old_archive.close()
+        writer.close()
+        print("save_archive ", writer.data_path)
+    elapsed = max(time.time() - start, 1e-6)
+
+    print("%s: %d files (%d cached), %d frames, %.2fs, %.1f files/s, %.1f frames/s (workers=%d)"
+          % (scp, len(jobs), n_cached, n_frames, elapsed, len(jobs) / elapsed, n_frames / elapsed, n_workers))
+    return len(jobs), n_frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并行提取 MFCC 特征")
+    parser.add_argument('--scp', help="输入 scp 文件, 不指定时提取 ubm_wav.scp 和 test.scp")
+    parser.add_argument('--out', help="特征输出目录 (与 --scp 一起使用)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="进程数")
+    parser.add_argument('--chunk-size', type=int, default=4, help="每个任务包含的文件数")
+    parser.add_argument('--no-cache', action='store_true', help="忽略缓存, 重新提取全部语音")
+    parser.add_argument('--archive', action='store_true', help="写入打包档案 <out>.ark 代替逐句 .npy")
+    args = parser.parse_args()
+
+    if args.scp:
+        if not args.out:
+            parser.error("--scp 需要同时指定 --out")
+        jobs = [(args.scp, args.out)]
+    else:
+        jobs = DEFAULT_JOBS
+
+    for scp, fea_path in jobs:
+        extract_scp(scp, fea_path, n_workers=args.workers, chunk_size=args.chunk_size,
+                    use_cache=not args.no_cache, archive=args.archive)
+
 
-# 提取 UBM特征
-
-fea_train_path = "fea/TRAIN"
-os.makedirs(fea_train_path,exist_ok=True)
-
-file_lines = np.loadtxt('ubm_wav.scp',dtype='str',delimiter=" ")
-files= file_lines[:,0]
-spk_ids = file_lines[:,1]
-utt_ids = file_lines[:,2]
-
-for file,spk,utt in zip(files,spk_ids,utt_ids):
-    # 读取音频文件
-    y,fs = librosa.load(file,sr=None, mono=True)
-
-    # 进行MFCC特征的提取
-    raw_mfcc = librosa.feature.mfcc(y=y,
-                                   sr=fs,
-                                   n_mfcc=19,
-                                   n_fft=512,
-                                   hop_length=160,
-                                   win_length=320,
-                                   n_mels=20
-                                   )
-    # 增加动态特征
-    raw_mfcc = librosa.util.normalize(raw_mfcc)
-    mfcc_delta = librosa.feature.delta(raw_mfcc)
-    mfcc_delta2 = librosa.feature.delta(raw_mfcc, order=2)
-
-    # 拼接生成最终的MFCC特征
-    fea_mfcc = np.concatenate([raw_mfcc,mfcc_delta,mfcc_delta2],axis=0)
-
-    # fea_mean = np.mean(fea_mfcc,axis=1,keepdims=True)
-    # fea_std = np.std(fea_mfcc,axis=1,keepdims=True)
-    # fea_mfcc = fea_mfcc-
-
-    file_fea = os.path.join(fea_train_path,spk+"_"+utt+".npy")
-    np.save(file=file_fea,arr=fea_mfcc)
-    print("save_file ",file_fea)
-
-
-# 提取 test数据特征
-
-fea_train_path = "fea/TEST"
-os.makedirs(fea_train_path,exist_ok=True)
-
-file_lines = np.loadtxt('test.scp',dtype='str',delimiter=" ")
-files= file_lines[:,0]
-spk_ids = file_lines[:,1]
-utt_ids = file_lines[:,2]
-
-for file,spk,utt in zip(files,spk_ids,utt_ids):
-    # 读取音频文件
-    y,fs = librosa.load(file,sr=None, mono=True)
-
-    # 进行MFCC特征的提取
-    raw_mfcc = librosa.feature.mfcc(y=y,
-                                   sr=fs,
-                                   n_mfcc=19,
-                                   n_fft=512,
-                                   hop_length=160,
-                                   win_length=320,
-                                   n_mels=20
-                                   )
-    # 增加动态特征
-    raw_mfcc = librosa.util.normalize(raw_mfcc)
-    mfcc_delta = librosa.feature.delta(raw_mfcc)
-    mfcc_delta2 = librosa.feature.delta(raw_mfcc, order=2)
-
-    # 拼接生成最终的MFCC特征
-    fea_mfcc = np.concatenate([raw_mfcc,mfcc_delta,mfcc_delta2],axis=0)
-    file_fea = os.path.join(fea_train_path,spk+"_"+utt+".npy")
-    np.save(file=file_fea,arr=fea_mfcc)
-    print("save_file ",file_fea)
 #
 # import numpy as np
 # import matplotlib.pyplot as plt
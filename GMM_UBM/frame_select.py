@@ -0,0 +1,94 @@
+import numpy as np
+
+# UBM 训练数据的帧筛选, 位于特征读取和 EM 之间
+# 1. 能量 VAD: 丢弃能量比本句最大能量低 vad_db 分贝以上的帧 (静音)
+# 2. 定比抽帧: 每 decimate 帧保留 1 帧, 去掉 10ms 帧移下高度相似的相邻帧
+# 3. 说话人上限: 每个说话人最多保留 max_frames_per_spk 帧, 超出时各句按相同比例等间隔抽取
+
+
+class FrameSelector:
+    def __init__(self, vad_db=None, decimate=1, max_frames_per_spk=None):
+        if decimate < 1:
+            raise ValueError("decimate 必须 >= 1")
+        self.vad_db = vad_db
+        self.decimate = decimate
+        self.max_frames_per_spk = max_frames_per_spk
+        # 每句的保留比例, 由 plan() 根据说话人上限计算
+        self.ratios = {}
+        self.n_selected = None
+
+    def to_config(self):
+        # 保存筛选参数和 plan() 的结果, 供其他进程 (如分片 EM 的 worker) 使用相同的筛选
+        return {'vad_db': self.vad_db,
+                'decimate': self.decimate,
+                'max_frames_per_spk': self.max_frames_per_spk,
+                'ratios': self.ratios}
+
+    @classmethod
+    def from_config(cls, config):
+        selector = cls(config['vad_db'], config['decimate'], config['max_frames_per_spk'])
+        selector.ratios = config['ratios']
+        return selector
+
+    def enabled(self):
+        return self.vad_db is not None or self.decimate > 1 or self.max_frames_per_spk is not None
+
+    def _vad_index(self, feats, key, T):
+        idx = np.arange(T)
+        if self.vad_db is not None and T > 0:
+            energy = feats.energy(key)
+            if energy is None:
+                raise ValueError("特征 %s 没有帧能量, 请重新运行 feature_extract.py 后再使用 VAD" % key)
+            energy = np.asarray(energy)
+            idx = idx[energy > energy.max() - self.vad_db]
+        return idx
+
+    def plan(self, feats, keys, spks):
+        """
+        统计各步骤保留的帧数并打印, 计算说话人上限对应的每句保留比例
+        keys 与 spks 一一对应, 返回最终保留的总帧数
+        """
+        n_total, n_vad, n_dec = 0, 0, 0
+        kept = {}
+        spk_frames = {}
+        for key, spk in zip(keys, spks):
+            T = feats[key].shape[0]
+            idx = self._vad_index(feats, key, T)
+            n = len(idx[::self.decimate])
+            n_total += T
+            n_vad += len(idx)
+            n_dec += n
+            kept[key] = n
+            spk_frames[spk] = spk_frames.get(spk, 0) + n
+
+        self.ratios = {}
+        n_selected = n_dec
+        if self.max_frames_per_spk is not None:
+            n_selected = 0
+            for key, spk in zip(keys, spks):
+                ratio = min(1.0, self.max_frames_per_spk / max(spk_frames[spk], 1))
+                self.ratios[key] = ratio
+                n_selected += int(round(kept[key] * ratio))
+
+        pct = lambda n: 100.0 * n / max(n_total, 1)
+        print("frame selection: total %d" % n_total)
+        if self.vad_db is not None:
+            print("  vad (%.1f dB): %d (%.1f%%)" % (self.vad_db, n_vad, pct(n_vad)))
+        if self.decimate > 1:
+            print("  decimate 1/%d: %d (%.1f%%)" % (self.decimate, n_dec, pct(n_dec)))
+        if self.max_frames_per_spk is not None:
+            print("  max %d frames/spk: %d (%.1f%%)" % (self.max_frames_per_spk, n_selected, pct(n_selected)))
+        print("  kept %d of %d frames (%.1f%%)" % (n_selected, n_total, pct(n_selected)))
+        self.n_selected = n_selected
+        return n_selected
+
+    def apply(self, feats, key, data):
+        # 返回 data ([T x 特征维度]) 中保留的帧, 不做筛选时直接返回 data
+        if not self.enabled():
+            return data
+        idx = self._vad_index(feats, key, data.shape[0])[::self.decimate]
+        ratio = self.ratios.get(key, 1.0)
+        if ratio < 1.0:
+            n = int(round(len(idx) * ratio))
+            idx = idx[np.linspace(0, len(idx) - 1, n).astype(int)] if n > 0 else idx[:0]
+        return data[idx]
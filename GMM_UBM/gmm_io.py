@@ -0,0 +1,143 @@
+import json
+import os
+import struct
+import joblib
+import numpy as np
+from gmm_score import PreparedGMM
+from ubm_em import make_gmm
+
+# GMM 模型文件 (.gmm), 代替 joblib 保存的 sklearn 对象
+# 数组以只读 memmap 方式读取, 加载只需读取头部, 多个进程共享同一份页面缓存, 也不依赖 sklearn 的版本
+# 文件结构:
+#   8 字节魔数 b'GMMDIAG\0' | uint32 版本 | uint32 头部长度 | JSON 头部 | 补齐到 64 字节 | 各数组 (float64, C 顺序, 64 字节对齐)
+# JSON 头部: {"n_components", "n_features", "feature_fingerprint", "arrays": {名字: [偏移, 形状]}}
+# 数组: weights [M], means [M x D], precisions [M x D] (对角方差的倒数), log_det [M] (log|Sigma_i|)
+MAGIC = b'GMMDIAG\0'
+GMM_FORMAT_VERSION = 1
+ALIGN = 64
+GMM_ARRAYS = ('weights', 'means', 'precisions', 'log_det')
+
+
+class GMMFile:
+    def __init__(self, weights, means, precisions, log_det, feature_fingerprint=None):
+        self.weights = weights
+        self.means = means
+        self.precisions = precisions
+        self.log_det = log_det
+        self.feature_fingerprint = feature_fingerprint
+
+    @classmethod
+    def from_covars(cls, weights, means, covars, feature_fingerprint=None):
+        covars = np.asarray(covars, dtype=np.float64)
+        return cls(weights, means, 1.0 / covars, np.sum(np.log(covars), axis=-1), feature_fingerprint)
+
+    @classmethod
+    def from_sklearn(cls, gmm, feature_fingerprint=None):
+        # joblib 保存的 GaussianMixture, 精度由 precisions_cholesky_ 得到, 与 gmm.score 使用的参数一致
+        precisions = gmm.precisions_cholesky_ ** 2
+        return cls(gmm.weights_, gmm.means_, precisions, -np.sum(np.log(precisions), axis=1), feature_fingerprint)
+
+    @property
+    def covars(self):
+        return 1.0 / self.precisions
+
+    def prepared(self):
+        # 打分用的 PreparedGMM, 直接使用映射的 precisions 和 log_det
+        return PreparedGMM.from_file(self)
+
+    def to_sklearn(self):
+        # 只有需要 sklearn 对象时 (MAP 自适应, 统计量) 才转换, 均值和权重拷贝为可写数组
+        return make_gmm(np.array(self.weights), np.array(self.means), self.covars)
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_gmm(path, weights, means, covars, feature_fingerprint=None):
+    covars = np.asarray(covars, dtype=np.float64)
+    arrays = {'weights': np.asarray(weights, dtype=np.float64),
+              'means': np.asarray(means, dtype=np.float64),
+              'precisions': 1.0 / covars,
+              'log_det': np.sum(np.log(covars), axis=1)}
+
+    # 头部长度影响数组偏移, 先按占位偏移估计头部长度, 再留出余量
+    header = {'n_components': int(arrays['means'].shape[0]),
+              'n_features': int(arrays['means'].shape[1]),
+              'feature_fingerprint': feature_fingerprint,
+              'arrays': {}}
+    reserve = len(json.dumps(dict(header, arrays={name: [10 ** 12, list(arrays[name].shape)]
+                                                  for name in GMM_ARRAYS})).encode('utf-8'))
+    offset = _align(len(MAGIC) + 8 + reserve)
+    for name in GMM_ARRAYS:
+        header['arrays'][name] = [offset, list(arrays[name].shape)]
+        offset = _align(offset + arrays[name].nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<II', GMM_FORMAT_VERSION, len(header_bytes)) + header_bytes)
+        for name in GMM_ARRAYS:
+            f.seek(header['arrays'][name][0])
+            f.write(np.ascontiguousarray(arrays[name]).astype('<f8').tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+def save_sklearn(path, gmm, feature_fingerprint=None):
+    save_gmm(path, gmm.weights_, gmm.means_, gmm.covariances_, feature_fingerprint)
+
+
+def load_gmm(path, mmap=True):
+    # 读取 .gmm 文件, mmap 为 True 时数组为只读 memmap, 否则读入内存
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError("不是 GMM 模型文件: %s" % path)
+        version, header_len = struct.unpack('<II', prefix[len(MAGIC):])
+        if version != GMM_FORMAT_VERSION:
+            raise ValueError("不支持的 GMM 模型文件版本: %d" % version)
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        arrays = {}
+        for name in GMM_ARRAYS:
+            offset, shape = header['arrays'][name]
+            if mmap:
+                arrays[name] = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=tuple(shape))
+            else:
+                f.seek(offset)
+                arrays[name] = np.fromfile(f, dtype='<f8', count=int(np.prod(shape))).reshape(shape)
+    return GMMFile(feature_fingerprint=header.get('feature_fingerprint'), **arrays)
+
+
+def model_path(path_model, name):
+    # load_model 读取的文件: name.gmm, 不存在时为 name.model
+    gmm_path = os.path.join(path_model, name + '.gmm')
+    return gmm_path if os.path.exists(gmm_path) else os.path.join(path_model, name + '.model')
+
+
+def _load_checked(gmm_path, feature_fingerprint):
+    model = load_gmm(gmm_path)
+    if (feature_fingerprint is not None and model.feature_fingerprint is not None
+            and model.feature_fingerprint != feature_fingerprint):
+        print("warning: %s was trained with a different feature config" % gmm_path)
+    return model
+
+
+def load_model(path_model, name, feature_fingerprint=None):
+    """
+    读取 path_model 下名为 name 的模型, 返回 sklearn GaussianMixture
+    优先读取 name.gmm, 不存在时读取 joblib 保存的 name.model
+    给出 feature_fingerprint 时检查模型训练时使用的特征配置, 不一致时打印警告
+    """
+    gmm_path = model_path(path_model, name)
+    if not gmm_path.endswith('.gmm'):
+        return joblib.load(gmm_path)
+    return _load_checked(gmm_path, feature_fingerprint).to_sklearn()
+
+
+def load_prepared(path_model, name, feature_fingerprint=None):
+    # 同 load_model, 但返回打分用的 PreparedGMM, .gmm 文件不经过 sklearn 对象
+    gmm_path = model_path(path_model, name)
+    if not gmm_path.endswith('.gmm'):
+        return PreparedGMM.from_sklearn(joblib.load(gmm_path))
+    return _load_checked(gmm_path, feature_fingerprint).prepared()
@@ -0,0 +1,161 @@
+import numpy as np
+from scipy.special import logsumexp
+
+# GMM-UBM 打分
+# MAP 自适应得到的说话人模型与 UBM 的成分一一对应, 快速打分时 (top-C):
+#   1. 用 UBM 的全部 M 个成分计算每帧的似然, 保留得分最高的 C 个成分
+#   2. UBM 和说话人模型都只在这 C 个成分上计算每帧的似然
+#   LLR = mean_t [log sum_{c in top-C} w^s_c N(x_t | spk_c) - log sum_{c in top-C} w_c N(x_t | ubm_c)]
+# 每个说话人的计算量由 M*D 降为 C*D
+
+
+class PreparedGMM:
+    # 预先计算好常数项的对角协方差 GMM, 避免每次打分重复计算
+    # precs 为方差的倒数, log_det 为 log|Sigma_i|, 不给出时由 precs 计算; float64 的 memmap 直接使用, 不拷贝
+    def __init__(self, weights, means, precs, log_det=None):
+        self.means = np.asarray(means, dtype=np.float64)
+        self.precs = np.asarray(precs, dtype=np.float64)
+        if log_det is None:
+            log_det = -np.sum(np.log(self.precs), axis=1)
+        D = self.means.shape[1]
+        # log w_i - 0.5 * (D log 2pi + log|Sigma_i|)
+        self.consts = np.log(weights) - 0.5 * (D * np.log(2 * np.pi) + np.asarray(log_det, dtype=np.float64))
+        self._means_precs = self.means * self.precs
+        self._consts_full = self.consts - 0.5 * np.sum(self.means ** 2 * self.precs, axis=1)
+
+    @classmethod
+    def from_covars(cls, weights, means, covars):
+        return cls(weights, means, 1.0 / np.asarray(covars, dtype=np.float64))
+
+    @classmethod
+    def from_sklearn(cls, gmm):
+        # 精度由 precisions_cholesky_ 得到, 与 gmm.score 使用的参数一致
+        return cls(gmm.weights_, gmm.means_, gmm.precisions_cholesky_ ** 2)
+
+    @classmethod
+    def from_file(cls, model):
+        # gmm_io.GMMFile: 直接使用文件中保存的 precisions 和 log_det
+        return cls(model.weights, model.means, model.precisions, model.log_det)
+
+    def log_prob(self, X):
+        # 每帧在全部成分上的 log(w_i * N(x | mu_i, sigma_i)), [T x M]
+        return (self._consts_full - 0.5 * np.dot(X ** 2, self.precs.T)
+                + np.dot(X, self._means_precs.T))
+
+    def log_prob_top(self, X, idx):
+        # 每帧只在 idx [T x C] 指定的成分上计算, [T x C]
+        diff = X[:, np.newaxis, :] - self.means[idx]
+        return self.consts[idx] - 0.5 * np.einsum('tcd,tcd->tc', diff * diff, self.precs[idx])
+
+    def score(self, X):
+        # 平均每帧对数似然, 与 sklearn GaussianMixture.score 相同
+        return logsumexp(self.log_prob(X), axis=1).mean()
+
+
+def ubm_top_c(ubm, X, C):
+    """
+    UBM 上每帧得分最高的 C 个成分
+    返回 (idx [T x C], UBM 在这 C 个成分上的每帧对数似然 [T, ])
+    """
+    X = np.asarray(X, dtype=np.float64)
+    log_prob = ubm.log_prob(X)
+    C = min(C, log_prob.shape[1])
+    idx = np.argpartition(-log_prob, C - 1, axis=1)[:, :C]
+    return idx, logsumexp(np.take_along_axis(log_prob, idx, axis=1), axis=1)
+
+
+def top_c_llr(spk, X, idx, ubm_frame_llk):
+    # 说话人模型在 top-C 成分上的 LLR, idx 和 ubm_frame_llk 由 ubm_top_c 得到
+    X = np.asarray(X, dtype=np.float64)
+    spk_frame_llk = logsumexp(spk.log_prob_top(X, idx), axis=1)
+    return np.mean(spk_frame_llk - ubm_frame_llk)
+
+
+class SpeakerBatch:
+    """
+    全部说话人模型的参数堆叠在一起, 一条语音对所有说话人的 LLR 由少数几次矩阵乘法得到
+    weights [S x M], means [S x M x D], precs [S x M x D] (方差的倒数)
+    只自适应均值时 weights 和 precs 可以只传 UBM 的 [M, ] / [M x D], 二次项对所有说话人只算一次
+    log_det 为 log|Sigma|, 不给出时由 precs 计算
+    max_elements 限制中间结果 [帧数 x 说话人 x 成分] 的大小, 说话人按块计算
+    """
+    def __init__(self, speakers, weights, means, precs, log_det=None, max_elements=1 << 23):
+        self.speakers = list(speakers)
+        self.means = np.asarray(means, dtype=np.float64)
+        S, M, D = self.means.shape
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), (S, M))
+        self.precs = np.asarray(precs, dtype=np.float64)
+        self.shared_precs = self.precs.ndim == 2
+        if log_det is None:
+            log_det = -np.sum(np.log(self.precs), axis=-1)
+        self.consts = np.log(weights) - 0.5 * (D * np.log(2 * np.pi) + log_det)
+        self._means_precs = self.means * self.precs
+        self._consts_full = self.consts - 0.5 * np.sum(self.means * self._means_precs, axis=2)
+        self.max_elements = max_elements
+
+    @classmethod
+    def from_bank(cls, bank, **kwargs):
+        weights = bank.ubm_weights if bank.weights is None else bank.weights
+        covars = bank.ubm_covars if bank.covars is None else bank.covars
+        return cls(bank.speakers, weights, bank.means, 1.0 / np.asarray(covars, dtype=np.float64), **kwargs)
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def _blocks(self, per_speaker):
+        step = max(1, self.max_elements // max(per_speaker, 1))
+        for start in range(0, len(self.speakers), step):
+            yield slice(start, min(start + step, len(self.speakers)))
+
+    def frame_llk(self, X):
+        # 每个说话人在全部成分上的每帧对数似然 [S x T]
+        X = np.asarray(X, dtype=np.float64)
+        T, D = X.shape
+        S, M = self.consts.shape
+        out = np.empty((S, T))
+        if self.shared_precs:
+            quad = -0.5 * np.dot(X ** 2, self.precs.T)
+        for block in self._blocks(T * M):
+            n = block.stop - block.start
+            log_prob = np.dot(X, self._means_precs[block].reshape(n * M, D).T).reshape(T, n, M)
+            if self.shared_precs:
+                log_prob += quad[:, np.newaxis, :]
+            else:
+                log_prob -= 0.5 * np.dot(X ** 2, self.precs[block].reshape(n * M, D).T).reshape(T, n, M)
+            log_prob += self._consts_full[block]
+            out[block] = logsumexp(log_prob, axis=2).T
+        return out
+
+    def frame_llk_top(self, X, idx):
+        # 每个说话人只在 idx [T x C] 指定的成分上的每帧对数似然 [S x T]
+        X = np.asarray(X, dtype=np.float64)
+        T, C = idx.shape
+        D = X.shape[1]
+        out = np.empty((len(self.speakers), T))
+        for block in self._blocks(T * C * D):
+            diff = X[np.newaxis, :, np.newaxis, :] - self.means[block][:, idx]
+            precs = self.precs[idx] if self.shared_precs else self.precs[block][:, idx]
+            log_prob = self.consts[block][:, idx] - 0.5 * np.sum(diff * diff * precs, axis=3)
+            out[block] = logsumexp(log_prob, axis=2)
+        return out
+
+    def llr(self, ubm, X, top_c=0):
+        """
+        一条语音对全部说话人的 LLR [S, ], 与说话人列表 speakers 一一对应
+        ubm 为 PreparedGMM, top_c > 0 时使用 top-C 快速打分
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if top_c > 0:
+            idx, ubm_frame_llk = ubm_top_c(ubm, X, top_c)
+            spk_frame_llk = self.frame_llk_top(X, idx)
+        else:
+            ubm_frame_llk = logsumexp(ubm.log_prob(X), axis=1)
+            spk_frame_llk = self.frame_llk(X)
+        return np.mean(spk_frame_llk - ubm_frame_llk, axis=1)
+
+    def top_k(self, scores, k):
+        # 按得分从高到低排列的前 k 个说话人, 返回 [(说话人, 得分)]
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.speakers[i], float(scores[i])) for i in best]
@@ -0,0 +1,145 @@
+import numpy as np
+
+# 只依赖 numpy 的 MFCC 提取, 与 librosa.feature.mfcc + librosa.util.normalize + librosa.feature.delta 的结果一致 (误差约 1e-6)
+# 窗函数, 梅尔滤波器组, DCT 矩阵和差分系数在构造时计算一次, MFCCEngine.get 按参数缓存引擎
+# 分帧使用 stride 视图, 一段语音的全部帧由一次 rfft 和几次矩阵乘法得到
+# audio/_2feature_extractor.py 通过 sys.path 导入本模块, 训练和识别共用同一份实现
+
+
+def hz_to_mel(freqs):
+    # Slaney 梅尔刻度 (librosa 默认 htk=False): 1000Hz 以下线性, 以上对数
+    freqs = np.asarray(freqs, dtype=np.float64)
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    mels = freqs / f_sp
+    log_part = freqs >= min_log_hz
+    mels[log_part] = min_log_mel + np.log(freqs[log_part] / min_log_hz) / logstep
+    return mels
+
+
+def mel_to_hz(mels):
+    mels = np.asarray(mels, dtype=np.float64)
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    freqs = f_sp * mels
+    log_part = mels >= min_log_mel
+    freqs[log_part] = min_log_hz * np.exp(logstep * (mels[log_part] - min_log_mel))
+    return freqs
+
+
+def mel_filterbank(sr, n_fft, n_mels, fmin=0.0, fmax=None):
+    # 三角滤波器组 [n_mels x (n_fft//2 + 1)], Slaney 面积归一化, 同 librosa.filters.mel
+    if fmax is None:
+        fmax = sr / 2.0
+    fft_freqs = np.linspace(0, sr / 2.0, 1 + n_fft // 2)
+    mel_f = mel_to_hz(np.linspace(hz_to_mel([fmin])[0], hz_to_mel([fmax])[0], n_mels + 2))
+    fdiff = np.diff(mel_f)
+    ramps = mel_f[:, np.newaxis] - fft_freqs[np.newaxis, :]
+    lower = -ramps[:n_mels] / fdiff[:n_mels, np.newaxis]
+    upper = ramps[2:] / fdiff[1:, np.newaxis]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_f[2:n_mels + 2] - mel_f[:n_mels]))[:, np.newaxis]
+    return weights.astype(np.float32)
+
+
+def dct_matrix(n_out, n_in):
+    # 正交 DCT-II 的前 n_out 行 [n_out x n_in], 同 scipy.fft.dct(type=2, norm='ortho')
+    k = np.arange(n_out)[:, np.newaxis]
+    n = np.arange(n_in)[np.newaxis, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2.0 * n_in)) * np.sqrt(2.0 / n_in)
+    basis[0] /= np.sqrt(2.0)
+    return basis
+
+
+def delta_weights(width, order):
+    """
+    Savitzky-Golay 差分系数 [width, ]: 窗口内按最小二乘拟合 order 次多项式, 取 order 阶导数
+    多项式次数与导数阶数相同 (同 librosa.feature.delta), 导数在整个窗口内为常数,
+    所以 savgol_filter 的 mode='interp' 在两端的结果就是第一个 / 最后一个完整窗口的结果
+    """
+    x = np.arange(width, dtype=np.float64) - width // 2
+    return np.prod(np.arange(1, order + 1)) * np.linalg.pinv(x[:, np.newaxis] ** np.arange(order + 1))[order]
+
+
+class MFCCEngine:
+    _engines = {}
+
+    def __init__(self, sr, n_mfcc=19, n_fft=512, hop_length=160, win_length=320, n_mels=20,
+                 top_db=80.0, delta_width=9):
+        self.sr = sr
+        self.n_mfcc = n_mfcc
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.top_db = top_db
+        self.delta_width = delta_width
+        # 周期 Hann 窗, 居中补零到 n_fft (同 librosa.stft)
+        window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(win_length) / win_length)
+        self.window = np.zeros(n_fft, dtype=np.float32)
+        left = (n_fft - win_length) // 2
+        self.window[left:left + win_length] = window
+        self.mel_basis_t = mel_filterbank(sr, n_fft, n_mels).T
+        self.dct_t = dct_matrix(n_mfcc, n_mels).T
+        self.delta1 = delta_weights(delta_width, 1)
+        self.delta2 = delta_weights(delta_width, 2)
+
+    @classmethod
+    def get(cls, sr, **params):
+        # 相同参数共用一个引擎, 滤波器组等只计算一次
+        key = (sr, tuple(sorted(params.items())))
+        engine = cls._engines.get(key)
+        if engine is None:
+            engine = cls._engines[key] = cls(sr, **params)
+        return engine
+
+    def frames_log_mel(self, padded):
+        # padded 中全部完整帧的对数梅尔谱 (dB) [帧数 x n_mels], padded 已经补好首尾
+        n = (len(padded) - self.n_fft) // self.hop_length + 1
+        if n <= 0:
+            return np.empty((0, self.mel_basis_t.shape[1]), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft)[::self.hop_length][:n]
+        spec = np.fft.rfft(frames * self.window, axis=1)
+        power = spec.real ** 2 + spec.imag ** 2
+        return 10.0 * np.log10(np.maximum(1e-10, np.dot(power, self.mel_basis_t)))
+
+    def log_mel(self, y):
+        # 整段语音的对数梅尔谱, 首尾各补 n_fft//2 个 0 (同 librosa center=True)
+        pad = self.n_fft // 2
+        return self.frames_log_mel(np.pad(np.asarray(y, dtype=np.float32), pad))
+
+    def mfcc(self, log_mel, max_db=None):
+        # 未归一化的 MFCC [帧数 x n_mfcc], 低于最大值 top_db 分贝的梅尔能量截断 (同 librosa.power_to_db)
+        if max_db is None:
+            max_db = log_mel.max()
+        return np.dot(np.maximum(log_mel, max_db - self.top_db), self.dct_t)
+
+    def deltas(self, data, weights):
+        # data [帧数 x 维度] 沿帧的差分, 帧数不能少于 delta_width
+        width = self.delta_width
+        half = width // 2
+        if data.shape[0] < width:
+            raise ValueError("帧数 %d 少于差分窗长 %d" % (data.shape[0], width))
+        inner = np.dot(np.lib.stride_tricks.sliding_window_view(data, width, axis=0), weights)
+        return np.concatenate([np.repeat(inner[:1], half, axis=0), inner, np.repeat(inner[-1:], half, axis=0)])
+
+    def features(self, raw_mfcc):
+        # 每帧按最大绝对值归一化后拼接一阶, 二阶差分 [帧数 x 3*n_mfcc]
+        norm = np.max(np.abs(raw_mfcc), axis=1, keepdims=True)
+        norm[norm < np.finfo(raw_mfcc.dtype).tiny] = 1.0
+        mfcc = raw_mfcc / norm
+        fea = np.concatenate([mfcc, self.deltas(mfcc, self.delta1), self.deltas(mfcc, self.delta2)], axis=1)
+        return fea.astype(np.float32)
+
+    def extract(self, y, return_energy=False):
+        """
+        整段语音的特征 [帧数 x 3*n_mfcc]
+        return_energy 为 True 时同时返回每帧能量 (c0 换算的梅尔谱平均对数能量, dB)
+        """
+        raw_mfcc = self.mfcc(self.log_mel(y))
+        fea = self.features(raw_mfcc)
+        if return_energy:
+            return fea, (raw_mfcc[:, 0] / np.sqrt(self.mel_basis_t.shape[1])).astype(np.float32)
+        return fea
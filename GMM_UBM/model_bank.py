@@ -0,0 +1,140 @@
+import os
+import numpy as np
+from ubm_em import make_gmm
+
+# 说话人模型库
+# UBM 只保存一次, 所有说话人的自适应均值保存在一个 [S x M x D] 数组中,
+# 只有自适应了权重/方差时才保存 [S x M] 权重和 [S x M x D] 方差
+# 文件为 .npz, 一次读取即可加载全部说话人:
+#   version, adapt, ubm_weights, ubm_means, ubm_covars, speakers, means, (weights), (covars)
+BANK_VERSION = 1
+
+
+class SpeakerModelBank:
+    def __init__(self, ubm_weights, ubm_means, ubm_covars, adapt='m'):
+        self.ubm_weights = np.asarray(ubm_weights, dtype=np.float64)
+        self.ubm_means = np.asarray(ubm_means, dtype=np.float64)
+        self.ubm_covars = np.asarray(ubm_covars, dtype=np.float64)
+        self.adapt = adapt
+        self.speakers = []
+        self._index = {}
+        M, D = self.ubm_means.shape
+        self._means = np.zeros((0, M, D), dtype=np.float32)
+        self._weights = np.zeros((0, M), dtype=np.float32) if 'w' in adapt else None
+        self._covars = np.zeros((0, M, D), dtype=np.float32) if 'v' in adapt else None
+
+    @classmethod
+    def from_ubm(cls, ubm_model, adapt='m'):
+        return cls(ubm_model.weights_, ubm_model.means_, ubm_model.covariances_, adapt)
+
+    def same_ubm(self, ubm_model):
+        return (np.array_equal(self.ubm_weights, ubm_model.weights_)
+                and np.array_equal(self.ubm_means, ubm_model.means_)
+                and np.array_equal(self.ubm_covars, ubm_model.covariances_))
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def __contains__(self, spk):
+        return spk in self._index
+
+    def index(self, spk):
+        return self._index[spk]
+
+    # 只读视图, 行与 speakers 一一对应
+    @property
+    def means(self):
+        return self._means[:len(self.speakers)]
+
+    @property
+    def weights(self):
+        return None if self._weights is None else self._weights[:len(self.speakers)]
+
+    @property
+    def covars(self):
+        return None if self._covars is None else self._covars[:len(self.speakers)]
+
+    def _grow(self):
+        # 容量翻倍, 逐个添加说话人的均摊代价为 O(M*D)
+        capacity = max(2 * self._means.shape[0], 16)
+        def grow(arr):
+            new = np.zeros((capacity,) + arr.shape[1:], dtype=arr.dtype)
+            new[:len(self.speakers)] = arr[:len(self.speakers)]
+            return new
+        self._means = grow(self._means)
+        if self._weights is not None:
+            self._weights = grow(self._weights)
+        if self._covars is not None:
+            self._covars = grow(self._covars)
+
+    def add(self, spk, gmm):
+        # 添加或替换一个说话人, gmm 为 MAP 自适应得到的 GaussianMixture
+        if spk in self._index:
+            row = self._index[spk]
+        else:
+            if len(self.speakers) == self._means.shape[0]:
+                self._grow()
+            row = len(self.speakers)
+            self.speakers.append(spk)
+            self._index[spk] = row
+        self._means[row] = gmm.means_
+        if self._weights is not None:
+            self._weights[row] = gmm.weights_
+        if self._covars is not None:
+            self._covars[row] = gmm.covariances_
+
+    def ubm_gmm(self):
+        return make_gmm(self.ubm_weights, self.ubm_means, self.ubm_covars)
+
+    def speaker_params(self, spk):
+        # 一个说话人的 (weights, means, covars), 未自适应的参数使用 UBM 的参数
+        row = self._index[spk]
+        weights = self.ubm_weights if self._weights is None else self._weights[row].astype(np.float64)
+        covars = self.ubm_covars if self._covars is None else self._covars[row].astype(np.float64)
+        return weights, self._means[row].astype(np.float64), covars
+
+    def speaker_gmm(self, spk):
+        # 构造一个说话人的 GaussianMixture
+        return make_gmm(*self.speaker_params(spk))
+
+    def to_arrays(self):
+        # 模型库的全部数组, 可以用 from_arrays 恢复 (也用于嵌入其他 .npz 文件)
+        arrays = {'version': BANK_VERSION,
+                  'adapt': self.adapt,
+                  'ubm_weights': self.ubm_weights,
+                  'ubm_means': self.ubm_means,
+                  'ubm_covars': self.ubm_covars,
+                  'speakers': np.array(self.speakers, dtype=str),
+                  'means': self.means}
+        if self._weights is not None:
+            arrays['weights'] = self.weights
+        if self._covars is not None:
+            arrays['covars'] = self.covars
+        return arrays
+
+    def save(self, path):
+        arrays = self.to_arrays()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_arrays(cls, data):
+        # data 为 to_arrays 的结果或读取的 .npz 文件
+        if int(data['version']) != BANK_VERSION:
+            raise ValueError("不支持的模型库版本: %s" % data['version'])
+        bank = cls(data['ubm_weights'], data['ubm_means'], data['ubm_covars'], str(data['adapt']))
+        bank.speakers = [str(spk) for spk in data['speakers']]
+        bank._index = {spk: i for i, spk in enumerate(bank.speakers)}
+        bank._means = data['means']
+        if bank._weights is not None:
+            bank._weights = data['weights']
+        if bank._covars is not None:
+            bank._covars = data['covars']
+        return bank
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls.from_arrays(data)
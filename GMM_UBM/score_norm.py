@@ -0,0 +1,136 @@
+import argparse
+import os
+import time
+import numpy as np
+from bw_stats import StatsStore
+from fea_archive import open_features
+from gmm_score import PreparedGMM, SpeakerBatch
+from model_bank import SpeakerModelBank
+from train_spk_model import GMM_MAP_stats
+
+# 得分规整 (adaptive S-norm)
+#   s_norm = 0.5 * ((s - mu_z) / sigma_z + (s - mu_t) / sigma_t)
+# Z-norm 统计量 (mu_z, sigma_z): 说话人模型对 cohort 语音的得分, 离线计算后保存, 识别时直接查表
+# T-norm 统计量 (mu_t, sigma_t): 测试语音对 cohort 模型的得分, 识别时由 SpeakerBatch 一次批量计算
+# 两侧都只取得分最高的 top_k 个 cohort 得分 (adaptive), 识别时的额外开销为给 cohort 模型打一次分
+# 文件格式 (.npz): version, top_k, top_c, speakers, z_mean, z_std, cohort_* (cohort 模型库, 见 model_bank)
+NORM_VERSION = 1
+
+
+def cohort_stats(scores, top_k):
+    # scores [..., cohort 数], 返回最后一维中最高的 top_k 个得分的均值和标准差
+    k = min(top_k, scores.shape[-1])
+    top = -np.partition(-scores, k - 1, axis=-1)[..., :k]
+    return top.mean(axis=-1), np.maximum(top.std(axis=-1), 1e-6)
+
+
+class ScoreNorm:
+    def __init__(self, speakers, z_mean, z_std, cohort_bank, top_k=200, top_c=0):
+        self.speakers = list(speakers)
+        self._index = {spk: i for i, spk in enumerate(self.speakers)}
+        self.z_mean = np.asarray(z_mean, dtype=np.float64)
+        self.z_std = np.asarray(z_std, dtype=np.float64)
+        self.cohort_bank = cohort_bank
+        self.cohort = SpeakerBatch.from_bank(cohort_bank)
+        self.top_k = top_k
+        self.top_c = top_c
+
+    def __contains__(self, spk):
+        return spk in self._index
+
+    def t_stats(self, ubm, X):
+        # 测试语音的 T-norm 统计量, ubm 为 PreparedGMM
+        return cohort_stats(self.cohort.llr(ubm, X, self.top_c), self.top_k)
+
+    def normalize(self, scores, spks, t_mean, t_std):
+        # scores 为测试语音对说话人 spks 的原始 LLR, t_mean / t_std 由 t_stats 得到
+        rows = np.array([self._index[spk] for spk in spks])
+        scores = np.asarray(scores, dtype=np.float64)
+        return 0.5 * ((scores - self.z_mean[rows]) / self.z_std[rows] + (scores - t_mean) / t_std)
+
+    def save(self, path):
+        arrays = {'version': NORM_VERSION,
+                  'top_k': self.top_k,
+                  'top_c': self.top_c,
+                  'speakers': np.array(self.speakers, dtype=str),
+                  'z_mean': self.z_mean,
+                  'z_std': self.z_std}
+        for name, value in self.cohort_bank.to_arrays().items():
+            arrays['cohort_' + name] = value
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != NORM_VERSION:
+                raise ValueError("不支持的得分规整文件版本: %s" % data['version'])
+            cohort_bank = SpeakerModelBank.from_arrays(
+                {name[len('cohort_'):]: data[name] for name in data.files if name.startswith('cohort_')})
+            return cls([str(spk) for spk in data['speakers']], data['z_mean'], data['z_std'], cohort_bank,
+                       int(data['top_k']), int(data['top_c']))
+
+
+def build_znorm(bank, ubm, feats, cohort_keys, top_k=200, top_c=0):
+    """
+    Z-norm 统计量: 模型库中每个说话人对全部 cohort 语音的得分中最高的 top_k 个的均值和标准差
+    ubm 为 PreparedGMM, 返回 (z_mean [S, ], z_std [S, ])
+    """
+    targets = SpeakerBatch.from_bank(bank)
+    scores = np.empty((len(bank), len(cohort_keys)))
+    for j, key in enumerate(cohort_keys):
+        scores[:, j] = targets.llr(ubm, feats[key], top_c)
+    return cohort_stats(scores, top_k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线计算 S-norm 得分规整所需的 cohort 模型和 Z-norm 统计量")
+    parser.add_argument('--bank', default='spk_bank.npz', help="说话人模型库文件名 (models 下)")
+    parser.add_argument('--cohort-scp', default='ubm_wav.scp', help="cohort 语音列表, 格式同 ubm_wav.scp")
+    parser.add_argument('--cohort-fea', default='fea/TRAIN', help="cohort 语音的特征")
+    parser.add_argument('--stats-dir', default='stats/TRAIN', help="cohort 语音 Baum-Welch 统计量的缓存目录")
+    parser.add_argument('--relevance-factor', type=float, default=16)
+    parser.add_argument('--top-k', type=int, default=200, help="adaptive S-norm 每侧使用的 cohort 得分数")
+    parser.add_argument('--top-c', type=int, default=0,
+                        help="cohort 打分使用 top-C 快速打分, 应与识别/评估时的 --top-c 相同")
+    parser.add_argument('--keep-enrolled', action='store_true',
+                        help="cohort 中保留模型库中已注册的说话人 (默认排除)")
+    parser.add_argument('--out', default='snorm.npz', help="输出文件名 (models 下)")
+    args = parser.parse_args()
+
+    path_model = 'models'
+    bank = SpeakerModelBank.load(os.path.join(path_model, args.bank))
+    ubm_gmm = bank.ubm_gmm()
+    ubm = PreparedGMM.from_sklearn(ubm_gmm)
+
+    file_lines = np.loadtxt(args.cohort_scp, dtype='str', delimiter=' ', ndmin=2)
+    spks = file_lines[:, 1]
+    keys = np.array([spk + '_' + utt for spk, utt in zip(spks, file_lines[:, 2])])
+    cohort_spks = [spk for spk in np.unique(spks) if args.keep_enrolled or spk not in bank]
+    if not cohort_spks:
+        raise ValueError("cohort 中没有未注册的说话人, 请使用其他 cohort 列表或 --keep-enrolled")
+    feats = open_features(args.cohort_fea)
+    store = StatsStore(args.stats_dir, ubm_gmm)
+
+    # cohort 模型: 与注册说话人相同的 MAP 自适应方式
+    start = time.time()
+    cohort_bank = SpeakerModelBank.from_ubm(ubm_gmm, bank.adapt)
+    cohort_keys = []
+    for spk in cohort_spks:
+        spk_keys = list(keys[spks == spk])
+        cohort_bank.add(spk, GMM_MAP_stats(ubm_gmm, [store.get(feats, key) for key in spk_keys],
+                                           args.relevance_factor, bank.adapt))
+        cohort_keys.extend(spk_keys)
+    print("adapt %d cohort models in %.2fs" % (len(cohort_bank), time.time() - start))
+
+    start = time.time()
+    z_mean, z_std = build_znorm(bank, ubm, feats, cohort_keys, args.top_k, args.top_c)
+    print("z-norm stats of %d speakers against %d cohort utterances in %.2fs"
+          % (len(bank), len(cohort_keys), time.time() - start))
+
+    norm = ScoreNorm(bank.speakers, z_mean, z_std, cohort_bank, args.top_k, args.top_c)
+    out_path = os.path.join(path_model, args.out)
+    norm.save(out_path)
+    print("save score normalisation: %s" % out_path)
@@ -1,30 +1,99 @@
-from platform import python_branch
 import numpy as np
 from sklearn.mixture import GaussianMixture as GMM
 import os
+import argparse
 import joblib
-import pickle
-path_fea = 'fea/Train'
-file_lines = np.loadtxt('ubm_wav.scp',dtype='str',delimiter=' ')
-datas_all = []
-
-spks = file_lines[:,1]
-utt_ids = file_lines[:,2]
-
-for spk,utt in zip(spks,utt_ids):
-    file_fea = os.path.join(path_fea,spk+"_"+utt+".npy")
-    print("load fea",file_fea)
-    data = np.load(file_fea)
-    datas_all.append(data)
-
-datas = np.concatenate(datas_all,axis=1).T
-print(datas.shape)
-
-# 构造UBM 模型
-N_mix = 128
-ubm =  GMM(n_components = N_mix, covariance_type='diag', max_iter=50)
-ubm.fit(datas)
-model_path = 'models'
-os.makedirs(model_path,exist_ok=True)
-joblib.dump(ubm, os.path.join(model_path,'ubm.model'))
+from fea_archive import FeatureArchive, open_features
+from fea_cache import FEATURE_CONFIG, config_fingerprint
+from gmm_io import save_sklearn
+from ubm_em import FrameChunks, e_step, train_ubm_streaming, train_ubm_split
+from ubm_shard import ShardedEStep, check_sharded_estep
+from frame_select import FrameSelector
 
+
+def main():
+    parser = argparse.ArgumentParser(description="训练 UBM")
+    parser.add_argument('--trainer', choices=['stream', 'sklearn'], default='stream',
+                        help="stream: 流式 EM, 内存由块大小决定; sklearn: 全部特征载入内存后 GaussianMixture.fit")
+    parser.add_argument('--n-mix', type=int, default=128, help="高斯成分数")
+    parser.add_argument('--n-iter', type=int, default=50, help="最大 EM 迭代次数")
+    parser.add_argument('--chunk-frames', type=int, default=50000, help="流式 EM 每块的帧数")
+    parser.add_argument('--init', choices=['kmeans', 'split'], default='kmeans',
+                        help="流式 EM 的初始化: kmeans: 抽样帧上的 k-means; split: 从 1 个高斯开始二分裂")
+    parser.add_argument('--split-iters', type=int, default=4, help="二分裂时每个中间规模的 EM 次数")
+    parser.add_argument('--split-frames-per-mix', type=int, default=None,
+                        help="二分裂时中间规模 M 只用约 M 倍该帧数的抽样训练, 不指定时用全部帧")
+    parser.add_argument('--shards', type=int, default=1, help="流式 EM 的 E 步分片数, 大于 1 时分片并行")
+    parser.add_argument('--shard-dir', default='ubm_shards', help="分片 EM 的工作目录, 所有 worker 都要能访问")
+    parser.add_argument('--launch-cmd', default=None,
+                        help="启动分片 worker 的命令模板, 可用 {work_dir} {iter} {shard}; 不指定时使用本机进程池")
+    parser.add_argument('--workers', type=int, default=None, help="本机进程池的进程数, 默认为 CPU 核数")
+    parser.add_argument('--check-shards', action='store_true',
+                        help="训练前用初始参数各做一次单进程和分片的 E 步, 统计量不一致时报错")
+    parser.add_argument('--vad-db', type=float, default=None,
+                        help="丢弃能量比本句最大能量低多少 dB 以上的帧, 如 30; 不指定时不做 VAD")
+    parser.add_argument('--decimate', type=int, default=1, help="每 N 帧保留 1 帧")
+    parser.add_argument('--max-frames-per-spk', type=int, default=None, help="每个说话人最多保留的帧数")
+    parser.add_argument('--pickle', action='store_true', help="同时保存 joblib 格式的 ubm.model (旧版本程序使用)")
+    args = parser.parse_args()
+
+    path_fea = 'fea/TRAIN'
+    file_lines = np.loadtxt('ubm_wav.scp',dtype='str',delimiter=' ')
+
+    spks = file_lines[:,1]
+    utt_ids = file_lines[:,2]
+    keys = [spk+"_"+utt for spk,utt in zip(spks,utt_ids)]
+
+    feats = open_features(path_fea)
+
+    # 帧筛选
+    selector = FrameSelector(vad_db=args.vad_db, decimate=args.decimate,
+                             max_frames_per_spk=args.max_frames_per_spk)
+    if selector.enabled():
+        selector.plan(feats, keys, spks)
+    else:
+        selector = None
+
+    # 构造UBM 模型
+    N_mix = args.n_mix
+    if args.trainer == 'stream':
+        chunks = FrameChunks(feats, keys, chunk_frames=args.chunk_frames, selector=selector)
+        print("frames:", chunks.n_frames)
+        estep = e_step
+        if args.shards > 1:
+            estep = ShardedEStep(chunks, path_fea, args.shards, args.shard_dir,
+                                 launch_cmd=args.launch_cmd, n_workers=args.workers)
+            if args.check_shards:
+                check_sharded_estep(chunks, estep, N_mix)
+        try:
+            if args.init == 'split':
+                ubm = train_ubm_split(chunks, N_mix, n_iter=args.n_iter, split_iters=args.split_iters,
+                                      frames_per_mix=args.split_frames_per_mix, estep=estep)
+            else:
+                ubm = train_ubm_streaming(chunks, N_mix, n_iter=args.n_iter, estep=estep)
+        finally:
+            if estep is not e_step:
+                estep.close()
+    else:
+        if selector is not None:
+            datas = np.concatenate([selector.apply(feats, key, feats[key]) for key in keys], axis=0)
+        elif isinstance(feats, FeatureArchive) and len(feats) == len(keys) and all(key in feats for key in keys):
+            # 档案中正好是全部 UBM 语音, 直接把整个档案作为一个数组训练, 不拼接
+            datas = feats.all_frames()
+        else:
+            print("load fea", path_fea)
+            datas = feats.frames(keys)
+        print(datas.shape)
+        ubm =  GMM(n_components = N_mix, covariance_type='diag', max_iter=args.n_iter)
+        ubm.fit(datas)
+
+    model_path = 'models'
+    os.makedirs(model_path,exist_ok=True)
+    save_sklearn(os.path.join(model_path, 'ubm.gmm'), ubm, config_fingerprint(FEATURE_CONFIG))
+    if args.pickle:
+        joblib.dump(ubm, os.path.join(model_path,'ubm.model'))
+
+
+# 分片 EM 的本机进程池在 spawn 方式 (Windows / macOS) 下会重新导入本文件, 训练流程必须放在 main 中
+if __name__ == "__main__":
+    main()
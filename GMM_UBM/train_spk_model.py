@@ -1,54 +1,71 @@
 import numpy as np
 import os
 import joblib
-
-
-# 利用 MAP自适应从UBM中
-# 学习说话人GMM
-def GMM_MAP(ubm_model, data):
-    # 获取特征维度
-    xdim = data.shape[1]
-    T = data.shape[0]
-
-    # 获取UBM参数
-    M = ubm_model.n_components
+import argparse
+from fea_archive import open_features
+from ubm_em import make_gmm
+from bw_stats import StatsStore, ubm_stats, sum_stats, check_ubm_stats
+from fea_cache import FEATURE_CONFIG, config_fingerprint
+from gmm_io import load_model, save_sklearn
+from model_bank import SpeakerModelBank
+
+
+# 由统计量做 MAP 自适应
+# adapt 为要自适应的参数: 'm' 均值, 'w' 权重, 'v' 方差, 可以组合, 如 'm' 或 'mwv'
+# 默认只自适应均值 (GMM-UBM 的常用做法), 识别阈值也是按只自适应均值的模型设定的
+def map_adapt(ubm_model, N, F, S, relevance_factor=16, adapt='m'):
     ubm_weights = ubm_model.weights_
     ubm_means = ubm_model.means_
     ubm_covars = ubm_model.covariances_
-
-    # 计算特征在每个高斯成分上的概率
-    posterior_prob = ubm_model.predict_proba(data)
-    pr_i_xt = (ubm_weights * posterior_prob) / np.asmatrix(np.sum(ubm_weights \
-                                                                  * posterior_prob, axis=1)).T
-    # 0阶统计量
-    n_i = np.asarray(np.sum(pr_i_xt, axis=0)).flatten()  # [M, ]
-
-    # 1阶统计量
-    E_x = np.asarray([(np.asarray(pr_i_xt[:, i]) * data).sum(axis=0) / n_i[i] for i in range(M)])  # [M x xdim]
-
-    # 2阶统计量
-    E_x2 = np.asarray([(np.asarray(pr_i_xt[:, i]) * (data ** 2)).sum(axis=0) / n_i[i] for i in range(M)])  # [M x xdim]
+    T = N.sum()
 
     # 计算融合参数
-    relevance_factor = 16
-    scaleparam = 1
-    alpha_i = n_i / (n_i + relevance_factor)
+    alpha_i = (N / (N + relevance_factor))[:, np.newaxis]  # [M x 1]
+    n_i = np.maximum(N, np.finfo(np.float64).eps)[:, np.newaxis]
+    E_x = F / n_i
+    E_x2 = S / n_i
 
     # 计算 GMM的参数
-    new_weights = (alpha_i * n_i / T + (1.0 - alpha_i) * ubm_weights) * scaleparam
-    alpha_i = np.asarray(np.asmatrix(alpha_i).T)
-    new_means = (alpha_i * E_x + (1. - alpha_i) * ubm_means)
-    new_covars = alpha_i * E_x2 + (1. - alpha_i) * (ubm_covars + (ubm_means ** 2)) - (new_means ** 2)
+    new_weights = ubm_weights
+    new_means = ubm_means
+    new_covars = ubm_covars
+    if 'w' in adapt:
+        new_weights = alpha_i[:, 0] * N / T + (1.0 - alpha_i[:, 0]) * ubm_weights
+        new_weights = new_weights / new_weights.sum()
+    if 'm' in adapt:
+        new_means = alpha_i * E_x + (1. - alpha_i) * ubm_means
+    if 'v' in adapt:
+        new_covars = alpha_i * E_x2 + (1. - alpha_i) * (ubm_covars + ubm_means ** 2) - new_means ** 2
+        new_covars = np.maximum(new_covars, ubm_model.reg_covar)
+
+    # 返回新的 GMM, 不修改 UBM
+    return make_gmm(np.array(new_weights), np.array(new_means), np.array(new_covars))
+
+
+# 利用 MAP自适应从UBM中
+# 学习说话人GMM
+def GMM_MAP(ubm_model, data, relevance_factor=16, adapt='m'):
+    N, F, S = ubm_stats(ubm_model, data)
+    return map_adapt(ubm_model, N, F, S, relevance_factor, adapt)
 
-    # 返回 GMM
-    ubm_model.means_ = new_means
-    ubm_model.weights_ = new_weights
-    ubm_model.covariances_ = new_covars
 
-    return ubm_model
+# 由多条语音缓存的统计量 (N, F, S) 做 MAP 自适应, 不需要再读取特征
+def GMM_MAP_stats(ubm_model, stats, relevance_factor=16, adapt='m'):
+    N, F, S = sum_stats(stats)
+    return map_adapt(ubm_model, N, F, S, relevance_factor, adapt)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MAP 自适应训练说话人模型")
+    parser.add_argument('--relevance-factor', type=float, default=16)
+    parser.add_argument('--adapt', default='m', help="自适应的参数: m 均值, w 权重, v 方差, 如 m 或 mwv")
+    parser.add_argument('--stats-dir', default='stats/TEST', help="每条语音 Baum-Welch 统计量的缓存目录")
+    parser.add_argument('--no-stats-cache', action='store_true', help="不使用统计量缓存, 直接由特征计算")
+    parser.add_argument('--bank', default='spk_bank.npz', help="说话人模型库文件名 (保存在 models 下)")
+    parser.add_argument('--gmm-files', action='store_true', help="同时为每个说话人保存 .gmm 格式的 spk.gmm")
+    parser.add_argument('--pickle', action='store_true', help="同时为每个说话人保存 joblib 格式的 spk.model (旧版本程序使用)")
+    parser.add_argument('--check-stats', action='store_true', help="先在第一个说话人的数据上检查向量化统计量与逐成分循环一致")
+    args = parser.parse_args()
 
     model_path = 'models'
 
@@ -61,20 +78,44 @@ if __name__ == "__main__":
 
     unique_spks = np.unique(spks)
 
+    feats = open_features(path_fea)
+    fingerprint = config_fingerprint(FEATURE_CONFIG)
+    ubm = load_model(model_path, 'ubm', fingerprint)
+    store = None if args.no_stats_cache else StatsStore(args.stats_dir, ubm)
+
+    if args.check_stats:
+        first = unique_spks[0]
+        check_ubm_stats(ubm, feats.frames([first + "_" + utts[i] for i in np.where(spks == first)[0]]))
+
+    # 已有模型库且 UBM 和自适应方式相同时, 在其基础上添加/更新说话人
+    bank_path = os.path.join(model_path, args.bank)
+    bank = None
+    if os.path.exists(bank_path):
+        bank = SpeakerModelBank.load(bank_path)
+        if not bank.same_ubm(ubm) or bank.adapt != args.adapt:
+            print("UBM 或自适应方式已变化, 重新建立模型库")
+            bank = None
+    if bank is None:
+        bank = SpeakerModelBank.from_ubm(ubm, args.adapt)
+
     for spk in unique_spks:
         index = np.where(spks == spk)[0]
-        datas = []
-
-        for i in index:
-            utt = utts[i]
-            data = np.load(os.path.join(path_fea, spk + "_" + utt + ".npy"))
-            datas.append(data)
-        datas = np.concatenate(datas, axis=1).T
-        ubm = joblib.load(os.path.join(model_path, 'ubm.model'))
-        gmm = GMM_MAP(ubm, datas)
-
-        joblib.dump(gmm, os.path.join(model_path, spk + '.model'))
-        print("save model of spk:", spk)
+        keys = [spk + "_" + utts[i] for i in index]
+        if store is not None:
+            gmm = GMM_MAP_stats(ubm, [store.get(feats, key) for key in keys], args.relevance_factor, args.adapt)
+        else:
+            datas = feats.frames(keys)
+            gmm = GMM_MAP(ubm, datas, args.relevance_factor, args.adapt)
+
+        bank.add(spk, gmm)
+        if args.gmm_files:
+            save_sklearn(os.path.join(model_path, spk + '.gmm'), gmm, fingerprint)
+        if args.pickle:
+            joblib.dump(gmm, os.path.join(model_path, spk + '.model'))
+        print("adapt model of spk:", spk)
+
+    bank.save(bank_path)
+    print("save model bank: %s (%d speakers)" % (bank_path, len(bank)))
 
 
 
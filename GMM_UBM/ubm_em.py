@@ -0,0 +1,222 @@
+import time
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.cluster import KMeans
+from sklearn.mixture import GaussianMixture as GMM
+
+# 流式 EM 训练对角协方差 UBM
+# 每次迭代逐块读取特征帧, E 步只累加 0/1/2 阶统计量, 峰值内存由块大小决定, 与语料大小无关
+
+
+class FrameChunks:
+    """
+    按块遍历多条语音的特征帧, 每块约 chunk_frames 帧, 可以多次遍历
+    feats 为 open_features() 返回的特征集合
+    selector 为已经调用过 plan() 的 FrameSelector, 每句只取筛选后的帧
+    """
+    def __init__(self, feats, keys, chunk_frames=50000, selector=None):
+        self.feats = feats
+        self.keys = list(keys)
+        self.chunk_frames = chunk_frames
+        self.selector = selector
+        if selector is not None and selector.n_selected is not None:
+            self.n_frames = selector.n_selected
+        else:
+            self.n_frames = sum(feats[key].shape[0] for key in self.keys)
+
+    def __iter__(self):
+        buf, n_buf = [], 0
+        for key in self.keys:
+            data = self.feats[key]
+            if self.selector is not None:
+                data = self.selector.apply(self.feats, key, data)
+            for start in range(0, data.shape[0], self.chunk_frames):
+                piece = data[start:start + self.chunk_frames]
+                buf.append(piece)
+                n_buf += piece.shape[0]
+                if n_buf >= self.chunk_frames:
+                    yield np.concatenate(buf, axis=0).astype(np.float64)
+                    buf, n_buf = [], 0
+        if buf:
+            yield np.concatenate(buf, axis=0).astype(np.float64)
+
+
+def sample_frames(chunks, n_samples):
+    # 等间隔抽取约 n_samples 帧, 用于初始化
+    step = max(1, chunks.n_frames // n_samples)
+    samples = []
+    offset = 0
+    for X in chunks:
+        start = (-offset) % step
+        samples.append(X[start::step])
+        offset += X.shape[0]
+    return np.concatenate(samples, axis=0)
+
+
+def log_gauss_diag(X, weights, means, covars):
+    # 每帧在每个高斯成分上的 log(w_i * N(x | mu_i, sigma_i)), [T x M]
+    D = X.shape[1]
+    precs = 1.0 / covars
+    const = np.log(weights) - 0.5 * (D * np.log(2 * np.pi)
+                                     + np.sum(np.log(covars), axis=1)
+                                     + np.sum(means ** 2 * precs, axis=1))
+    return const - 0.5 * np.dot(X ** 2, precs.T) + np.dot(X, (means * precs).T)
+
+
+def e_step(chunks, weights, means, covars):
+    """
+    流式 E 步, 返回 (N, F, S, 总对数似然, 总帧数)
+    N: 0阶统计量 [M, ]
+    F: 1阶统计量 [M x D]
+    S: 2阶统计量 [M x D]
+    """
+    M, D = means.shape
+    N = np.zeros(M)
+    F = np.zeros((M, D))
+    S = np.zeros((M, D))
+    llk = 0.0
+    T = 0
+    for X in chunks:
+        log_prob = log_gauss_diag(X, weights, means, covars)
+        log_norm = logsumexp(log_prob, axis=1)
+        post = np.exp(log_prob - log_norm[:, np.newaxis])
+        N += post.sum(axis=0)
+        F += np.dot(post.T, X)
+        S += np.dot(post.T, X ** 2)
+        llk += log_norm.sum()
+        T += X.shape[0]
+    return N, F, S, llk, T
+
+
+def m_step(N, F, S, reg_covar=1e-6):
+    # 由统计量更新 UBM 参数, 与 sklearn 相同的方式避免空成分和方差为 0
+    N = N + 10 * np.finfo(N.dtype).eps
+    weights = N / N.sum()
+    means = F / N[:, np.newaxis]
+    covars = S / N[:, np.newaxis] - means ** 2
+    covars = np.maximum(covars, 0) + reg_covar
+    return weights, means, covars
+
+
+def init_kmeans(chunks, n_mix, n_samples=100000, random_state=0):
+    # 在抽样帧上做 k-means 初始化均值, 方差取各类内方差, 权重取各类帧数比例
+    X = sample_frames(chunks, n_samples)
+    labels = KMeans(n_clusters=n_mix, n_init=1, random_state=random_state).fit(X).labels_
+    N = np.bincount(labels, minlength=n_mix).astype(np.float64)
+    F = np.zeros((n_mix, X.shape[1]))
+    S = np.zeros((n_mix, X.shape[1]))
+    np.add.at(F, labels, X)
+    np.add.at(S, labels, X ** 2)
+    return m_step(N, F, S)
+
+
+def em_iterations(chunks, weights, means, covars, n_iter, tol=1e-3, reg_covar=1e-6, estep=e_step):
+    # 运行最多 n_iter 次流式 EM, 平均对数似然变化小于 tol 时停止
+    # estep 与 e_step 接口相同, 可以替换为分片并行的实现 (见 ubm_shard.py)
+    # 返回 (weights, means, covars, 平均对数似然, 迭代次数, 是否收敛)
+    prev_llk = -np.inf
+    avg_llk = -np.inf
+    converged = False
+    it = -1
+    for it in range(n_iter):
+        start = time.time()
+        N, F, S, llk, T = estep(chunks, weights, means, covars)
+        weights, means, covars = m_step(N, F, S, reg_covar)
+        avg_llk = llk / T
+        print("EM iter %d: avg llk %.4f, %.2fs" % (it + 1, avg_llk, time.time() - start))
+        if abs(avg_llk - prev_llk) < tol:
+            converged = True
+            break
+        prev_llk = avg_llk
+    return weights, means, covars, avg_llk, it + 1, converged
+
+
+def make_gmm(weights, means, covars, lower_bound=None, n_iter=0, converged=True):
+    # 由参数构造已训练好的 sklearn GaussianMixture, SpeakerIdentifier 和 GMM_MAP 可以直接使用
+    M, D = means.shape
+    gmm = GMM(n_components=M, covariance_type='diag')
+    gmm.weights_ = weights
+    gmm.means_ = means
+    gmm.covariances_ = covars
+    gmm.precisions_ = 1.0 / covars
+    gmm.precisions_cholesky_ = 1.0 / np.sqrt(covars)
+    gmm.converged_ = converged
+    gmm.n_iter_ = n_iter
+    gmm.lower_bound_ = lower_bound if lower_bound is not None else -np.inf
+    gmm.n_features_in_ = D
+    return gmm
+
+
+def global_stats(chunks, estep=e_step):
+    # 全部帧的均值和方差, 即 1 个高斯成分的 UBM (所有帧的后验概率都是 1)
+    D = next(iter(chunks)).shape[1]
+    N, F, S, _, _ = estep(chunks, np.ones(1), np.zeros((1, D)), np.ones((1, D)))
+    return m_step(N, F, S)
+
+
+def split_mixtures(weights, means, covars, n_split, eps=0.2):
+    # 把权重最大的 n_split 个成分各分裂为两个, 均值沿标准差方向扰动 +/- eps
+    order = np.argsort(-weights)[:n_split]
+    offset = eps * np.sqrt(covars[order])
+    weights = weights.copy()
+    weights[order] /= 2
+    means = np.concatenate([means, means[order] + offset], axis=0)
+    means[order] -= offset
+    return (np.concatenate([weights, weights[order]]),
+            means,
+            np.concatenate([covars, covars[order]], axis=0))
+
+
+def train_ubm_split(chunks, n_mix, n_iter=50, split_iters=4, frames_per_mix=None, tol=1e-3, reg_covar=1e-6,
+                    estep=e_step):
+    """
+    二分裂训练 UBM: 从 1 个高斯开始, 每次把成分数翻倍 (最后一次只分裂到 n_mix),
+    每个中间规模只做 split_iters 次 EM, 达到 n_mix 后最多做 n_iter 次 EM
+    frames_per_mix 不为空时, 中间规模 M 只在约 frames_per_mix * M 帧的抽样上训练
+    estep 用于全部帧上的 E 步, 抽样上的 E 步始终在本进程中完成
+    返回 sklearn GaussianMixture (对角协方差)
+    """
+    weights, means, covars = global_stats(chunks, estep)
+
+    sizes = []
+    M = 1
+    while M < n_mix:
+        M = min(2 * M, n_mix)
+        sizes.append(M)
+
+    # 中间规模共用一份抽样, 规模越小抽得越稀
+    subsample = None
+    if frames_per_mix is not None and len(sizes) > 1:
+        n_samples = frames_per_mix * sizes[-2]
+        if n_samples < chunks.n_frames:
+            subsample = sample_frames(chunks, n_samples)
+
+    for M in sizes[:-1]:
+        weights, means, covars = split_mixtures(weights, means, covars, M - len(weights))
+        if subsample is not None and frames_per_mix * M < chunks.n_frames:
+            step = max(1, subsample.shape[0] // (frames_per_mix * M))
+            data, data_estep = [subsample[::step]], e_step
+            print("split to %d mixtures (%d frames)" % (M, data[0].shape[0]))
+        else:
+            data, data_estep = chunks, estep
+            print("split to %d mixtures (%d frames)" % (M, chunks.n_frames))
+        weights, means, covars, _, _, _ = em_iterations(data, weights, means, covars, split_iters, tol, reg_covar,
+                                                        data_estep)
+
+    weights, means, covars = split_mixtures(weights, means, covars, n_mix - len(weights))
+    print("split to %d mixtures (%d frames)" % (n_mix, chunks.n_frames))
+    weights, means, covars, avg_llk, n, converged = em_iterations(chunks, weights, means, covars,
+                                                                  n_iter, tol, reg_covar, estep)
+    return make_gmm(weights, means, covars, avg_llk, n, converged)
+
+
+def train_ubm_streaming(chunks, n_mix, n_iter=50, tol=1e-3, reg_covar=1e-6, init_samples=100000, estep=e_step):
+    """
+    流式训练 UBM, chunks 为 FrameChunks
+    estep 默认在本进程中完成, 也可以传入 ubm_shard.ShardedEStep 分片并行
+    返回 sklearn GaussianMixture (对角协方差)
+    """
+    weights, means, covars = init_kmeans(chunks, n_mix, init_samples)
+    weights, means, covars, avg_llk, n, converged = em_iterations(chunks, weights, means, covars,
+                                                                  n_iter, tol, reg_covar, estep)
+    return make_gmm(weights, means, covars, avg_llk, n, converged)
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import time
+import numpy as np
+from multiprocessing import Pool
+from fea_archive import open_features
+from frame_select import FrameSelector
+from ubm_em import FrameChunks, e_step, sample_frames
+
+# 分片 map-reduce EM
+# 驱动进程把语音按帧数均分为若干分片, 写入 work_dir/shards.json
+# 每次迭代:
+#   1. 驱动进程把当前 UBM 参数写入 work_dir/params_<iter>.npz
+#   2. 每个分片的 worker 在自己的语音上做 E 步, 把统计量写入 work_dir/stats_<iter>_<shard>.npz
+#   3. 驱动进程读取并累加全部统计量, 由 ubm_em.m_step 完成 M 步
+# worker 可以是本机进程池中的进程, 也可以是其他主机上的任务 (需要共享文件系统), 由 launch_cmd 启动:
+#   python ubm_shard.py --work-dir <work_dir> --iter <iter> --shard <shard>
+
+SHARDS_FILE = 'shards.json'
+
+# worker 进程中打开过的特征集合, 进程池中的进程在多次迭代间复用
+_feats_cache = {}
+
+
+def params_path(work_dir, it):
+    return os.path.join(work_dir, 'params_%d.npz' % it)
+
+
+def stats_path(work_dir, it, shard):
+    return os.path.join(work_dir, 'stats_%d_%d.npz' % (it, shard))
+
+
+def save_npz(path, **arrays):
+    # 先写临时文件再替换, 其他主机上的读取方不会读到写了一半的文件
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def split_shards(feats, keys, n_shards):
+    # 按帧数把语音顺序均分为 n_shards 份
+    lengths = np.array([feats[key].shape[0] for key in keys])
+    bounds = np.searchsorted(np.cumsum(lengths), np.arange(1, n_shards) * lengths.sum() / n_shards)
+    shards = np.split(np.arange(len(keys)), bounds)
+    return [[keys[i] for i in shard] for shard in shards]
+
+
+def accumulate_shard(work_dir, it, shard):
+    # worker: 在一个分片上做第 it 次迭代的 E 步, 统计量写入文件
+    with open(os.path.join(work_dir, SHARDS_FILE), 'rt') as f:
+        config = json.load(f)
+    fea_path = config['fea_path']
+    if fea_path not in _feats_cache:
+        _feats_cache[fea_path] = open_features(fea_path)
+    feats = _feats_cache[fea_path]
+    selector = FrameSelector.from_config(config['selector']) if config['selector'] else None
+    chunks = FrameChunks(feats, config['shards'][shard], config['chunk_frames'], selector)
+
+    params = np.load(params_path(work_dir, it))
+    N, F, S, llk, T = e_step(chunks, params['weights'], params['means'], params['covars'])
+    save_npz(stats_path(work_dir, it, shard), N=N, F=F, S=S, llk=llk, T=T)
+    return shard
+
+
+def _accumulate_job(job):
+    return accumulate_shard(*job)
+
+
+class ShardedEStep:
+    """
+    分片并行的 E 步, 接口与 ubm_em.e_step 相同, 可以传给 train_ubm_streaming / train_ubm_split
+    调用时传入的 chunks 不再使用, 始终在初始化时划分好的全部分片上计算
+    launch_cmd 为空时使用本机进程池 (n_workers 个进程)
+    否则为启动一个 worker 的命令模板, 可用 {work_dir} {iter} {shard}, 例如
+        ssh node{shard} "cd /data/GMM_UBM && python ubm_shard.py --work-dir {work_dir} --iter {iter} --shard {shard}"
+    """
+    def __init__(self, chunks, fea_path, n_shards, work_dir, launch_cmd=None, n_workers=None):
+        self.work_dir = os.path.abspath(work_dir)
+        self.n_shards = n_shards
+        self.launch_cmd = launch_cmd
+        self.it = 0
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        shards = split_shards(chunks.feats, chunks.keys, n_shards)
+        config = {'fea_path': os.path.abspath(fea_path),
+                  'chunk_frames': chunks.chunk_frames,
+                  'selector': chunks.selector.to_config() if chunks.selector is not None else None,
+                  'shards': shards}
+        with open(os.path.join(self.work_dir, SHARDS_FILE), 'wt') as f:
+            json.dump(config, f)
+        print("split %d utterances into %d shards in %s" % (len(chunks.keys), n_shards, self.work_dir))
+
+        self.pool = None
+        if launch_cmd is None:
+            self.pool = Pool(processes=min(n_workers or os.cpu_count() or 1, n_shards))
+
+    def _run_shards(self, it):
+        if self.pool is not None:
+            self.pool.map(_accumulate_job, [(self.work_dir, it, shard) for shard in range(self.n_shards)])
+            return
+        procs = []
+        for shard in range(self.n_shards):
+            cmd = self.launch_cmd.format(work_dir=shlex.quote(self.work_dir), iter=it, shard=shard)
+            procs.append((shard, subprocess.Popen(cmd, shell=True)))
+        for shard, proc in procs:
+            if proc.wait() != 0:
+                raise RuntimeError("分片 %d 的 worker 失败, 返回码 %d" % (shard, proc.returncode))
+
+    def __call__(self, chunks, weights, means, covars):
+        self.it += 1
+        it = self.it
+        save_npz(params_path(self.work_dir, it), weights=weights, means=means, covars=covars)
+
+        start = time.time()
+        self._run_shards(it)
+
+        # reduce: 累加各分片的统计量
+        N, F, S, llk, T = 0, 0, 0, 0.0, 0
+        for shard in range(self.n_shards):
+            path = stats_path(self.work_dir, it, shard)
+            with np.load(path) as stats:
+                N = N + stats['N']
+                F = F + stats['F']
+                S = S + stats['S']
+                llk += float(stats['llk'])
+                T += int(stats['T'])
+            os.remove(path)
+        os.remove(params_path(self.work_dir, it))
+        print("sharded E-step %d: %d shards, %.2fs" % (it, self.n_shards, time.time() - start))
+        return N, F, S, llk, T
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def check_sharded_estep(chunks, estep, n_mix, rtol=1e-6):
+    """
+    用同一组参数分别做一次单进程 e_step 和分片 E 步, 统计量不一致时抛出 RuntimeError
+    参数: 抽样帧中等间隔的 n_mix 帧为均值, 全局方差, 均匀权重
+    """
+    X = sample_frames(chunks, max(n_mix * 20, 1000))
+    means = X[np.linspace(0, len(X) - 1, n_mix).astype(int)]
+    covars = np.tile(X.var(axis=0) + 1e-6, (n_mix, 1))
+    weights = np.full(n_mix, 1.0 / n_mix)
+    ref = e_step(chunks, weights, means, covars)
+    sharded = estep(chunks, weights, means, covars)
+    for name, a, b in zip(('N', 'F', 'S', 'llk', 'T'), ref, sharded):
+        if not np.allclose(a, b, rtol=rtol, atol=0):
+            raise RuntimeError("分片 E 步的统计量 %s 与单进程不一致, 最大相对误差 %.3g"
+                               % (name, np.max(np.abs(np.asarray(a) - b) / np.maximum(np.abs(a), 1e-300))))
+    print("sharded E-step matches single-process statistics (rtol %g)" % rtol)
+
+if __name__ == "__main__":
+    # 单个 worker 的入口, 由 ShardedEStep 的 launch_cmd 在本机或其他主机上启动
+    parser = argparse.ArgumentParser(description="分片 EM 的 worker: 在一个分片上做 E 步")
+    parser.add_argument('--work-dir', required=True)
+    parser.add_argument('--iter', type=int, required=True)
+    parser.add_argument('--shard', type=int, required=True)
+    args = parser.parse_args()
+    accumulate_shard(args.work_dir, args.iter, args.shard)
@@ -4,24 +4,218 @@ import sounddevice as sd
 import numpy as np
 import traceback
 import sys
+import queue
+import threading
+
+# --- 录音缓冲区 ---
+class AudioRingBuffer:
+    """
+    预分配的 float32 录音缓冲区 [帧数 x 声道]。
+    只有录音回调一个线程写入：先写数据，再更新写入位置 frames_written，读者不需要加锁。
+    max_frames 为 None 时容量用完后按倍增长 (只在容量用完时分配一次，不是每块都分配)；
+    否则为固定容量的环形缓冲区，只保留最近 max_frames 帧。环形时每帧同时写在位置 i 和 i + max_frames，
+    最近 max_frames 帧总是一段连续内存，view() 不需要拼接。
+    """
+    def __init__(self, channels, initial_frames, max_frames=None):
+        self.channels = channels
+        self.max_frames = max_frames
+        if max_frames is None:
+            self._buffer = np.zeros((max(initial_frames, 1), channels), dtype=np.float32)
+        else:
+            self._buffer = np.zeros((2 * max_frames, channels), dtype=np.float32)
+        self.frames_written = 0 # 开始录音以来写入的总帧数
+
+    def clear(self):
+        self.frames_written = 0
+
+    def __len__(self):
+        if self.max_frames is None:
+            return self.frames_written
+        return min(self.frames_written, self.max_frames)
+
+    @property
+    def dropped_frames(self):
+        # 超过 max_frames 后被覆盖的最早的帧数
+        return self.frames_written - len(self)
+
+    def write(self, block):
+        """
+        写入 [帧数 x 声道] 的音频块，返回缓冲区中这一块的视图。
+        """
+        n = len(block)
+        written = self.frames_written
+        if self.max_frames is None:
+            if written + n > len(self._buffer):
+                grown = np.zeros((max(2 * len(self._buffer), written + n), self.channels), dtype=np.float32)
+                grown[:written] = self._buffer[:written]
+                self._buffer = grown
+            self._buffer[written:written + n] = block
+            self.frames_written = written + n
+            return self._buffer[written:written + n]
+
+        cap = self.max_frames
+        if n > cap:
+            written += n - cap
+            block = block[n - cap:]
+            n = cap
+        pos = written % cap
+        first = min(n, cap - pos)
+        # [pos, pos + n) 中 cap 之前是主位置，之后是开头几帧的镜像；再补上另一份
+        self._buffer[pos:pos + n] = block
+        self._buffer[pos + cap:pos + cap + first] = block[:first]
+        self._buffer[:n - first] = block[first:]
+        self.frames_written = written + n
+        return self._buffer[pos:pos + n]
+
+    def view(self):
+        """
+        已录制部分 (环形时为最近 max_frames 帧) 的视图，不复制数据。
+        视图指向缓冲区本身，下一次 clear() 后继续写入会覆盖其中的数据，需要长期保留时请自行复制。
+        """
+        written = self.frames_written
+        if self.max_frames is None:
+            return self._buffer[:written]
+        if written <= self.max_frames:
+            return self._buffer[:written]
+        pos = written % self.max_frames
+        return self._buffer[pos:pos + self.max_frames]
+
+
+# --- 端点检测 ---
+class EnergyEndpointer:
+    """
+    基于能量的端点检测 (VAD)。
+    录音时每个音频块计算一次平均能量 (dBFS)：能量比噪声基底高 threshold_db 分贝且不低于 min_speech_db 的块为语音，
+    噪声基底取非语音块能量的滑动平均 (遇到更低的能量时立即下降)。
+    累计语音达到 min_speech_duration 秒后，连续静音超过 silence_duration 秒即认为一句话结束。
+    录音结束后 speech_range() 按 20ms 的帧重新判定，去掉首尾静音，两端各保留 padding 秒。
+    """
+    def __init__(self, samplerate, threshold_db=10.0, silence_duration=0.8, min_speech_duration=0.2,
+                 padding=0.2, initial_noise_db=-50.0, min_speech_db=-55.0):
+        self.samplerate = samplerate
+        self.threshold_db = threshold_db
+        self.silence_frames = int(silence_duration * samplerate)
+        self.min_speech_frames = int(min_speech_duration * samplerate)
+        self.padding_frames = int(padding * samplerate)
+        self.initial_noise_db = initial_noise_db
+        self.min_speech_db = min_speech_db
+        self.frame_length = samplerate // 50
+        self.reset()
+
+    def reset(self):
+        self.noise_db = self.initial_noise_db
+        self.speech_frames = 0 # 累计的语音帧数 (采样点)
+        self.trailing_silence = 0 # 最后一段语音之后的静音帧数
+        self.endpoint_detected = False
+
+    @staticmethod
+    def _energy_db(x):
+        return 10.0 * np.log10(float(np.dot(x, x)) / max(len(x), 1) + 1e-12)
+
+    def _is_speech(self, energy_db, noise_db):
+        return energy_db > max(noise_db + self.threshold_db, self.min_speech_db)
+
+    def process(self, block):
+        """
+        处理一个 [帧数 x 声道] 的录音块 (只看第一个声道)，检测到一句话结束时返回 True (每次录音只返回一次)。
+        只做一次点积，不分配缓冲区，可以在录音回调中调用。
+        """
+        x = block[:, 0] if block.ndim > 1 else block
+        energy_db = self._energy_db(x)
+        if self._is_speech(energy_db, self.noise_db):
+            self.speech_frames += len(x)
+            self.trailing_silence = 0
+        else:
+            self.noise_db = min(energy_db, 0.9 * self.noise_db + 0.1 * energy_db)
+            self.trailing_silence += len(x)
+        if (not self.endpoint_detected and self.speech_frames >= self.min_speech_frames
+                and self.trailing_silence >= self.silence_frames):
+            self.endpoint_detected = True
+            return True
+        return False
+
+    def speech_range(self, audio):
+        """
+        返回 audio 中语音部分的采样点范围 (start, end)，两端各保留 padding；没有语音时返回 (0, 0)。
+        噪声基底取录音时的估计和各帧能量 10% 分位数中较低的一个。
+        """
+        x = audio[:, 0] if audio.ndim > 1 else audio
+        n = len(x) // self.frame_length
+        if n == 0:
+            return 0, 0
+        frames = x[:n * self.frame_length].reshape(n, self.frame_length).astype(np.float64)
+        energy_db = 10.0 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+        noise_db = min(self.noise_db, float(np.percentile(energy_db, 10)))
+        speech = np.flatnonzero(self._is_speech(energy_db, noise_db))
+        if len(speech) == 0:
+            return 0, 0
+        start = max(0, int(speech[0]) * self.frame_length - self.padding_frames)
+        end = min(len(x), (int(speech[-1]) + 1) * self.frame_length + self.padding_frames)
+        return start, end
+
+
 # --- 音频录制类 ---
 class AudioRecorder:
-    def __init__(self, samplerate=16000, channels=1, blocksize=1024):
+    def __init__(self, samplerate=16000, channels=1, blocksize=1024, max_duration=None, initial_duration=30.0):
         """
         初始化音频录制器。
         Args:
             samplerate (int): 采样率，默认为 16000 Hz。
             channels (int): 声道数，默认为 1 (单声道)。
             blocksize (int): 每次回调处理的音频帧数。
+            max_duration (float): 最多保留的录音秒数，超过后只保留最近 max_duration 秒；None 为不限制。
+            initial_duration (float): 不限制时长时预先分配的录音秒数，录音更长时缓冲区按倍增长。
         """
         self.samplerate = samplerate
         self.channels = channels
         self.blocksize = blocksize
+        self.max_duration = max_duration
         self._is_recording = False
-        self._audio_data = [] # 存储录制的音频数据块
+        max_frames = int(max_duration * samplerate) if max_duration else None
+        self._audio_buffer = AudioRingBuffer(channels, int(initial_duration * samplerate), max_frames) # 预分配的录音缓冲区
         self._stream = None
+        self._block_consumer = None
+        self._endpointer = None
+        self._on_endpoint = None
+        self._block_queue = None
+        self._consumer_thread = None
         print(f"初始化录音器，采样率: {self.samplerate}, 声道: {self.channels}")
 
+    def set_block_consumer(self, consumer):
+        """
+        设置音频块的处理函数 consumer(block)，block 为录音缓冲区中 [帧数 x 声道] 的 float32 视图，None 表示取消。
+        回调函数只把音频块放进队列，由单独的线程按顺序调用 consumer，不占用实时音频回调的时间；
+        stop_recording 返回前会等队列中的音频块全部处理完。需要在 start_recording 之前设置。
+        """
+        self._block_consumer = consumer
+
+    def set_endpointer(self, endpointer, on_endpoint=None):
+        """
+        设置端点检测 (EnergyEndpointer)，None 表示取消。录音回调中每个音频块都交给 endpointer.process，
+        检测到一句话结束时调用 on_endpoint()。on_endpoint 在音频线程中调用，
+        不能在其中直接调用 stop_recording，应通知其他线程停止录音 (例如发送 Qt 信号)。
+        """
+        self._endpointer = endpointer
+        self._on_endpoint = on_endpoint
+
+    def _consume_blocks(self, block_queue, consumer):
+        while True:
+            block = block_queue.get()
+            if block is None:
+                break
+            try:
+                consumer(block)
+            except Exception as e:
+                print(f"警告: 处理音频块失败: {e}")
+
+    def _append_block(self, block):
+        # 直接写入预分配的缓冲区，交给消费线程的是缓冲区中这一块的视图
+        view = self._audio_buffer.write(block)
+        if self._block_queue is not None:
+            self._block_queue.put_nowait(view)
+        if self._endpointer is not None and self._endpointer.process(view) and self._on_endpoint is not None:
+            self._on_endpoint()
+
     def _callback(self, indata, frames, time_info, status):
         """
         录音流的回调函数。每当有新的音频数据块可用时被调用。
@@ -30,14 +224,14 @@ class AudioRecorder:
             print(f"录音状态警告: {status}")
         if self._is_recording:
             if indata.dtype == np.float32 and indata.ndim == 2 and indata.shape[1] == self.channels:
-                 self._audio_data.append(indata.copy())
+                 self._append_block(indata)
             else:
                  print(f"警告: 录音回调接收到非预期的 indata 类型/形状: {indata.dtype}, {indata.shape}")
                  try:
                      converted_data = indata.astype(np.float32)
                      if converted_data.ndim > 1:
                           converted_data = converted_data[:, 0]
-                     self._audio_data.append(converted_data[:, np.newaxis])
+                     self._append_block(converted_data[:, np.newaxis])
                  except Exception as e:
                       print(f"警告: 录音回调数据转换失败: {e}")
 
@@ -52,7 +246,15 @@ class AudioRecorder:
 
         print("开始录音...")
         self._is_recording = True
-        self._audio_data = []
+        self._audio_buffer.clear()
+        if self._endpointer is not None:
+            self._endpointer.reset()
+        if self._block_consumer is not None:
+            self._block_queue = queue.Queue()
+            self._consumer_thread = threading.Thread(target=self._consume_blocks,
+                                                     args=(self._block_queue, self._block_consumer),
+                                                     daemon=True)
+            self._consumer_thread.start()
         try:
             input_device_index = sd.default.device[0]
             device_info = sd.query_devices(input_device_index, 'input')
@@ -73,11 +275,21 @@ class AudioRecorder:
             print(f"错误信息: {e}")
             self._is_recording = False
             self._stream = None
+            self._stop_consumer()
+
+    def _stop_consumer(self):
+        # 等待队列中剩下的音频块处理完
+        if self._consumer_thread is not None:
+            self._block_queue.put(None)
+            self._consumer_thread.join()
+        self._block_queue = None
+        self._consumer_thread = None
 
 
     def stop_recording(self):
         """
         停止录音并返回录制的音频数据和采样率。
+        返回的音频数据是录音缓冲区的视图 (不复制)，下一次 start_recording 后会被覆盖。
         """
         if not self._is_recording:
             print("未在录音中...")
@@ -90,23 +302,17 @@ class AudioRecorder:
             self._stream.close()
             self._stream = None
             print("录音已停止，流已关闭。")
+        self._stop_consumer()
 
-        if not self._audio_data:
+        if len(self._audio_buffer) == 0:
             print("没有录制到音频数据。")
             return np.array([]), self.samplerate
 
-        try:
-            if self.channels > 1:
-                recorded_data = np.vstack(self._audio_data)
-            else:
-                 recorded_data = np.concatenate(self._audio_data, axis=0)
-
-            print(f"录制完成，数据形状: {recorded_data.shape}, 采样率: {self.samplerate}")
-            return recorded_data, self.samplerate
-        except Exception as e:
-            print(f"拼接音频数据失败: {e}")
-            print(f"错误信息: {e}")
-            return np.array([]), self.samplerate
+        if self._audio_buffer.dropped_frames:
+            print(f"录音超过 {self.max_duration} 秒，只保留最后 {self.max_duration} 秒。")
+        recorded_data = self._audio_buffer.view()
+        print(f"录制完成，数据形状: {recorded_data.shape}, 采样率: {self.samplerate}")
+        return recorded_data, self.samplerate
 
 # --- 音频播放函数 ---
 def play_audio(audio_data, samplerate):
@@ -1,10 +1,27 @@
 # feature_extractor.py
 
 import numpy as np
-import librosa
-import librosa.display 
+import os
+import sys
 import traceback
 
+# --- MFCC 计算 ---
+# 使用 GMM_UBM/mfcc.py 的 MFCCEngine (只依赖 numpy)，训练和识别共用同一份实现，应用启动时不需要导入 librosa。
+# 特征配置 FEATURE_CONFIG 和指纹算法也来自 GMM_UBM/fea_cache.py (只依赖标准库)。
+_GMM_UBM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'GMM_UBM'))
+if _GMM_UBM_DIR not in sys.path:
+    sys.path.insert(0, _GMM_UBM_DIR)
+from fea_cache import FEATURE_CONFIG, config_fingerprint
+from mfcc import MFCCEngine
+
+
+def feature_fingerprint():
+    """
+    当前特征配置的指纹，训练脚本把它写入 .gmm 模型文件，用于核对模型训练时使用的特征配置。
+    """
+    return config_fingerprint(FEATURE_CONFIG)
+
+
 # --- 特征提取函数 ---
 def extract_features(audio_data, samplerate,
                      n_mfcc=19,
@@ -46,20 +63,9 @@ def extract_features(audio_data, samplerate,
     # print(f"使用特征参数: n_mfcc={n_mfcc}, n_fft={n_fft}, hop_length={hop_length}, win_length={win_length}, n_mels={n_mels}") # Removed detailed print
 
     try:
-        mfccs = librosa.feature.mfcc(y=audio_data,
-                                     sr=samplerate,
-                                     n_mfcc=n_mfcc,
-                                     n_fft=n_fft,
-                                     hop_length=hop_length,
-                                     win_length=win_length,
-                                     n_mels=n_mels)
-        mfccs = librosa.util.normalize(mfccs)
-
-        delta_mfccs = librosa.feature.delta(mfccs, order=1)
-        delta2_mfccs = librosa.feature.delta(mfccs, order=2)
-
-        features = np.concatenate((mfccs, delta_mfccs, delta2_mfccs), axis=0)
-        features = features.T
+        engine = MFCCEngine.get(samplerate, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length,
+                                win_length=win_length, n_mels=n_mels)
+        features = engine.extract(audio_data)
 
         print(f"特征提取完成，特征形状: {features.shape}")
         return features
@@ -67,4 +73,111 @@ def extract_features(audio_data, samplerate,
     except Exception as e:
         print(f"特征提取失败: {e}")
         print(f"错误信息: {e}") # Simplified error output
-        return np.array([])
\ No newline at end of file
+        return np.array([])
+
+# --- 流式特征提取 ---
+class StreamingFeatureExtractor:
+    """
+    录音过程中逐块送入音频，增量完成分帧、加窗、FFT 和梅尔滤波 (特征提取的主要计算量)，
+    保留帧之间重叠的采样点。录音结束时 finish() 只需处理最后不足一帧的数据和梅尔谱之后的少量计算，
+    结果与 extract_features 对整段音频的结果一致 (数值误差范围内)。
+    """
+    def __init__(self, samplerate,
+                 n_mfcc=19,
+                 n_fft=512,
+                 hop_length=160,
+                 win_length=320,
+                 n_mels=20,
+                 top_db=80.0,
+                 delta_width=9):
+        self.samplerate = samplerate
+        self.n_mfcc = n_mfcc
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.delta_width = delta_width
+        self._engine = MFCCEngine.get(samplerate, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length,
+                                      win_length=win_length, n_mels=n_mels, top_db=top_db, delta_width=delta_width)
+        self.reset()
+
+    def reset(self):
+        # librosa 默认 center=True，开头补 n_fft // 2 个 0
+        self._pending = np.zeros(self.n_fft // 2, dtype=np.float32)
+        self._log_mel = [] # 每块得到的对数梅尔谱 [帧数 x n_mels]，finish() 时一次拼接
+        self._context = None # push() 计算差分用的最近几帧对数梅尔谱，从第 _context_start 帧开始
+        self._context_start = 0
+        self._n_frames = 0
+        self._n_emitted = 0
+        self._max_db = -np.inf
+        self._finished = False
+
+    @property
+    def n_frames(self):
+        return self._n_frames
+
+    def push(self, block):
+        """
+        送入一块音频 (一维或 [采样点数 x 声道]，多声道只取第一个声道)。
+        返回新得到的特征帧 [帧数 x 3*n_mfcc]：一阶/二阶差分需要后面 delta_width // 2 帧，
+        所以输出比输入滞后几帧；top_db 截断暂时使用目前为止的最大值，finish() 会用全局最大值重新计算。
+        """
+        if self._finished:
+            raise RuntimeError("finish() 之后需要先调用 reset()")
+        block = self._to_mono(block)
+        self._pending = np.concatenate((self._pending, block))
+        self._analyze()
+
+        half = self.delta_width // 2
+        if self._n_frames < self.delta_width or self._n_frames - half <= self._n_emitted:
+            return np.empty((0, 3 * self.n_mfcc), dtype=np.float32)
+        # 只重算需要输出的帧及其前 half 帧，片段两端按 savgol 边界拟合的帧不输出
+        start = max(0, self._n_emitted - half)
+        features = self._features(self._context[start - self._context_start:], self._max_db)
+        end = self._n_frames - half
+        out = features[self._n_emitted - start:end - start]
+        self._n_emitted = end
+        # 下一次从 end - half 帧开始重算，更早的帧不再需要，每次 push 的计算量与录音长度无关
+        keep = max(0, end - half)
+        self._context = self._context[keep - self._context_start:]
+        self._context_start = keep
+        return out
+
+    def finish(self):
+        """
+        结束输入，返回整段音频的特征 [帧数 x 3*n_mfcc]，与 extract_features 相同；
+        帧数不足以计算差分时返回空数组。
+        """
+        if not self._finished:
+            # 结尾同样补 n_fft // 2 个 0
+            self._pending = np.concatenate((self._pending, np.zeros(self.n_fft // 2, dtype=np.float32)))
+            self._analyze()
+            self._finished = True
+        if self._n_frames < self.delta_width:
+            print("录音太短，无法提取特征。")
+            return np.array([])
+        features = self._features(np.concatenate(self._log_mel, axis=0), self._max_db)
+        print(f"特征提取完成，特征形状: {features.shape}")
+        return features
+
+    def _to_mono(self, block):
+        block = np.asarray(block)
+        if block.ndim > 1:
+            block = block[:, 0]
+        if np.issubdtype(block.dtype, np.integer):
+            iinfo = np.iinfo(block.dtype)
+            return block.astype(np.float32) / max(abs(iinfo.min), abs(iinfo.max))
+        return block.astype(np.float32, copy=False)
+
+    def _analyze(self):
+        # 把 _pending 中所有完整的帧转成对数梅尔谱，剩下的采样点留给下一块
+        n = (len(self._pending) - self.n_fft) // self.hop_length + 1
+        if n <= 0:
+            return
+        log_mel = self._engine.frames_log_mel(self._pending)
+        self._log_mel.append(log_mel)
+        self._context = log_mel if self._context is None else np.concatenate((self._context, log_mel), axis=0)
+        self._n_frames += n
+        self._max_db = max(self._max_db, float(log_mel.max()))
+        self._pending = self._pending[n * self.hop_length:].copy()
+
+    def _features(self, log_mel, max_db):
+        return self._engine.features(self._engine.mfcc(log_mel, max_db))
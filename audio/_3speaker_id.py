@@ -3,81 +3,431 @@
 import numpy as np
 import joblib # 用于加载模型
 import os
+import threading
 import traceback
 import sys
 
 try:
-    from sklearn.mixture import GaussianMixture as GMM
+    from scipy.special import logsumexp
 except ImportError:
     print("Error: scikit-learn is not installed. Please install it using 'pip install scikit-learn'.")
     # Exit handled in main app if essential component fails to load
     # sys.exit(1)
 
+# .gmm 文件的读取和批量打分使用 GMM_UBM 中的实现 (gmm_io, gmm_score)，与训练和评测共用同一份代码
+_GMM_UBM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'GMM_UBM'))
+if _GMM_UBM_DIR not in sys.path:
+    sys.path.insert(0, _GMM_UBM_DIR)
+from gmm_io import GMMFile, load_gmm
+from gmm_score import SpeakerBatch, ubm_top_c
+from model_bank import SpeakerModelBank
+
+
+class _ModelState:
+    """
+    一次加载得到的全部模型：UBM、用户模型、批量打分参数和 S-norm 统计量。
+    加载完成后不再修改，重新加载时整体替换，正在进行的识别继续使用原来的状态。
+    """
+    def __init__(self, signature):
+        self.signature = signature
+        self.ubm_model = None
+        self.user_models = {}
+        self.users = []
+        self.prepared_ubm = None
+        self.speaker_batch = None
+        self.snorm = None
+
+
 class SpeakerIdentifier:
-    def __init__(self, model_dir, ubm_model_file, user_models_files, identification_threshold):
+    def __init__(self, model_dir, ubm_model_file, user_models_files, identification_threshold, model_bank_file=None, top_c=None,
+                 snorm_file=None, snorm_threshold=None, watch_interval=None, feature_fingerprint=None):
         """
         初始化声纹识别器，加载模型。
 
         Args:
             model_dir (str): 模型文件所在的目录。
-            ubm_model_file (str): UBM 模型的文件名。
+            ubm_model_file (str): UBM 模型的文件名，.gmm (GMM_UBM/gmm_io.py 的格式) 或 joblib 保存的 .model。
+                                  文件不存在时尝试另一种扩展名。
             user_models_files (dict): 字典，键是用户ID (str)，值是该用户 GMM 模型的文件名 (str)。
+                                      为 None 或空时扫描 model_dir 下除 UBM 外的全部 .gmm 和 .model 文件，
+                                      文件名 (不含扩展名) 即用户ID，两种文件都存在时使用 .gmm。
             identification_threshold (float): 用于判定的得分阈值。
+            model_bank_file (str): 说话人模型库的文件名 (train_spk_model.py 生成的 .npz)。
+                                   文件存在时从模型库加载 UBM 和其中全部用户，不再使用 ubm_model_file 和 user_models_files。
+            top_c (int): 快速打分，每帧只在 UBM 得分最高的 top_c 个高斯成分上计算 UBM 和用户模型的得分。
+                         None 或 0 时使用全部成分 (model.score)。
+            snorm_file (str): S-norm 得分规整文件名 (GMM_UBM/score_norm.py 生成的 .npz)。
+                              文件存在且包含全部用户时，得分差经过 S-norm 规整后与 snorm_threshold 比较。
+            snorm_threshold (float): 规整后得分的判定阈值，为 None 时使用 identification_threshold。
+            watch_interval (float): 不为 None 时，后台线程每隔 watch_interval 秒检查模型文件的增加、修改和删除，
+                                    有变化时在后台重新加载并整体替换，不阻塞正在进行的识别。
+            feature_fingerprint (str): 当前特征配置的指纹，与 .gmm 模型中记录的不一致时打印警告。
         """
         self.model_dir = model_dir
         self.ubm_model_file = ubm_model_file
         self.user_models_files = user_models_files
+        self.model_bank_file = model_bank_file
         self.identification_threshold = identification_threshold
-        self.ubm_model = None
-        self.user_models = {}
-        self.users = list(user_models_files.keys())
         self.min_frames_for_inference = 10
+        self.top_c = top_c
+        self.snorm_file = snorm_file
+        self.snorm_threshold = snorm_threshold
+        self.feature_fingerprint = feature_fingerprint
+
+        self._state = None
+        self._file_cache = {} # 模型文件路径 -> (文件签名, 加载的模型)，重新加载时未变化的文件不再反序列化
+        self._reload_lock = threading.Lock()
+        self._watch_stop = threading.Event()
+        self._watch_thread = None
+
+        self.reload()
+        if watch_interval:
+            self.start_watching(watch_interval)
+
+    # 当前模型状态的只读视图
+    @property
+    def ubm_model(self):
+        return self._state.ubm_model
+
+    @property
+    def user_models(self):
+        return self._state.user_models
+
+    @property
+    def users(self):
+        return self._state.users
+
+    def _model_files(self, use_bank=True):
+        """
+        当前定义模型的文件 {用途: 路径}。
+        有模型库时为模型库，否则为 UBM 和各用户的 .model 文件；配置了 S-norm 时包括 S-norm 文件。
+        """
+        files = {}
+        bank_path = os.path.join(self.model_dir, self.model_bank_file) if self.model_bank_file else None
+        if use_bank and bank_path and os.path.exists(bank_path):
+            files['bank'] = bank_path
+        else:
+            ubm_path = os.path.join(self.model_dir, self.ubm_model_file)
+            ubm_stem, ubm_ext = os.path.splitext(ubm_path)
+            alt_path = ubm_stem + ('.model' if ubm_ext == '.gmm' else '.gmm')
+            files['ubm'] = alt_path if not os.path.exists(ubm_path) and os.path.exists(alt_path) else ubm_path
+            if self.user_models_files:
+                for user_id, model_file in self.user_models_files.items():
+                    files['user:' + user_id] = os.path.join(self.model_dir, model_file)
+            elif os.path.isdir(self.model_dir):
+                ubm_name = os.path.splitext(self.ubm_model_file)[0]
+                # 按文件名排序，同一用户的 .gmm 排在 .model 之后，覆盖 .model
+                for name in sorted(os.listdir(self.model_dir), key=lambda n: (os.path.splitext(n)[0], n.endswith('.gmm'))):
+                    user_id, ext = os.path.splitext(name)
+                    if ext in ('.gmm', '.model') and user_id != ubm_name:
+                        files['user:' + user_id] = os.path.join(self.model_dir, name)
+        if self.snorm_file:
+            files['snorm'] = os.path.join(self.model_dir, self.snorm_file)
+        return files
+
+    @staticmethod
+    def _file_signature(path):
+        # (修改时间, 大小)，文件不存在时为 None
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _scan(self):
+        files = self._model_files()
+        signature = tuple(sorted((key, path, self._file_signature(path)) for key, path in files.items()))
+        return files, signature
+
+    def has_models(self):
+        """
+        只检查模型文件是否存在，不加载模型。
+        """
+        _, signature = self._scan()
+        present = {key for key, _, sig in signature if sig is not None}
+        return 'bank' in present or ('ubm' in present and any(key.startswith('user:') for key in present))
 
-        self._load_models()
+    def reload(self, force=False):
+        """
+        扫描模型文件，有增加、修改或删除时 (或 force 为 True 时) 重新加载，完成后整体替换当前模型状态。
+        正在进行的识别继续使用原来的状态。返回是否替换了模型。
+        """
+        with self._reload_lock:
+            files, signature = self._scan()
+            old = self._state
+            if old is not None and not force and old.signature == signature:
+                return False
+            state = self._load_state(files, signature)
+            self._state = state
+        if old is not None:
+            added = sorted(set(state.users) - set(old.users))
+            removed = sorted(set(old.users) - set(state.users))
+            print(f"模型已重新加载: 共 {len(state.users)} 个用户，新增 {added}，移除 {removed}")
+        return True
 
-    def _load_models(self):
+    def start_watching(self, interval=2.0):
         """
-        加载 UBM 模型和所有用户的 GMM 模型。
-        使用 joblib.load 加载 sklearn 模型。
+        启动后台线程，每隔 interval 秒检查一次模型文件，有变化时重新加载。
         """
+        if self._watch_thread is not None:
+            return
+        self._watch_stop.clear()
+
+        def watch():
+            while not self._watch_stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"重新加载模型失败: {e}")
+
+        self._watch_thread = threading.Thread(target=watch, name="speaker-model-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._watch_stop.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def _load_state(self, files, signature):
+        state = _ModelState(signature)
         print("开始加载声纹识别模型...")
-        ubm_path = os.path.join(self.model_dir, self.ubm_model_file)
+        if 'bank' not in files or not self._load_model_bank(state, files['bank']):
+            self._load_models(state, self._model_files(use_bank=False) if 'bank' in files else files)
+        self._prepare_batch_scoring(state)
+        if 'snorm' in files:
+            self._load_snorm(state, files['snorm'])
+
+        # 不再使用的文件从缓存中移除
+        used = set(files.values())
+        for path in list(self._file_cache):
+            if path not in used:
+                del self._file_cache[path]
+        return state
+
+    def _cached_load(self, path):
+        # 读取 .gmm 或 joblib 保存的模型，文件签名未变化时直接使用上次加载的对象
+        signature = self._file_signature(path)
+        cached = self._file_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        if path.endswith('.gmm'):
+            model = load_gmm(path)
+            fingerprint = model.feature_fingerprint
+            if self.feature_fingerprint and fingerprint and fingerprint != self.feature_fingerprint:
+                print(f"警告: 模型 {path} 训练时使用的特征配置与当前特征提取不一致")
+        else:
+            # joblib 保存的 sklearn GaussianMixture 转换为同样的参数形式 (GMMFile)
+            model = GMMFile.from_sklearn(joblib.load(path))
+        self._file_cache[path] = (signature, model)
+        return model
+
+    def _load_model_bank(self, state, bank_path):
+        """
+        从说话人模型库一次性加载 UBM 和所有用户的模型。
+        模型库中 UBM 只保存一次，各用户只保存自适应后的均值 (以及可选的权重和方差)。
+        """
+        try:
+            bank = SpeakerModelBank.load(bank_path)
+            # 批量打分参数由模型库的数组直接构造：float32 的均值 (和方差) 只在这里转换一次为 float64，
+            # 只自适应均值时各用户共用 UBM 的权重和精度，不按用户复制
+            batch = SpeakerBatch.from_bank(bank)
+        except Exception as e:
+            print(f"加载模型库失败: {bank_path} - {e}")
+            print(f"错误信息: {e}")
+            return False
+
+        # 各用户的模型是模型库数组和批量打分参数的视图，不另外拷贝
+        ubm = GMMFile.from_covars(bank.ubm_weights, bank.ubm_means, bank.ubm_covars)
+        state.ubm_model = ubm
+        for row, user_id in enumerate(bank.speakers):
+            user_weights = ubm.weights if bank.weights is None else bank.weights[row]
+            if batch.shared_precs:
+                state.user_models[user_id] = GMMFile(user_weights, bank.means[row], ubm.precisions, ubm.log_det)
+            else:
+                precs = batch.precs[row]
+                state.user_models[user_id] = GMMFile(user_weights, bank.means[row], precs, -np.sum(np.log(precs), axis=1))
+        state.users = list(bank.speakers)
+        state.speaker_batch = batch
+        print(f"成功加载模型库: {bank_path}，共 {len(bank)} 个用户")
+        return True
+
+    def _load_models(self, state, files):
+        """
+        加载 UBM 模型和 files 中所有用户的模型 (.gmm 文件和 joblib 保存的 sklearn GMM 都加载为 gmm_io.GMMFile)。
+        """
+        ubm_path = files['ubm']
         try:
-            self.ubm_model = joblib.load(ubm_path)
+            state.ubm_model = self._cached_load(ubm_path)
             print(f"成功加载 UBM 模型: {ubm_path}")
-            if not isinstance(self.ubm_model, GMM):
-                print(f"警告: 加载的 UBM 模型对象类型不是 sklearn GaussianMixture: {type(self.ubm_model)}")
         except FileNotFoundError:
             print(f"错误: 未找到 UBM 模型文件: {ubm_path}")
-            self.ubm_model = None
+            state.ubm_model = None
         except Exception as e:
             print(f"加载 UBM 模型失败: {ubm_path} - {e}")
             print(f"错误信息: {e}") # Simplified error output
-            self.ubm_model = None
+            state.ubm_model = None
 
-        for user_id, model_file in self.user_models_files.items():
-            model_path = os.path.join(self.model_dir, model_file)
+        for key, model_path in files.items():
+            if not key.startswith('user:'):
+                continue
+            user_id = key[len('user:'):]
+            state.users.append(user_id)
             try:
-                self.user_models[user_id] = joblib.load(model_path)
+                state.user_models[user_id] = self._cached_load(model_path)
                 print(f"成功加载用户 {user_id} 的模型: {model_path}")
-                if not isinstance(self.user_models[user_id], GMM):
-                     print(f"警告: 加载的用户 {user_id} 模型对象类型不是 sklearn GaussianMixture: {type(self.user_models[user_id])}")
             except FileNotFoundError:
                 print(f"错误: 未找到用户 {user_id} 的模型文件: {model_path}")
-                self.user_models[user_id] = None
+                state.user_models[user_id] = None
             except Exception as e:
                 print(f"加载用户 {user_id} 的模型失败: {model_path} - {e}")
                 print(f"错误信息: {e}") # Simplified error output
-                self.user_models[user_id] = None
+                state.user_models[user_id] = None
 
-        if self.ubm_model is None or not any(self.user_models.values()):
+        if state.ubm_model is None or not any(state.user_models.values()):
              print("警告: 并非所有必需的模型都加载成功，识别功能可能受限或无法使用。")
 
 
+    def _prepare_batch_scoring(self, state):
+        """
+        把 UBM 和全部已加载的用户模型的参数预先计算并堆叠，供批量打分使用 (模型库在加载时已经构造)。
+        失败时 (例如用户模型的成分数不一致) 识别退回逐个模型调用 .score()。
+        """
+        users = [user_id for user_id, model in state.user_models.items() if model is not None]
+        if state.ubm_model is None or not users:
+            return
+        try:
+            state.prepared_ubm = state.ubm_model.prepared()
+            if state.speaker_batch is None:
+                # 各用户的 .gmm 模型保持只读 memmap，只在这里堆叠为 [用户数 x 成分数 x 维度] 的 float64 数组：
+                # 每个用户拷贝一次均值和精度 (2 * M * D 个 float64)，之后打分不再访问模型文件
+                models = [state.user_models[user_id] for user_id in users]
+                state.speaker_batch = SpeakerBatch(users, np.stack([model.weights for model in models]),
+                                                   np.stack([model.means for model in models]),
+                                                   np.stack([model.precisions for model in models]),
+                                                   np.stack([model.log_det for model in models]))
+            mode = f"top-{self.top_c} 快速打分" if self.top_c else "全部成分打分"
+            print(f"已准备 {len(users)} 个用户的批量打分 ({mode})")
+        except Exception as e:
+            print(f"准备批量打分失败，将逐个模型打分: {e}")
+            state.prepared_ubm = None
+            state.speaker_batch = None
+
+    def _load_snorm(self, state, snorm_path):
+        """
+        加载 S-norm 所需的离线统计量：每个用户的 Z-norm 均值/标准差 (对 cohort 语音的得分)
+        和 cohort 模型 (识别时用于计算测试语音的 T-norm 统计量)。
+        """
+        if state.speaker_batch is None or not os.path.exists(snorm_path):
+            return
+        try:
+            with np.load(snorm_path) as data:
+                index = {str(spk): i for i, spk in enumerate(data['speakers'])}
+                users = state.speaker_batch.speakers
+                missing = [user_id for user_id in users if user_id not in index]
+                if missing:
+                    print(f"S-norm 文件中缺少用户 {missing}，不使用得分规整")
+                    return
+                rows = np.array([index[user_id] for user_id in users])
+                cohort_means = data['cohort_means']
+                n_cohort = cohort_means.shape[0]
+                # 只自适应均值的 cohort 模型共用 UBM 的权重和方差，SpeakerBatch 对全部 cohort 模型只计算一次二次项
+                cohort_weights = data['cohort_weights'] if 'cohort_weights' in data else data['cohort_ubm_weights']
+                cohort_covars = data['cohort_covars'] if 'cohort_covars' in data else data['cohort_ubm_covars']
+                state.snorm = {
+                    'z_mean': data['z_mean'][rows],
+                    'z_std': data['z_std'][rows],
+                    'cohort': SpeakerBatch(range(n_cohort), cohort_weights, cohort_means, 1.0 / cohort_covars),
+                    'top_k': int(data['top_k']),
+                }
+                if int(data['top_c']) != (self.top_c or 0):
+                    print(f"警告: S-norm 统计量使用 top-{int(data['top_c'])} 打分计算，当前使用 top-{self.top_c or 0}")
+            print(f"成功加载 S-norm 文件: {snorm_path}，cohort 模型 {n_cohort} 个")
+        except Exception as e:
+            print(f"加载 S-norm 文件失败，不使用得分规整: {snorm_path} - {e}")
+            state.snorm = None
+
+    @staticmethod
+    def _cohort_top_stats(snorm, scores):
+        # 得分最高的 top_k 个 cohort 得分的均值和标准差
+        k = min(snorm['top_k'], scores.shape[0])
+        top = -np.partition(-scores, k - 1)[:k]
+        return top.mean(), max(top.std(), 1e-6)
+
+    def score_all_speakers(self, features):
+        """
+        一次计算一条语音对全部用户的得分差 (GMM - UBM)。
+        top_c 不为 0 时，UBM 在全部成分上计算一次，每帧只保留得分最高的 C 个成分，
+        用户模型只在这些成分上计算 (MAP 自适应后用户模型与 UBM 的成分一一对应)。
+        加载了 S-norm 文件时返回规整后的得分，cohort 模型复用同一次 UBM 计算和 top-C 成分。
+        返回 (用户ID 列表, 得分数组)，无法批量打分时返回 None。
+        """
+        return self._score_all(self._state, features)
+
+    def _score_all(self, state, features):
+        if state.speaker_batch is None:
+            return None
+        try:
+            user_llr, cohort_llr = self._frame_llr(state, np.asarray(features, dtype=np.float64))
+            cohort_scores = None if cohort_llr is None else np.mean(cohort_llr, axis=1)
+            return state.speaker_batch.speakers, self._normalize(state, np.mean(user_llr, axis=1), cohort_scores)
+        except Exception as e:
+            print(f"批量打分失败: {e}")
+            return None
+
+    def _frame_llr(self, state, X):
+        """
+        每帧的得分差 (用户模型 - UBM) [用户数 x 帧数]；加载了 S-norm 时同时返回 cohort 模型的每帧得分差，否则为 None。
+        每帧的得分差只与该帧有关，可以分块计算后累加。
+        """
+        if self.top_c:
+            idx, ubm_frame_llk = ubm_top_c(state.prepared_ubm, X, self.top_c)
+            frame_llk = lambda batch: batch.frame_llk_top(X, idx)
+        else:
+            ubm_frame_llk = logsumexp(state.prepared_ubm.log_prob(X), axis=1)
+            frame_llk = lambda batch: batch.frame_llk(X)
+        user_llr = frame_llk(state.speaker_batch) - ubm_frame_llk
+        cohort_llr = None if state.snorm is None else frame_llk(state.snorm['cohort']) - ubm_frame_llk
+        return user_llr, cohort_llr
+
+    def _normalize(self, state, scores, cohort_scores):
+        # 平均得分差的 S-norm 规整，没有加载 S-norm 时原样返回
+        snorm = state.snorm
+        if snorm is None:
+            return scores
+        t_mean, t_std = self._cohort_top_stats(snorm, cohort_scores)
+        return 0.5 * ((scores - snorm['z_mean']) / snorm['z_std'] + (scores - t_mean) / t_std)
+
+    def _threshold(self, state):
+        if state.snorm is not None and self.snorm_threshold is not None:
+            return self.snorm_threshold
+        return self.identification_threshold
+
+    def start_session(self, early_margin=None, min_frames=100):
+        """
+        开始一次流式打分 (见 ScoringSession)，整个会话使用开始时的模型状态。
+        无法批量打分时返回 None，此时只能在录音结束后调用 identify_speaker。
+        """
+        state = self._state
+        if state.speaker_batch is None:
+            return None
+        return ScoringSession(self, state, self._threshold(state), early_margin,
+                              max(min_frames, self.min_frames_for_inference))
+
+    def rank_speakers(self, features, k=3):
+        """
+        按得分差从高到低返回前 k 个用户 [(用户ID, 得分差)]，无法批量打分时返回空列表。
+        """
+        state = self._state
+        result = self._score_all(state, features)
+        if result is None:
+            return []
+        return state.speaker_batch.top_k(result[1], k)
+
     def _calculate_gmm_score(self, features, model):
         """
         计算特征向量在给定 GMM/UBM 模型下的平均对数似然得分。
-        使用 sklearn GMM 对象的 .score(features) 方法。
+        使用模型 (gmm_io.GMMFile) 打分用参数的 .score(features) 方法。
         """
         if model is None:
             return -float('inf')
@@ -90,11 +440,8 @@ class SpeakerIdentifier:
              return -float('inf')
 
         try:
-            score = model.score(features)
+            score = model.prepared().score(features)
             return score
-        except AttributeError:
-            print("错误: 加载的模型对象没有 .score() 方法。请检查您的模型类型和加载方式是否正确 (应为 sklearn GMM)。")
-            return -float('inf')
         except Exception as e:
             print(f"计算 GMM 得分失败: {e}")
             print(f"错误信息: {e}") # Simplified error output
@@ -104,8 +451,10 @@ class SpeakerIdentifier:
     def identify_speaker(self, features):
         """
         对提取的特征进行声纹识别推理。
+        整个推理过程使用同一个模型状态，期间重新加载的模型从下一次识别开始使用。
         """
-        if self.ubm_model is None or not any(self.user_models.values()):
+        state = self._state
+        if state.ubm_model is None or not any(state.user_models.values()):
             print("模型未完全加载，无法进行识别。")
             return "模型未加载"
 
@@ -118,26 +467,35 @@ class SpeakerIdentifier:
 
         print(f"\n开始进行声纹识别推理...")
 
-        score_ubm = self._calculate_gmm_score(features, self.ubm_model)
-        if score_ubm == -float('inf'):
-             print("计算 UBM 得分失败，推理中止。")
-             return "推理失败"
+        score_diffs = None
+        result = self._score_all(state, features)
+        if result is not None:
+            score_diffs = dict(zip(result[0], result[1].tolist()))
+            label = "S-norm 规整后" if state.snorm is not None else "GMM - UBM"
+            for user_id, score_diff in score_diffs.items():
+                print(f"用户 {user_id} 得分差 ({label}): {score_diff:.4f}")
+        threshold = self._threshold(state) if result is not None else self.identification_threshold
+        if score_diffs is None:
+            score_ubm = self._calculate_gmm_score(features, state.ubm_model)
+            if score_ubm == -float('inf'):
+                 print("计算 UBM 得分失败，推理中止。")
+                 return "推理失败"
 
-        score_diffs = {}
-        for user_id, model in self.user_models.items():
-            if model is None:
-                 print(f"跳过用户 {user_id}，因为模型未加载或加载失败。")
-                 continue
+            score_diffs = {}
+            for user_id, model in state.user_models.items():
+                if model is None:
+                     print(f"跳过用户 {user_id}，因为模型未加载或加载失败。")
+                     continue
 
-            score_gmm = self._calculate_gmm_score(features, model)
-            if score_gmm == -float('inf'):
-                 print(f"计算用户 {user_id} GMM 得分失败。")
-                 score_diffs[user_id] = -float('inf')
-                 continue
+                score_gmm = self._calculate_gmm_score(features, model)
+                if score_gmm == -float('inf'):
+                     print(f"计算用户 {user_id} GMM 得分失败。")
+                     score_diffs[user_id] = -float('inf')
+                     continue
 
-            score_diff = score_gmm - score_ubm
-            score_diffs[user_id] = score_diff
-            print(f"用户 {user_id} 得分差 (GMM - UBM): {score_diff:.4f}")
+                score_diff = score_gmm - score_ubm
+                score_diffs[user_id] = score_diff
+                print(f"用户 {user_id} 得分差 (GMM - UBM): {score_diff:.4f}")
 
         if not score_diffs or all(score == -float('inf') for score in score_diffs.values()):
             print("所有用户得分差计算失败或无效，无法进行比较。")
@@ -152,11 +510,74 @@ class SpeakerIdentifier:
         highest_score_diff = valid_scores[highest_user]
 
         print(f"最高得分差属于用户 {highest_user}: {highest_score_diff:.4f}")
-        print(f"识别阈值: {self.identification_threshold:.4f}")
+        print(f"识别阈值: {threshold:.4f}")
 
-        if highest_score_diff > self.identification_threshold:
+        if highest_score_diff > threshold:
             print(f"判定结果: 用户 {highest_user} (得分差高于阈值)")
             return highest_user
         else:
             print(f"判定结果: 未知用户 (最高得分差低于阈值)")
-            return "未知用户"
\ No newline at end of file
+            return "未知用户"
+
+
+class ScoringSession:
+    """
+    流式打分：录音过程中逐块送入特征帧，累加每个用户 (和 cohort 模型) 的每帧得分差，
+    随时可以得到当前得分最高的用户和领先幅度。送入全部帧后的得分与 score_all_speakers 对整段特征的得分相同。
+    early_margin 不为 None 时，帧数达到 min_frames 后提前判定：
+    最高得分比次高得分和阈值都高出 early_margin 时接受该用户，比阈值低 early_margin 时判为未知用户。
+    由 SpeakerIdentifier.start_session 创建。
+    """
+    def __init__(self, identifier, state, threshold, early_margin=None, min_frames=100):
+        self._identifier = identifier
+        self._state = state
+        self.users = state.speaker_batch.speakers
+        self.threshold = threshold
+        self.early_margin = early_margin
+        self.min_frames = min_frames
+        self.n_frames = 0
+        self.decision = None # 提前判定的结果：用户ID 或 "未知用户"
+        self._sums = np.zeros(len(self.users))
+        self._cohort_sums = None if state.snorm is None else np.zeros(len(state.snorm['cohort']))
+
+    def update(self, features):
+        """
+        送入新的特征帧 [帧数 x 维度]，返回提前判定的结果，尚未判定时返回 None。
+        """
+        if features is None or len(features) == 0:
+            return self.decision
+        user_llr, cohort_llr = self._identifier._frame_llr(self._state, np.asarray(features, dtype=np.float64))
+        self._sums += np.sum(user_llr, axis=1)
+        if cohort_llr is not None:
+            self._cohort_sums += np.sum(cohort_llr, axis=1)
+        self.n_frames += len(features)
+
+        if self.decision is None and self.early_margin is not None and self.n_frames >= self.min_frames:
+            user_id, score, margin = self.best()
+            if score - self.threshold >= self.early_margin and margin >= self.early_margin:
+                self.decision = user_id
+            elif self.threshold - score >= self.early_margin:
+                self.decision = "未知用户"
+            if self.decision is not None:
+                print(f"提前判定 ({self.n_frames} 帧): {self.decision}，最高得分差 {score:.4f}，领先 {margin:.4f}")
+        return self.decision
+
+    def scores(self):
+        """
+        目前为止每个用户的得分差 (加载了 S-norm 时为规整后的得分)，与 self.users 对应；还没有帧时返回 None。
+        """
+        if self.n_frames == 0:
+            return None
+        cohort_scores = None if self._cohort_sums is None else self._cohort_sums / self.n_frames
+        return self._identifier._normalize(self._state, self._sums / self.n_frames, cohort_scores)
+
+    def best(self):
+        """
+        返回 (得分最高的用户, 得分, 领先次高用户的幅度)，只有一个用户时领先幅度为 inf；还没有帧时返回 (None, None, None)。
+        """
+        scores = self.scores()
+        if scores is None:
+            return None, None, None
+        order = np.argsort(-scores, kind='stable')
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else float('inf')
+        return self.users[order[0]], float(scores[order[0]]), margin
@@ -1,15 +1,143 @@
 # baidu_api_client.py
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import base64
+import hashlib
+import os
+import threading
 import time
 import uuid
 import traceback
-import socket 
+from urllib.parse import urlsplit
+
+# 各接口的读取超时 (秒)，连接超时另外设置
+DEFAULT_TIMEOUTS = {"oauth": 10, "asr": 20, "tts": 10, "llm": 60}
+# ASR/TTS Access Token 的默认缓存文件
+DEFAULT_TOKEN_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "gmm_ubm_audio", "baidu_token.json")
+
+
+class OAuthTokenProvider:
+    """
+    OAuth Access Token 的获取和缓存。
+    - Token 和过期时间保存在本地缓存文件 (目录 0700，文件 0600)，重启应用或其他进程直接使用，不必重新获取；
+      缓存按密钥对的哈希区分，不保存密钥本身。
+    - 同一时间只有一个调用者去获取 (single-flight)，其他调用者等待并直接使用它的结果。
+    - start_background_refresh() 之后，后台线程在过期前 refresh_ahead 秒刷新，用户请求不会等待 OAuth。
+    """
+    def __init__(self, fetch, key_id, cache_path=None, refresh_ahead=86400, retry_interval=60):
+        """
+        Args:
+            fetch (callable): 获取新 Token 的函数，返回 (token, 过期时间戳)，失败时返回 (None, 0)。
+            key_id (str): 缓存中区分不同密钥对的标识。
+            cache_path (str): 缓存文件路径，None 时只缓存在内存中。
+            refresh_ahead (float): 后台刷新提前的秒数。
+            retry_interval (float): 后台刷新失败后的重试间隔 (秒)。
+        """
+        self._fetch = fetch
+        self.key_id = key_id
+        self.cache_path = cache_path
+        self.refresh_ahead = refresh_ahead
+        self.retry_interval = retry_interval
+        self._token = None
+        self._expiry_time = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresh_thread = None
+
+    def _valid(self, margin=0):
+        return self._token is not None and time.time() < self._expiry_time - margin
+
+    def get_token(self):
+        """
+        返回有效的 Token：依次使用内存、缓存文件，都已过期时重新获取。获取失败时返回 None。
+        """
+        if self._valid():
+            return self._token
+        return self._refresh(margin=0)
+
+    def _refresh(self, margin):
+        # 剩余有效期不足 margin 秒时获取新 Token；在锁内再检查一次，等待期间其他调用者可能已经刷新
+        with self._lock:
+            if self._valid(margin):
+                return self._token
+            self._load_cache()
+            if self._valid(margin):
+                return self._token
+            token, expiry_time = self._fetch()
+            if token:
+                self._token, self._expiry_time = token, expiry_time
+                self._save_cache()
+                return token
+            return self._token if self._valid() else None
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f).get(self.key_id)
+            if entry and entry["expiry_time"] > self._expiry_time:
+                self._token, self._expiry_time = entry["access_token"], entry["expiry_time"]
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            print(f"读取 Token 缓存失败，将重新获取: {e}")
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            cache_dir = os.path.dirname(self.cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            entries = {}
+            if os.path.exists(self.cache_path):
+                try:
+                    with open(self.cache_path, 'r', encoding='utf-8') as f:
+                        entries = json.load(f)
+                except (OSError, ValueError):
+                    entries = {}
+            entries[self.key_id] = {"access_token": self._token, "expiry_time": self._expiry_time}
+            # 先写临时文件 (创建时即为 0600) 再替换，其他进程不会读到写了一半的文件
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"保存 Token 缓存失败: {e}")
+
+    def start_background_refresh(self):
+        """
+        启动后台刷新线程 (守护线程)，已启动时不重复启动。
+        """
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._stop.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+            self._refresh_thread = None
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            token = self._refresh(margin=self.refresh_ahead)
+            if token is not None and self._valid(self.refresh_ahead):
+                # 到提前刷新的时间再醒来
+                wait = self._expiry_time - self.refresh_ahead - time.time()
+            else:
+                # 获取失败，或 Token 的有效期本身短于 refresh_ahead
+                wait = self.retry_interval
+            self._stop.wait(min(max(wait, self.retry_interval), threading.TIMEOUT_MAX))
+
 
 class BaiduAPIClient:
-    def __init__(self, asr_tts_api_key, asr_tts_secret_key, llm_api_key):
+    def __init__(self, asr_tts_api_key, asr_tts_secret_key, llm_api_key, pool_size=2, connect_timeout=5, timeouts=None,
+                 token_cache_path=DEFAULT_TOKEN_CACHE):
         """
         初始化百度 API 客户端，接收 ASR/TTS 的密钥对和 LLM 的 API Key。
 
@@ -17,16 +145,59 @@ class BaiduAPIClient:
             asr_tts_api_key (str): ASR/TTS 服务的 API Key。
             asr_tts_secret_key (str): ASR/TTS 服务的 Secret Key。
             llm_api_key (str): LLM 服务的 API Key (只有 Key)。
+            pool_size (int): 每个域名保持的长连接数。
+            connect_timeout (float): 建立连接的超时 (秒)。
+            timeouts (dict): 各接口的读取超时，键为 "oauth" / "asr" / "tts" / "llm"，未给出的使用 DEFAULT_TIMEOUTS。
+            token_cache_path (str): ASR/TTS Access Token 的缓存文件，None 时只缓存在内存中。
         """
         self._asr_tts_api_key = asr_tts_api_key
         self._asr_tts_secret_key = asr_tts_secret_key
         self._llm_api_key = llm_api_key # 只存储 LLM API Key
 
-        self._asr_tts_access_token = None
-        self._asr_tts_token_expiry_time = 0
+        key_id = hashlib.sha256(f"{asr_tts_api_key}:{asr_tts_secret_key}".encode('utf-8')).hexdigest()[:16]
+        self._token_provider = OAuthTokenProvider(
+            lambda: self._get_oauth_token(self._asr_tts_api_key, self._asr_tts_secret_key),
+            key_id, token_cache_path)
 
         self.cuid = '123456PYTHON' # 硬编码 CUID
 
+        # 每个域名一个 requests.Session，连接复用 (keep-alive)，一轮对话的几次请求不用重复 TCP + TLS 握手
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+
+
+    def _session(self, url):
+        """
+        返回 url 所在域名的 Session，第一次使用时创建。
+        """
+        host = urlsplit(url).netloc
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _post(self, api, url, **kwargs):
+        # 使用对应域名的长连接发送 POST 请求，超时为 (连接超时, 该接口的读取超时)
+        return self._session(url).post(url, timeout=(self.connect_timeout, self.timeouts[api]), **kwargs)
+
+    def close(self):
+        """
+        停止 Token 后台刷新，关闭所有长连接。
+        """
+        self._token_provider.stop_background_refresh()
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
 
     def _get_oauth_token(self, api_key, secret_key):
         """
@@ -41,7 +212,7 @@ class BaiduAPIClient:
         }
         try:
             print(f"正在获取 OAuth Access Token (Key: {api_key[:8]}...)...")
-            response = requests.post(url, params=params, timeout=10)
+            response = self._post("oauth", url, params=params)
             response.raise_for_status()
             result = response.json()
 
@@ -70,16 +241,15 @@ class BaiduAPIClient:
     # 获取 ASR/TTS Access Token 的方法 (使用 OAuth)
     def get_asr_tts_access_token(self):
         """
-        获取 ASR/TTS 服务当前有效的 Access Token。
+        获取 ASR/TTS 服务当前有效的 Access Token (见 OAuthTokenProvider)。
+        """
+        return self._token_provider.get_token()
+
+    def start_token_refresh(self):
+        """
+        在后台提前刷新 ASR/TTS Access Token，之后的 ASR/TTS 请求不会因 Token 过期而等待。
         """
-        if self._asr_tts_access_token and time.time() < self._asr_tts_token_expiry_time:
-            return self._asr_tts_access_token
-        else:
-            print("ASR/TTS Access Token 已过期或未获取，尝试刷新。")
-            token, expiry_time = self._get_oauth_token(self._asr_tts_api_key, self._asr_tts_secret_key)
-            self._asr_tts_access_token = token
-            self._asr_tts_token_expiry_time = expiry_time
-            return self._asr_tts_access_token
+        self._token_provider.start_background_refresh()
 
 
     def asr(self, audio_data_bytes, audio_format="pcm", sample_rate=16000):
@@ -111,7 +281,7 @@ class BaiduAPIClient:
 
         try:
             print("正在调用百度 ASR API...")
-            response = requests.post(url, data=post_data_bytes, headers=headers, timeout=20)
+            response = self._post("asr", url, data=post_data_bytes, headers=headers)
             response.raise_for_status()
             result = response.json()
 
@@ -160,7 +330,7 @@ class BaiduAPIClient:
 
         try:
             print(f"正在调用百度 TTS API 合成文本: '{text}'...")
-            response = requests.post(url, data=params, timeout=10)
+            response = self._post("tts", url, data=params)
             if 'audio' in response.headers.get('Content-Type', ''):
                 print("TTS 成功，收到音频数据。")
                 return response.content
@@ -196,17 +366,8 @@ class BaiduAPIClient:
         LLM_PATH = "/v2/chat/completions"
         LLM_API_URL = f"https://{LLM_HOSTNAME}{LLM_PATH}"
 
-        try:
-            print(f"工作线程：尝试解析主机名 '{LLM_HOSTNAME}'...")
-            ip_address = socket.gethostbyname(LLM_HOSTNAME)
-            print(f"工作线程：主机名 '{LLM_HOSTNAME}' 解析到 IP: {ip_address}")
-        except socket.gaierror as e:
-            print(f"工作线程：DNS 解析失败: {e}")
-            return f"LLM 调用失败: DNS 解析 '{LLM_HOSTNAME}' 失败 - {e}"
-        except Exception as e:
-            print(f"工作线程：DNS 解析时发生未知错误: {e}")
-            return f"LLM 调用失败: DNS 解析时发生未知错误 - {e}"
-        # *** DNS 解析检查结束 ***
+        # 不再单独解析域名：DNS 失败时 requests 会抛出 ConnectionError，按请求失败处理；
+        # 长连接建立后后续请求不再解析域名
 
 
         # API 请求体结构
@@ -223,7 +384,7 @@ class BaiduAPIClient:
             print(f"工作线程：请求 Header 中的 Authorization: Bearer {llm_api_key[:8]}...")
             print(f"工作线程：请求 Body: {json.dumps(payload)}") # 打印整个 payload
 
-            response = requests.post(LLM_API_URL, headers=headers, data=json.dumps(payload), timeout=60)
+            response = self._post("llm", LLM_API_URL, headers=headers, data=json.dumps(payload))
             response.raise_for_status()
 
             result = response.json()
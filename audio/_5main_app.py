@@ -2,29 +2,25 @@
 
 import sys
 import time
+APP_START = time.perf_counter() # 用于统计启动到可用的时间
 import numpy as np # 用于处理音频数据 (numpy array)
 from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QLabel, QTextEdit
-from PySide6.QtCore import Qt, QThread, Signal, QObject, Slot # 导入 Slot 装饰器
-
-
-from _1audio_utils import AudioRecorder, play_audio
-from _2feature_extractor import extract_features
-from _3speaker_id import SpeakerIdentifier
-from _4baidu_api_client import BaiduAPIClient
+from PySide6.QtCore import Qt, QThread, Signal, QObject, Slot, QTimer # 导入 Slot 装饰器
 
 
 # --- Configuration ---
 MODEL_DIR = "./models" 
 
-UBM_MODEL_FILE = "ubm.model"
-USER_MODELS_FILES = {
-    "liumingfang": "liumingfang.model",
-    "wanghongyi": "wanghongyi.model",
-    "wuwei": "wuwei.model",
-    "zhanglixuan": "zhanglixuan.model",
-
-}
+UBM_MODEL_FILE = "ubm.gmm" # GMM_UBM/train_UBM.py 保存的 .gmm 模型，不存在时使用旧的 ubm.model
+USER_MODELS_FILES = None # None 时扫描 MODEL_DIR 下除 UBM 外的全部 .gmm / .model 文件，文件名即用户ID；也可以写成 {"用户ID": "文件名.gmm"}
+MODEL_BANK_FILE = "spk_bank.npz" # 说话人模型库，存在时代替上面的 UBM 和用户模型文件
 IDENTIFICATION_THRESHOLD = 0.5 # 示例阈值
+TOP_C = 5 # 快速打分：每帧只在 UBM 得分最高的 TOP_C 个高斯成分上打分，0 为全部成分打分
+SNORM_FILE = "snorm.npz" # S-norm 得分规整文件 (GMM_UBM/score_norm.py 生成)，存在时使用规整后的得分
+SNORM_THRESHOLD = 2.0 # 规整后得分的示例阈值
+MODEL_WATCH_INTERVAL = 2.0 # 每隔多少秒检查一次模型文件，有增加、修改或删除时在后台重新加载
+EARLY_DECISION_MARGIN = 1.0 # 录音过程中最高得分领先次高得分和阈值都超过该幅度时提前确认身份，None 为不提前判定
+EARLY_DECISION_MIN_FRAMES = 150 # 提前判定至少需要的特征帧数 (每帧 10ms)
 
 # --- 配置百度 API Key 和 Secret Key ---
 ASR_TTS_API_KEY = "*"
@@ -33,6 +29,10 @@ LLM_API_KEY = "*"
 
 # --- 其他配置 ---
 SAMPLE_RATE = 16000 # 采样率
+MAX_RECORDING_SECONDS = 60 # 录音最长保留的秒数 (百度短语音识别最长 60 秒)，超过后只保留最后这段
+ENDPOINT_SILENCE_SECONDS = 0.8 # 说话后静音超过该秒数时自动停止录音，None 为只能手动停止 (也不去掉首尾静音)
+VAD_THRESHOLD_DB = 10.0 # 能量高于噪声基底多少分贝算作语音
+READY_RETRY_SECONDS = 5.0 # 模型文件或 Token 暂时不可用时，每隔多少秒重新检查一次，可用后自动就绪
 
 # --- 工作线程类 ---
 class Worker(QObject):
@@ -43,47 +43,150 @@ class Worker(QObject):
     tts_audio_ready = Signal(bytes) # TTS 合成音频数据信号 
     error_occurred = Signal(str) # 错误发生信号
     welcome_user = Signal(str) # 用于发送欢迎信息
+    speech_ended = Signal() # 端点检测到一句话结束，请求停止录音
+    ready = Signal(float) # 后台初始化和预热完成，参数为从启动到就绪的秒数
 
 
-    def __init__(self, samplerate, model_dir, ubm_model_file, user_models_files, identification_threshold, baidu_api_key, baidu_secret_key, llm_api_key, parent=None):
+    def __init__(self, samplerate, model_dir, ubm_model_file, user_models_files, identification_threshold, baidu_api_key, baidu_secret_key, llm_api_key, model_bank_file=None, top_c=0, snorm_file=None, snorm_threshold=None, model_watch_interval=None, early_decision_margin=None, early_decision_min_frames=100, max_recording_seconds=None, endpoint_silence_seconds=None, vad_threshold_db=10.0, ready_retry_seconds=5.0, parent=None):
         super().__init__(parent)
-        self._is_running = True
+        self._is_running = False # initialize 完成并预热后才为 True，之前的录音请求直接报错
         self._is_recording_active = False
         self.samplerate = samplerate
+        self.early_decision_margin = early_decision_margin
+        self.early_decision_min_frames = early_decision_min_frames
+        self.scoring_session = None
 
         # 对话历史列表
         self.message_history = []
         self.message_history.append({"role": "system", "content": "你是一个有帮助的助手，请简洁明了地回答问题。"})
 
+        # 模块导入、模型加载、获取 Token 和预热都在工作线程的 initialize 中进行，这里只保存配置
+        self._model_config = (model_dir, ubm_model_file, user_models_files, identification_threshold, model_bank_file, top_c,
+                              snorm_file, snorm_threshold, model_watch_interval)
+        self._baidu_keys = (baidu_api_key, baidu_secret_key, llm_api_key)
+        self._max_recording_seconds = max_recording_seconds
+        self._endpoint_silence_seconds = endpoint_silence_seconds
+        self._vad_threshold_db = vad_threshold_db
+        self._ready_retry_seconds = ready_retry_seconds
+        self._ready_timer = None
+        # 由 initialize 在工作线程中导入后设置
+        self._extract_features = None
+        self._play_audio = None
+        self.recorder = None
+        self.feature_stream = None
+        self.endpointer = None
+        self.speaker_identifier = None
+        self.baidu_client = None
 
-        try:
-            self.recorder = AudioRecorder(samplerate=self.samplerate)
-            self.speaker_identifier = SpeakerIdentifier(model_dir, ubm_model_file, user_models_files, identification_threshold)
-            self.baidu_client = BaiduAPIClient(baidu_api_key,
-                                               baidu_secret_key,
-                                               llm_api_key)
-
-            if (self.speaker_identifier.ubm_model is None or not any(self.speaker_identifier.user_models.values())) or self.baidu_client.get_asr_tts_access_token() is None:
-                 self.error_occurred.emit("模型或API客户端初始化失败，语音功能受限。请检查模型文件和API Key。")
-                 self._is_running = False
 
+    @Slot()
+    def initialize(self):
+        """
+        在工作线程中完成初始化 (连接 QThread.started)：导入耗时模块、加载模型、获取 Token，
+        再用一段静音走一遍特征提取和打分，让第一次识别不再承担一次性的开销。完成后发送 ready 信号。
+        模型文件或 Token 暂时不可用时每隔 ready_retry_seconds 秒重新检查 (模型由后台监视线程加载)，可用后再发送 ready。
+        """
+        self._is_running = False
+        try:
+            self.progress.emit("正在加载模块...")
+            # sounddevice (PortAudio)、sklearn/scipy、requests 导入较慢，在工作线程中导入，不阻塞界面显示
+            from _1audio_utils import AudioRecorder, EnergyEndpointer, play_audio
+            from _2feature_extractor import extract_features, feature_fingerprint, StreamingFeatureExtractor
+            from _3speaker_id import SpeakerIdentifier
+            from _4baidu_api_client import BaiduAPIClient
+            self._extract_features = extract_features
+            self._play_audio = play_audio
+
+            self.recorder = AudioRecorder(samplerate=self.samplerate, max_duration=self._max_recording_seconds)
+            # 录音时在后台逐块提取特征，停止录音时只剩最后一小段需要处理
+            self.feature_stream = StreamingFeatureExtractor(self.samplerate)
+            self.recorder.set_block_consumer(self._process_audio_block)
+            # 端点检测：说话结束后自动停止录音，只把去掉首尾静音的部分用于识别和 ASR
+            if self._endpoint_silence_seconds is not None:
+                self.endpointer = EnergyEndpointer(self.samplerate, threshold_db=self._vad_threshold_db,
+                                                   silence_duration=self._endpoint_silence_seconds)
+                self.recorder.set_endpointer(self.endpointer, self.speech_ended.emit)
+
+            self.progress.emit("正在加载声纹模型...")
+            (model_dir, ubm_model_file, user_models_files, identification_threshold, model_bank_file, top_c,
+             snorm_file, snorm_threshold, model_watch_interval) = self._model_config
+            self.speaker_identifier = SpeakerIdentifier(model_dir, ubm_model_file, user_models_files, identification_threshold, model_bank_file, top_c,
+                                                        snorm_file, snorm_threshold,
+                                                        watch_interval=model_watch_interval,
+                                                        feature_fingerprint=feature_fingerprint())
+
+            self.progress.emit("正在连接百度 API...")
+            self.baidu_client = BaiduAPIClient(*self._baidu_keys)
         except Exception as e:
             self.error_occurred.emit(f"工作线程初始化失败: {e}")
-            self._is_running = False
-
+            return
 
+        if self._check_ready():
+            return
+        self.error_occurred.emit(f"模型或API客户端初始化失败，语音功能受限。请检查模型文件和API Key，"
+                                 f"每隔 {self._ready_retry_seconds:g} 秒自动重试。")
+        # 定时器属于工作线程 (initialize 在工作线程中执行)，重试也在工作线程中进行
+        self._ready_timer = QTimer(self)
+        self._ready_timer.timeout.connect(self._check_ready)
+        self._ready_timer.start(int(self._ready_retry_seconds * 1000))
 
     @Slot()
-    def run(self):
-        if not self._is_running:
-             self.progress.emit("工作线程因初始化失败而停止。")
-             self.finished.emit()
-             return
+    def _check_ready(self):
+        """
+        模型文件存在且能取得 Token 时完成剩余的初始化并发送 ready 信号，返回是否已就绪。
+        """
+        if self._is_running:
+            return True
+        try:
+            if not self.speaker_identifier.has_models() or self.baidu_client.get_asr_tts_access_token() is None:
+                return False
+            if self._ready_timer is not None:
+                self._ready_timer.stop()
+                self._ready_timer = None
+
+            # 模型文件在重试期间才出现时，不等监视线程的下一次检查，立即加载
+            self.speaker_identifier.reload()
 
-        self.progress.emit("工作线程已启动，等待开始信号...")
-        print("工作线程启动，等待开始信号...")
+            self.baidu_client.start_token_refresh()
 
-        self.thread().exec() 
+            self.progress.emit("正在预热...")
+            self._warm_up()
+        except Exception as e:
+            self.error_occurred.emit(f"工作线程初始化失败: {e}")
+            return False
+
+        self._is_running = True
+        elapsed = time.perf_counter() - APP_START
+        print(f"工作线程：初始化和预热完成，启动到可用共 {elapsed:.2f} 秒")
+        self.ready.emit(elapsed)
+        return True
+
+    def _warm_up(self):
+        # 用一秒低电平噪声走一遍流式特征、端点检测、批量打分和流式打分 (滤波器组、FFT、模型参数的首次计算和内存分配)
+        noise = (1e-3 * np.random.default_rng(0).standard_normal((self.samplerate, 1))).astype(np.float32)
+        start = time.perf_counter()
+        self.feature_stream.reset()
+        for i in range(0, len(noise), self.recorder.blocksize):
+            self.feature_stream.push(noise[i:i + self.recorder.blocksize])
+        features = self.feature_stream.finish()
+        if self.endpointer is not None:
+            self.endpointer.speech_range(noise)
+        self.speaker_identifier.score_all_speakers(features)
+        session = self.speaker_identifier.start_session()
+        if session is not None:
+            session.update(features)
+        self.feature_stream.reset()
+        print(f"工作线程：预热完成，用时 {time.perf_counter() - start:.2f} 秒")
+
+
+    def _process_audio_block(self, block):
+        # 在录音器的消费线程中调用：提取新的特征帧并送入流式打分
+        frames = self.feature_stream.push(block)
+        session = self.scoring_session
+        if session is None or frames.size == 0 or session.decision is not None:
+            return
+        if session.update(frames) is not None:
+            self.progress.emit(f"已确认身份: {session.decision}，继续录音...")
 
 
     @Slot()
@@ -99,6 +202,9 @@ class Worker(QObject):
         self.progress.emit("开始录音...")
         print("工作线程：开始录音...")
         try:
+            self.feature_stream.reset()
+            self.scoring_session = self.speaker_identifier.start_session(self.early_decision_margin,
+                                                                         self.early_decision_min_frames)
             self.recorder.start_recording()
         except Exception as e:
             self.error_occurred.emit(f"启动录音失败: {e}")
@@ -131,18 +237,44 @@ class Worker(QObject):
                 print("工作线程：没有录制到有效音频数据。")
                 return
 
-            self.progress.emit("提取特征...")
-            print("工作线程：提取特征...")
-            features = extract_features(recorded_audio_data, recorded_samplerate)
+            hop_length = self.feature_stream.hop_length
+            n_recorded = len(recorded_audio_data)
+            start = 0
+            if self.endpointer is not None:
+                start, end = self.endpointer.speech_range(recorded_audio_data)
+                if end <= start:
+                    self.progress.emit("没有检测到语音。")
+                    print("工作线程：没有检测到语音。")
+                    return
+                start = start // hop_length * hop_length # 与特征帧对齐，流式特征可以直接截取
+                recorded_audio_data = recorded_audio_data[start:end]
+                print(f"工作线程：去掉首尾静音，保留 {start / self.samplerate:.2f}s - {end / self.samplerate:.2f}s"
+                      f" (共录音 {n_recorded / self.samplerate:.2f}s)")
+
+            session, self.scoring_session = self.scoring_session, None
+            if session is not None and session.decision is not None:
+                # 录音过程中已经提前判定，直接进入后续流程
+                recognition_result = session.decision
+                print(f"工作线程：使用提前判定的结果 ({session.n_frames} 帧)")
+            else:
+                self.progress.emit("提取特征...")
+                print("工作线程：提取特征...")
+                features = self.feature_stream.finish()
+                if features.size != 0 and len(features) == 1 + n_recorded // hop_length:
+                    first = start // hop_length
+                    features = features[first:first + 1 + len(recorded_audio_data) // hop_length]
+                else:
+                    # 流式特征不完整 (例如处理音频块出错) 时对语音部分重新提取
+                    features = self._extract_features(recorded_audio_data, recorded_samplerate)
 
-            if features.size == 0:
-                self.progress.emit("特征提取失败。")
-                print("工作线程：特征提取失败。")
-                return
+                if features.size == 0:
+                    self.progress.emit("特征提取失败。")
+                    print("工作线程：特征提取失败。")
+                    return
 
-            self.progress.emit("进行声纹识别...")
-            print("工作线程：进行声纹识别...")
-            recognition_result = self.speaker_identifier.identify_speaker(features)
+                self.progress.emit("进行声纹识别...")
+                print("工作线程：进行声纹识别...")
+                recognition_result = self.speaker_identifier.identify_speaker(features)
             self.speaker_identified.emit(recognition_result)
             # self.progress.emit(f"声纹识别结果: {recognition_result}") # 这条信息由 speaker_identified 信号处理
 
@@ -196,7 +328,7 @@ class Worker(QObject):
                                 tts_audio_np = np.frombuffer(tts_audio_bytes, dtype=np.int16).astype(np.float32) / 32767.0
                                 self.progress.emit("播放回答语音...")
                                 print("工作线程：播放回答语音...")
-                                play_audio(tts_audio_np, self.samplerate)
+                                self._play_audio(tts_audio_np, self.samplerate)
                                 self.progress.emit("播放完成。")
                                 print("工作线程：播放完成。")
                             except Exception as e:
@@ -231,7 +363,7 @@ class VoiceInteractionGUI(QMainWindow):
 
     start_processing_signal = Signal() #启动处理 (开始录音)
     stop_processing_signal = Signal() # 停止录音并处理
-    quit_worker_signal = Signal() # GUI 发送信号请求 worker 的 run 方法退出循环 (如果run中有循环)
+    quit_worker_signal = Signal() # GUI 发送信号请求工作线程退出事件循环
 
 
     def __init__(self):
@@ -246,9 +378,10 @@ class VoiceInteractionGUI(QMainWindow):
         central_widget.setLayout(layout)
 
         self.record_button = QPushButton("开始录音")
+        self.record_button.setEnabled(False) # 工作线程初始化完成后启用
         layout.addWidget(self.record_button)
 
-        self.status_label = QLabel("准备就绪")
+        self.status_label = QLabel("正在启动...")
         self.status_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.status_label)
 
@@ -267,7 +400,18 @@ class VoiceInteractionGUI(QMainWindow):
             identification_threshold=IDENTIFICATION_THRESHOLD,
             baidu_api_key=ASR_TTS_API_KEY,
             baidu_secret_key=ASR_TTS_SECRET_KEY,
-            llm_api_key=LLM_API_KEY
+            llm_api_key=LLM_API_KEY,
+            model_bank_file=MODEL_BANK_FILE,
+            top_c=TOP_C,
+            snorm_file=SNORM_FILE,
+            snorm_threshold=SNORM_THRESHOLD,
+            model_watch_interval=MODEL_WATCH_INTERVAL,
+            early_decision_margin=EARLY_DECISION_MARGIN,
+            early_decision_min_frames=EARLY_DECISION_MIN_FRAMES,
+            max_recording_seconds=MAX_RECORDING_SECONDS,
+            endpoint_silence_seconds=ENDPOINT_SILENCE_SECONDS,
+            vad_threshold_db=VAD_THRESHOLD_DB,
+            ready_retry_seconds=READY_RETRY_SECONDS
         )
         self.worker.moveToThread(self.worker_thread)
 
@@ -281,6 +425,8 @@ class VoiceInteractionGUI(QMainWindow):
         self.worker.asr_recognized.connect(self.display_asr_result)
         self.worker.error_occurred.connect(self.display_error)
         self.worker.welcome_user.connect(self.display_welcome_message) # **新增连接：处理欢迎信息信号**
+        self.worker.speech_ended.connect(self.on_speech_ended) # 端点检测自动停止录音
+        self.worker.ready.connect(self.on_worker_ready)
 
 
         # 连接 worker 任务流程结束信号，用于重置 GUI 状态
@@ -290,11 +436,11 @@ class VoiceInteractionGUI(QMainWindow):
         self.start_processing_signal.connect(self.worker.start_voice_processing)
         self.stop_processing_signal.connect(self.worker.stop_recording_task)
         self.quit_worker_signal.connect(self.worker_thread.quit)
+        self.worker_thread.started.connect(self.worker.initialize) # 在工作线程中加载模型和预热
 
 
-        # 启动工作线程 (线程在后台进入事件循环，等待信号)
+        # 启动工作线程 (线程在后台进入事件循环，先执行 initialize，之后等待信号)
         self.worker_thread.start()
-        # 在 Worker 的 run 方法进入事件循环后，它就会停在那里等待信号
 
 
     @Slot()
@@ -310,7 +456,8 @@ class VoiceInteractionGUI(QMainWindow):
             self.status_label.setText("准备录音...")
             self.info_text_edit.clear()
             self.info_text_edit.append("请开始说话...")
-            self.info_text_edit.append("点击停止按钮结束录音...")
+            self.info_text_edit.append("点击停止按钮结束录音..." if ENDPOINT_SILENCE_SECONDS is None
+                                       else "说完后稍作停顿会自动结束录音，也可以点击停止按钮...")
 
             # 发送信号给 worker 启动录音
             self.start_processing_signal.emit()
@@ -323,6 +470,21 @@ class VoiceInteractionGUI(QMainWindow):
             self.stop_processing_signal.emit()
 
 
+    @Slot(float)
+    def on_worker_ready(self, elapsed):
+        self.record_button.setEnabled(True)
+        self.status_label.setText("准备就绪")
+        self.info_text_edit.append(f"启动完成，用时 {elapsed:.2f} 秒。")
+
+
+    @Slot()
+    def on_speech_ended(self):
+        # 与点击停止按钮相同；已经手动停止时忽略
+        if self.is_processing and self.worker._is_recording_active:
+            self.info_text_edit.append("检测到说话结束，自动停止录音。")
+            self.manage_processing_flow()
+
+
     @Slot(str)
     def update_status(self, message):
         self.status_label.setText(message)
@@ -372,6 +534,13 @@ class VoiceInteractionGUI(QMainWindow):
             if not self.worker_thread.wait(3000):
                  print("工作线程未在规定时间内退出。")
 
+        # 释放工作线程创建的资源：停止模型文件监视线程和 Token 后台刷新，关闭 HTTP 长连接
+        if self.worker:
+            if self.worker.speaker_identifier is not None:
+                self.worker.speaker_identifier.stop_watching()
+            if self.worker.baidu_client is not None:
+                self.worker.baidu_client.close()
+
         print("主应用关闭。")
         super().closeEvent(event)
 
@@ -384,5 +553,6 @@ if __name__ == "__main__":
 
     window = VoiceInteractionGUI()
     window.show()
+    print(f"界面已显示，用时 {time.perf_counter() - APP_START:.2f} 秒，模型在后台加载")
 
     sys.exit(app.exec())
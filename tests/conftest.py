@@ -0,0 +1,9 @@
+import os
+import sys
+
+# GMM_UBM 和 audio 下的模块以脚本目录为根互相导入, 测试时把两个目录加入 sys.path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for sub in ('GMM_UBM', 'audio'):
+    path = os.path.join(ROOT, sub)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sounddevice')
+from _1audio_utils import AudioRingBuffer
+
+
+def blocks(total, channels, rng):
+    # 长短不一的音频块, 包括长于缓冲区容量的块
+    written = 0
+    while written < total:
+        n = int(rng.choice([1, 7, 64, 300, 1000]))
+        yield rng.normal(size=(n, channels)).astype(np.float32)
+        written += n
+
+
+@pytest.mark.parametrize('max_frames', [None, 1, 256, 1000])
+def test_ring_buffer_keeps_latest_frames(max_frames):
+    rng = np.random.default_rng(0)
+    buf = AudioRingBuffer(channels=2, initial_frames=16, max_frames=max_frames)
+    recorded = np.empty((0, 2), dtype=np.float32)
+    for block in blocks(5000, 2, rng):
+        out = buf.write(block)
+        recorded = np.concatenate([recorded, block])
+        keep = len(recorded) if max_frames is None else min(len(recorded), max_frames)
+        # 写入返回的视图是这一块 (超过容量时只保留最后 max_frames 帧)
+        np.testing.assert_array_equal(out, block[-keep:])
+        np.testing.assert_array_equal(buf.view(), recorded[len(recorded) - keep:])
+        assert len(buf) == keep
+        assert buf.dropped_frames == len(recorded) - keep
+        assert buf.frames_written == len(recorded)
+
+
+def test_ring_buffer_clear():
+    buf = AudioRingBuffer(channels=1, initial_frames=4, max_frames=8)
+    buf.write(np.arange(20, dtype=np.float32)[:, np.newaxis])
+    buf.clear()
+    assert len(buf) == 0 and buf.view().shape == (0, 1)
+    buf.write(np.ones((3, 1), dtype=np.float32))
+    np.testing.assert_array_equal(buf.view(), np.ones((3, 1)))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from eval_metrics import compute_eer_dcf, det_sweep
+from eval_score import compute_eer
+
+
+def random_trials(rng, n, rounded):
+    labels = rng.integers(0, 2, n)
+    labels[:2] = [0, 1]
+    scores = rng.normal(size=n) + labels * rng.uniform(0, 3)
+    if rounded:
+        # 大量相同得分
+        scores = np.round(scores, 1)
+    return scores, labels
+
+
+@pytest.mark.parametrize('rounded', [False, True])
+def test_eer_matches_compute_eer(rounded):
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        scores, labels = random_trials(rng, int(rng.integers(5, 400)), rounded)
+        eer, threshold, _, _ = compute_eer_dcf(scores, labels)
+        ref_eer, ref_threshold = compute_eer(labels, scores)
+        assert eer == ref_eer
+        assert threshold == ref_threshold
+
+
+def test_min_dcf_matches_threshold_loop():
+    rng = np.random.default_rng(1)
+    scores, labels = random_trials(rng, 500, True)
+    p_target = 0.05
+    _, _, min_dcf, _ = compute_eer_dcf(scores, labels, p_target=p_target)
+    best = np.inf
+    for t in np.r_[np.inf, np.unique(scores)]:
+        p_miss = np.mean(scores[labels == 1] < t)
+        p_fa = np.mean(scores[labels == 0] >= t)
+        best = min(best, (p_target * p_miss + (1 - p_target) * p_fa) / p_target)
+    assert min_dcf == pytest.approx(best, rel=1e-12)
+
+
+def test_det_sweep_endpoints():
+    rng = np.random.default_rng(2)
+    scores, labels = random_trials(rng, 100, False)
+    thresholds, p_fa, p_miss = det_sweep(scores, labels)
+    assert (thresholds[0], p_fa[0], p_miss[0]) == (np.inf, 0.0, 1.0)
+    assert p_fa[-1] == 1.0 and p_miss[-1] == 0.0
+    assert np.all(np.diff(p_fa) >= 0) and np.all(np.diff(p_miss) <= 0)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from sklearn.mixture import GaussianMixture
+from gmm_score import PreparedGMM, SpeakerBatch, ubm_top_c, top_c_llr
+from train_spk_model import GMM_MAP
+
+N_SPK, M, D = 5, 8, 4
+
+
+@pytest.fixture(scope='module')
+def models():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, D)) * rng.uniform(0.5, 2.0, size=D)
+    ubm = GaussianMixture(n_components=M, covariance_type='diag', random_state=0).fit(X)
+    spk_data = [rng.normal(rng.normal(size=D), 1.0, size=(300, D)) for _ in range(N_SPK)]
+    test = rng.normal(size=(120, D))
+    return ubm, spk_data, test
+
+
+def batch_and_models(ubm, spk_data, adapt):
+    spks = [GMM_MAP(ubm, data, adapt=adapt) for data in spk_data]
+    speakers = ['spk%d' % i for i in range(len(spks))]
+    if adapt == 'm':
+        # 只自适应均值: 权重和精度只传 UBM 的一份
+        batch = SpeakerBatch(speakers, ubm.weights_, np.stack([s.means_ for s in spks]),
+                             1.0 / ubm.covariances_, max_elements=2 * 120 * M)
+    else:
+        batch = SpeakerBatch(speakers, np.stack([s.weights_ for s in spks]), np.stack([s.means_ for s in spks]),
+                             1.0 / np.stack([s.covariances_ for s in spks]), max_elements=2 * 120 * M)
+    return batch, spks
+
+
+@pytest.mark.parametrize('adapt', ['m', 'mwv'])
+def test_batch_llr_matches_per_model_score(models, adapt):
+    ubm, spk_data, X = models
+    batch, spks = batch_and_models(ubm, spk_data, adapt)
+    prepared_ubm = PreparedGMM.from_covars(ubm.weights_, ubm.means_, ubm.covariances_)
+    ref = np.array([PreparedGMM.from_covars(s.weights_, s.means_, s.covariances_).score(X) - prepared_ubm.score(X)
+                    for s in spks])
+    np.testing.assert_allclose(batch.llr(prepared_ubm, X), ref, rtol=1e-10, atol=1e-10)
+    # 也与 sklearn 的打分一致
+    np.testing.assert_allclose(ref, [s.score(X) - ubm.score(X) for s in spks], rtol=1e-8, atol=1e-8)
+
+
+@pytest.mark.parametrize('adapt', ['m', 'mwv'])
+def test_batch_top_c_matches_per_model(models, adapt):
+    ubm, spk_data, X = models
+    batch, spks = batch_and_models(ubm, spk_data, adapt)
+    prepared_ubm = PreparedGMM.from_covars(ubm.weights_, ubm.means_, ubm.covariances_)
+    idx, ubm_frame_llk = ubm_top_c(prepared_ubm, X, 3)
+    ref = [top_c_llr(PreparedGMM.from_covars(s.weights_, s.means_, s.covariances_), X, idx, ubm_frame_llk)
+           for s in spks]
+    np.testing.assert_allclose(batch.llr(prepared_ubm, X, top_c=3), ref, rtol=1e-10, atol=1e-10)
+
+
+def test_top_k_order(models):
+    ubm, spk_data, X = models
+    batch, _ = batch_and_models(ubm, spk_data, 'm')
+    scores = np.array([0.5, 2.0, -1.0, 2.0, 1.0])
+    assert batch.top_k(scores, 3) == [('spk1', 2.0), ('spk3', 2.0), ('spk4', 1.0)]
+    assert [s for s, _ in batch.top_k(scores, 10)] == ['spk1', 'spk3', 'spk4', 'spk0', 'spk2']
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from fea_cache import MFCC_PARAMS
+from mfcc import MFCCEngine
+
+librosa = pytest.importorskip('librosa')
+
+
+def synthetic_wav(seconds, sr=16000, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t)) + 0.05 * rng.normal(size=len(t))
+    return y.astype(np.float32)
+
+
+def librosa_features(y, sr):
+    # 原 feature_extract.py 中的 librosa 流程 [3*n_mfcc x T]
+    raw_mfcc = librosa.util.normalize(librosa.feature.mfcc(y=y, sr=sr, **MFCC_PARAMS))
+    return np.concatenate([raw_mfcc,
+                           librosa.feature.delta(raw_mfcc),
+                           librosa.feature.delta(raw_mfcc, order=2)], axis=0)
+
+
+@pytest.mark.parametrize('seconds', [0.1, 1.3])
+def test_engine_matches_librosa(seconds):
+    sr = 16000
+    y = synthetic_wav(seconds, sr)
+    fea = MFCCEngine.get(sr, **MFCC_PARAMS).extract(y)
+    ref = librosa_features(y, sr)
+    assert fea.shape == ref.T.shape
+    np.testing.assert_allclose(fea, ref.T, atol=1e-5)
+
+
+def test_engine_energy_is_mean_log_mel():
+    sr = 16000
+    y = synthetic_wav(0.5, sr, seed=1)
+    engine = MFCCEngine.get(sr, **MFCC_PARAMS)
+    _, energy = engine.extract(y, return_energy=True)
+    log_mel = np.maximum(engine.log_mel(y), engine.log_mel(y).max() - engine.top_db)
+    np.testing.assert_allclose(energy, log_mel.mean(axis=1), rtol=1e-4, atol=1e-3)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from _2feature_extractor import StreamingFeatureExtractor, extract_features
+
+
+def synthetic_recording(seconds, sr=16000, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.2 * np.sin(2 * np.pi * 180 * t) * (t > 0.3) + 0.02 * rng.normal(size=len(t))
+    # 录音回调得到的 int16 数据
+    return np.round(y * 32767).astype(np.int16)
+
+
+@pytest.mark.parametrize('blocksize', [1, 100, 1024, 4000])
+def test_streaming_matches_offline(blocksize):
+    sr = 16000
+    audio = synthetic_recording(1.0 if blocksize > 1 else 0.2, sr)
+    offline = extract_features(audio, sr)
+
+    extractor = StreamingFeatureExtractor(sr)
+    pushed = [extractor.push(audio[i:i + blocksize, np.newaxis]) for i in range(0, len(audio), blocksize)]
+    final = extractor.finish()
+    np.testing.assert_allclose(final, offline, rtol=1e-6, atol=1e-6)
+
+    # push() 输出的帧除了 top_db 截断用的是当时的最大值外与最终结果相同, 这段录音的最大值在开头之后出现
+    pushed = np.concatenate(pushed, axis=0)
+    assert 0 < len(pushed) <= len(final) - extractor.delta_width // 2
+    tail = slice(len(pushed) // 2, len(pushed))
+    np.testing.assert_allclose(pushed[tail], final[tail], rtol=1e-5, atol=1e-5)
+
+
+def test_streaming_reset_and_short_input():
+    sr = 16000
+    extractor = StreamingFeatureExtractor(sr)
+    extractor.push(np.zeros(400, dtype=np.int16))
+    assert extractor.finish().size == 0
+    with pytest.raises(RuntimeError):
+        extractor.push(np.zeros(10, dtype=np.int16))
+    extractor.reset()
+    audio = synthetic_recording(0.5, sr, seed=1)
+    extractor.push(audio)
+    np.testing.assert_allclose(extractor.finish(), extract_features(audio, sr), rtol=1e-6, atol=1e-6)
@@ -0,0 +1,39 @@
+import os
+import numpy as np
+from ubm_em import FrameChunks, e_step
+from ubm_shard import ShardedEStep, check_sharded_estep
+from fea_archive import open_features
+
+
+def write_features(fea_path, n_utts=6, dim=5, seed=0):
+    # 逐句 .npy 特征目录, 每句保存为 [特征维度 x T]
+    rng = np.random.default_rng(seed)
+    os.makedirs(fea_path)
+    keys = []
+    for i in range(n_utts):
+        key = 'spk%d_utt%d' % (i % 2, i)
+        frames = rng.normal(i % 3, 1.0, size=(int(rng.integers(50, 300)), dim)).astype(np.float32)
+        np.save(os.path.join(fea_path, key + '.npy'), frames.T)
+        keys.append(key)
+    return keys
+
+
+def test_sharded_estep_matches_serial(tmp_path):
+    fea_path = str(tmp_path / 'fea')
+    keys = write_features(fea_path)
+    chunks = FrameChunks(open_features(fea_path), keys, chunk_frames=128)
+    estep = ShardedEStep(chunks, fea_path, n_shards=3, work_dir=str(tmp_path / 'work'), n_workers=2)
+    try:
+        check_sharded_estep(chunks, estep, n_mix=4)
+
+        rng = np.random.default_rng(1)
+        weights = np.full(3, 1.0 / 3)
+        means = rng.normal(size=(3, 5))
+        covars = rng.uniform(0.5, 2.0, size=(3, 5))
+        ref = e_step(chunks, weights, means, covars)
+        sharded = estep(chunks, weights, means, covars)
+    finally:
+        estep.close()
+    for a, b in zip(ref, sharded):
+        np.testing.assert_allclose(b, a, rtol=1e-9)
+    assert sorted(os.listdir(str(tmp_path / 'work'))) == ['shards.json']
@@ -0,0 +1,12 @@
+import numpy as np
+from sklearn.mixture import GaussianMixture
+from bw_stats import loop_stats, ubm_stats
+
+
+def test_ubm_stats_matches_loop():
+    rng = np.random.default_rng(0)
+    X = np.concatenate([rng.normal(loc, 1.0, size=(200, 6)) for loc in (-2, 0, 3)])
+    ubm = GaussianMixture(n_components=4, covariance_type='diag', random_state=0).fit(X)
+    data = rng.normal(size=(150, 6)).astype(np.float32)
+    for a, b in zip(loop_stats(ubm, data), ubm_stats(ubm, data)):
+        np.testing.assert_allclose(b, a, rtol=1e-10, atol=1e-12)